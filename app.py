@@ -1,16 +1,40 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import APIRouter, FastAPI
 
+from archive import run_archiver
+from events import note_event_broker
+from handlers.attachments import attachments_router
 from handlers.auth import auth_router
+from handlers.debug import debug_router
+from handlers.metrics import metrics_router
 from handlers.notes import notes_router
-from utils import create_db_and_tables
+from metrics import MetricsMiddleware, listen_query_events
+from passwords import shutdown_password_executor
+from settings import settings
+from tracing import QueryTraceMiddleware
+from utils import create_db_and_tables, warm_up_pools
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
+    if settings.DB_SCHEMA_CHECK:
+        create_db_and_tables()
+    if settings.DB_POOL_WARMUP:
+        await warm_up_pools(settings.DB_POOL_WARMUP)
+    archiver = None
+    if settings.NOTES_ARCHIVE_INTERVAL:
+        archiver = asyncio.create_task(
+            run_archiver(settings.NOTES_ARCHIVE_INTERVAL)
+        )
     yield
+    if archiver is not None:
+        archiver.cancel()
+        with suppress(asyncio.CancelledError):
+            await archiver
+    await note_event_broker.close()
+    shutdown_password_executor()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -19,5 +43,16 @@ api_router = APIRouter(prefix='/api')
 
 api_router.include_router(auth_router)
 api_router.include_router(notes_router)
+api_router.include_router(attachments_router)
+api_router.include_router(debug_router)
 
 app.include_router(api_router)
+
+if settings.METRICS_ENABLED:
+    listen_query_events()
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_router)
+
+# Снаружи метрик: EXPLAIN после ответа не попадает в статистику запроса.
+# Включается в рантайме, без трассы стоит одной проверки настройки
+app.add_middleware(QueryTraceMiddleware)
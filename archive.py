@@ -0,0 +1,166 @@
+# Перенос давно удаленных заметок из note в note_archive.
+#
+# Запускается фоновой задачей приложения (см. app.lifespan) или вручную
+# из корня проекта: python -m archive
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import DateTime, literal
+from sqlmodel import delete, func, insert, select, true
+
+from cache import response_cache
+from models import ArchivedNote, Note, invalidate_note_cache
+from search import index_notes, search_values, unindex_notes
+from settings import settings
+from utils import create_async_session, shards
+
+logger = logging.getLogger(__name__)
+
+
+async def archive_deleted_notes(session, retention=None, batch_size=None):
+    if retention is None:
+        retention = settings.NOTES_ARCHIVE_RETENTION
+    batch_size = batch_size or settings.NOTES_ARCHIVE_BATCH_SIZE
+    deleted_before = datetime.now(timezone.utc) - timedelta(seconds=retention)
+    note_filters = [
+        Note.is_deleted == true(),
+        Note.deleted_at < deleted_before,
+        # SQLite без AUTOINCREMENT выдает новой строке max(id) + 1.
+        # Последнюю заметку не трогаем, чтобы ее id не достался новой
+        # заметке и архивную можно было восстановить
+        Note.id < select(func.max(Note.id)).scalar_subquery(),
+    ]
+    archived = 0
+    while True:
+        # Каждая пачка - отдельная транзакция, блокировки держатся недолго
+        result = await session.exec(
+            select(Note.id).filter(*note_filters).order_by(Note.id).limit(
+                batch_size
+            ).with_for_update(skip_locked=True)
+        )
+        note_ids = result.all()
+        if not note_ids:
+            break
+        await session.exec(
+            insert(ArchivedNote).from_select(
+                [
+                    'id', 'title', 'body', 'revision', 'deleted_at',
+                    'user_id', 'archived_at'
+                ],
+                select(
+                    Note.id,
+                    Note.title,
+                    Note.body,
+                    Note.revision,
+                    Note.deleted_at,
+                    Note.user_id,
+                    literal(
+                        datetime.now(timezone.utc), DateTime(timezone=True)
+                    )
+                ).filter(Note.id.in_(note_ids))
+            )
+        )
+        await session.exec(
+            delete(Note).filter(Note.id.in_(note_ids)).execution_options(
+                synchronize_session=False, note_cache_invalidation='manual'
+            )
+        )
+        await unindex_notes(session, note_ids)
+        # Удаленные заметки видны только админам
+        invalidate_note_cache(session, {response_cache.ADMIN_SCOPE})
+        await session.commit()
+        archived += len(note_ids)
+        if len(note_ids) < batch_size:
+            break
+    return archived
+
+
+async def restore_archived_notes(session, note_ids):
+    # Возвращает заметки из архива в note под прежними id. Изменения
+    # не фиксируются, коммит делает вызывающий код. Строки читаются
+    # в приложение: поисковый вектор PostgreSQL считается по тексту
+    # заметки в том же INSERT
+    result = await session.exec(
+        select(
+            ArchivedNote.id,
+            ArchivedNote.title,
+            ArchivedNote.body,
+            ArchivedNote.revision,
+            ArchivedNote.user_id
+        ).filter(ArchivedNote.id.in_(note_ids))
+    )
+    archived = result.all()
+    if not archived:
+        return archived
+    dialect = session.bind.dialect.name
+    result = await session.exec(
+        insert(Note).values([
+            {
+                **note._asdict(),
+                'revision': note.revision + 1,
+                **search_values(dialect, note.title, note.body),
+            }
+            for note in archived
+        ]).returning(
+            Note.id, Note.title, Note.body, Note.user_id, Note.revision
+        ).execution_options(note_cache_invalidation='manual')
+    )
+    notes = result.all()
+    await session.exec(
+        delete(ArchivedNote).filter(
+            ArchivedNote.id.in_([note.id for note in notes])
+        )
+    )
+    await index_notes(
+        session, [(note.id, note.title, note.body) for note in notes]
+    )
+    invalidate_note_cache(
+        session,
+        response_cache.get_owner_scopes({note.user_id for note in notes})
+    )
+    return notes
+
+
+async def archive_all_shards(retention=None, batch_size=None):
+    archived = 0
+    for shard in range(len(shards)):
+        async with create_async_session(shards.get_engine(shard)) as session:
+            archived += await archive_deleted_notes(
+                session, retention, batch_size
+            )
+    return archived
+
+
+async def run_archiver(interval):
+    while True:
+        try:
+            archived = await archive_all_shards()
+            if archived:
+                logger.info('Archived %d deleted notes', archived)
+        except Exception:
+            logger.exception('Failed to archive deleted notes')
+        await asyncio.sleep(interval)
+
+
+async def _main(retention, batch_size):
+    archived = await archive_all_shards(retention, batch_size)
+    print(f'Archived {archived} deleted notes')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--retention', type=int, default=settings.NOTES_ARCHIVE_RETENTION,
+        help='Сколько секунд хранить удаленные заметки в note'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=settings.NOTES_ARCHIVE_BATCH_SIZE
+    )
+    args = parser.parse_args()
+    asyncio.run(_main(args.retention, args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
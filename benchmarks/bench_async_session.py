@@ -0,0 +1,95 @@
+# Сравнение пропускной способности при конкурентных запросах:
+# блокирующая Session внутри async def (как было) против AsyncSession.
+#
+# Запуск из корня проекта: python -m benchmarks.bench_async_session
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import event, text
+
+# Запрос, который ждет ответа "сервера" БД. В SQLite задержку сети и
+# выполнения запроса имитирует функция sleep(), отпускающая GIL.
+SLOW_QUERY = text('SELECT sleep(:seconds)')
+
+
+def _add_sleep_function(dbapi_connection, connection_record):
+    def sleep(seconds):
+        time.sleep(seconds)
+        return seconds
+
+    dbapi_connection.create_function('sleep', 1, sleep)
+
+
+def build_app(latency):
+    from utils import (AsyncSessionDep, SessionDep, _get_async_engine,
+                       _get_engine)
+
+    event.listen(_get_engine(), 'connect', _add_sleep_function)
+    event.listen(
+        _get_async_engine().sync_engine, 'connect', _add_sleep_function
+    )
+    params = {'seconds': latency}
+
+    app = FastAPI()
+
+    @app.get('/sync')
+    async def sync_endpoint(session: SessionDep):
+        return session.exec(SLOW_QUERY, params=params).scalar()
+
+    @app.get('/async')
+    async def async_endpoint(session: AsyncSessionDep):
+        result = await session.exec(SLOW_QUERY, params=params)
+        return result.scalar()
+
+    return app
+
+
+async def run(app, path, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url='http://test') as c:
+        async def one():
+            async with semaphore:
+                response = await c.get(path)
+                response.raise_for_status()
+
+        # Прогрев пула
+        await asyncio.gather(*(one() for _ in range(concurrency)))
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument(
+        '--latency', type=float, default=0.02,
+        help='Время ответа БД на один запрос, секунды'
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault(
+            'DB_URL', f'sqlite:///{os.path.join(tmp, "bench.sqlite3")}'
+        )
+        app = build_app(args.latency)
+        for path in ('/sync', '/async'):
+            elapsed = asyncio.run(
+                run(app, path, args.requests, args.concurrency)
+            )
+            print(
+                f'{path:7} {args.requests} requests, '
+                f'concurrency {args.concurrency}: {elapsed:.2f}s, '
+                f'{args.requests / elapsed:.1f} req/s'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# Стоимость одной операции: по одному запросу на заметку против
+# пакетных эндпоинтов /api/notes/batch*.
+#
+# Запуск из корня проекта: python -m benchmarks.bench_batch
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import event
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self)
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+async def measure(counter, coro_factory):
+    counter.count = 0
+    start = time.perf_counter()
+    await coro_factory()
+    return time.perf_counter() - start, counter.count
+
+
+async def run(sizes):
+    from sqlmodel import Session
+
+    from app import app
+    from models import User
+    from utils import (_get_async_engine, _get_engine, create_db_and_tables,
+                       get_subject)
+
+    create_db_and_tables()
+    with Session(_get_engine()) as session:
+        user = User(
+            username='bench', email='bench@test.com', password='bench'
+        )
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+        headers = {'Authorization': f'Bearer {get_subject(user)}'}
+
+    counter = StatementCounter(_get_async_engine().sync_engine)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(
+        transport=transport, base_url='http://test', headers=headers
+    ) as client:
+        async def create_single(size):
+            ids = []
+            for i in range(size):
+                response = await client.post(
+                    '/api/notes/', data={'title': f't{i}', 'body': 'b' * 512}
+                )
+                ids.append(response.json()['id'])
+            return ids
+
+        async def create_batch(size):
+            notes = [{'title': f't{i}', 'body': 'b' * 512}
+                     for i in range(size)]
+            response = await client.post(
+                '/api/notes/batch', json={'notes': notes}
+            )
+            return [note['id'] for note in response.json()]
+
+        async def delete_single(ids):
+            for note_id in ids:
+                await client.delete(f'/api/notes/{note_id}')
+
+        async def delete_batch(ids):
+            await client.post('/api/notes/batch/delete', json={'ids': ids})
+
+        await create_batch(10)
+        for size in sizes:
+            results = {}
+            ids = {}
+
+            async def single_create():
+                ids['single'] = await create_single(size)
+
+            async def batch_create():
+                ids['batch'] = await create_batch(size)
+
+            results['create single'] = await measure(counter, single_create)
+            results['create batch'] = await measure(counter, batch_create)
+            results['delete single'] = await measure(
+                counter, lambda: delete_single(ids['single'])
+            )
+            results['delete batch'] = await measure(
+                counter, lambda: delete_batch(ids['batch'])
+            )
+            for name, (elapsed, statements) in results.items():
+                print(
+                    f'N={size:<5} {name:14} total {elapsed * 1000:8.1f}ms, '
+                    f'per item {elapsed / size * 1000:7.3f}ms, '
+                    f'SQL statements {statements}'
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault(
+            'DB_URL', f'sqlite:///{os.path.join(tmp, "bench.sqlite3")}'
+        )
+        asyncio.run(run(args.sizes))
+
+
+if __name__ == '__main__':
+    main()
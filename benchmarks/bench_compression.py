@@ -0,0 +1,56 @@
+# Экономия места и стоимость распаковки для сжатых тел заметок.
+#
+# Запуск из корня проекта: python -m benchmarks.bench_compression
+import argparse
+import time
+
+from benchmarks.datagen import generate_bodies
+from compressed import compress_text, decompress_text, zstandard
+from settings import settings
+
+
+def measure(bodies, algorithm, level):
+    settings.NOTE_BODY_COMPRESSION_LEVEL = level
+    start = time.perf_counter()
+    stored = [compress_text(body, algorithm=algorithm) for body in bodies]
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for value in stored:
+        decompress_text(value)
+    decode_time = time.perf_counter() - start
+    return (
+        sum(len(value) for value in stored),
+        encode_time,
+        decode_time,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    bodies = generate_bodies(args.count, args.seed)
+    raw_size = sum(len(body.encode()) for body in bodies)
+    print(
+        f'{len(bodies)} bodies, {raw_size / 1024 / 1024:.1f} MiB raw, '
+        f'threshold {settings.NOTE_BODY_COMPRESSION_THRESHOLD} chars'
+    )
+    variants = [('none', 0), ('zlib', 1), ('zlib', 6), ('zlib', 9)]
+    if zstandard is not None:
+        variants += [('zstd', 3), ('zstd', 10)]
+    for algorithm, level in variants:
+        stored_size, encode_time, decode_time = measure(
+            bodies, algorithm, level
+        )
+        print(
+            f'{algorithm:4} level {level}: '
+            f'stored {stored_size / raw_size:6.1%} of raw, '
+            f'write {encode_time / len(bodies) * 1e6:7.1f}us/body, '
+            f'read {decode_time / len(bodies) * 1e6:7.1f}us/body'
+        )
+
+
+if __name__ == '__main__':
+    main()
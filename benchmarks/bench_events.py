@@ -0,0 +1,133 @@
+# Стоимость простаивающих подключений к потоку событий заметок и время
+# доставки одного изменения всем подключениям: память воркера на
+# подключение и время от отправки записи до получения события всеми
+# подключениями (клиент в том же процессе тоже занимает CPU).
+#
+# Запуск из корня проекта: python -m benchmarks.bench_events
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+def _prepare_db():
+    from sqlmodel import Session
+
+    from models import User
+    from utils import _get_engine, create_db_and_tables, get_subject
+
+    create_db_and_tables()
+    with Session(_get_engine()) as session:
+        user = User(username='bench', email='bench@test.com', password='pw')
+        session.add(user)
+        session.commit()
+        return {'Authorization': f'Bearer {get_subject(user)}'}
+
+
+def _get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get_rss(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+async def _wait_for_event(response):
+    async for line in response.aiter_lines():
+        if line.startswith('event: note'):
+            return time.perf_counter()
+
+
+async def run(base_url, headers, connections, pid):
+    limits = httpx.Limits(max_connections=connections + 10)
+    timeout = httpx.Timeout(60)
+    async with httpx.AsyncClient(
+        base_url=base_url, headers=headers, limits=limits, timeout=timeout
+    ) as client:
+        await client.get('/api/notes/')
+        rss_before = _get_rss(pid)
+        streams = []
+        for _ in range(connections):
+            response = await client.send(
+                client.build_request('GET', '/api/notes/events'),
+                stream=True
+            )
+            response.raise_for_status()
+            streams.append(response)
+        # Подключения простаивают, пока сервер не раздаст их по очередям
+        await asyncio.sleep(1)
+        rss_after = _get_rss(pid)
+        waiters = [
+            asyncio.create_task(_wait_for_event(response))
+            for response in streams
+        ]
+        start = time.perf_counter()
+        response = await client.post(
+            '/api/notes/', data={'title': 'bench', 'body': 'bench'}
+        )
+        response.raise_for_status()
+        written = time.perf_counter()
+        received = await asyncio.gather(*waiters)
+        for response in streams:
+            await response.aclose()
+    print(
+        f'{connections} idle connections: '
+        f'{(rss_after - rss_before) / connections / 1024:.1f} KiB each, '
+        f'write {(written - start) * 1000:.1f}ms, event delivered to all '
+        f'{(max(received) - start) * 1000:.1f}ms after the write was sent'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault(
+            'DB_URL', f'sqlite:///{os.path.join(tmp, "bench.sqlite3")}'
+        )
+        os.environ['NOTES_ARCHIVE_INTERVAL'] = '0'
+        headers = _prepare_db()
+        port = _get_free_port()
+        process = subprocess.Popen(
+            [
+                sys.executable, '-m', 'uvicorn', 'app:app', '--host',
+                '127.0.0.1', '--port', str(port), '--log-level', 'warning',
+                '--backlog', str(args.connections * 2)
+            ]
+        )
+        base_url = f'http://127.0.0.1:{port}'
+        try:
+            start = time.perf_counter()
+            while True:
+                if time.perf_counter() - start > args.timeout:
+                    raise TimeoutError('uvicorn did not start')
+                try:
+                    httpx.get(base_url + '/api/notes/')
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.05)
+            asyncio.run(
+                run(base_url, headers, args.connections, process.pid)
+            )
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
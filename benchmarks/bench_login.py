@@ -0,0 +1,93 @@
+# Задержка легкого запроса во время всплеска входов: проверка пароля
+# в цикле событий (--inline, как было) против пула процессов.
+#
+# Запуск из корня проекта: python -m benchmarks.bench_login
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+
+async def run(logins, concurrency, inline):
+    from sqlmodel import Session
+
+    import passwords
+    from app import app
+    from models import User
+    from utils import _get_engine, create_db_and_tables, get_subject
+
+    if inline:
+        async def _run(func, *args):
+            return func(*args)
+        passwords._run = _run
+
+    create_db_and_tables()
+    with Session(_get_engine()) as session:
+        user = User(username='bench', email='bench@test.com', password='pw')
+        session.add(user)
+        session.commit()
+        headers = {'Authorization': f'Bearer {get_subject(user)}'}
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url='http://test') as c:
+        async def login():
+            response = await c.post(
+                '/api/auth/login', data={'username': 'bench', 'password': 'pw'}
+            )
+            response.raise_for_status()
+
+        # Прогрев пула процессов
+        await asyncio.gather(*(login() for _ in range(concurrency)))
+
+        semaphore = asyncio.Semaphore(concurrency)
+        done = asyncio.Event()
+        latencies = []
+
+        async def limited_login():
+            async with semaphore:
+                await login()
+
+        async def ping():
+            while not done.is_set():
+                start = time.perf_counter()
+                await c.get('/api/notes', headers=headers)
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.005)
+
+        pinger = asyncio.create_task(ping())
+        start = time.perf_counter()
+        await asyncio.gather(*(limited_login() for _ in range(logins)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await pinger
+    passwords.shutdown_password_executor()
+
+    latencies.sort()
+    mode = 'inline' if inline else 'pool'
+    print(
+        f'{mode:6} logins {logins / elapsed:6.1f}/s, '
+        f'GET /api/notes during burst: '
+        f'p50 {statistics.median(latencies) * 1000:7.1f}ms, '
+        f'max {latencies[-1] * 1000:7.1f}ms'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--inline', action='store_true')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault(
+            'DB_URL', f'sqlite:///{os.path.join(tmp, "bench.sqlite3")}'
+        )
+        asyncio.run(run(args.logins, args.concurrency, args.inline))
+
+
+if __name__ == '__main__':
+    main()
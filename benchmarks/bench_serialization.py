@@ -0,0 +1,107 @@
+# Сериализация списка заметок: модели pydantic на каждую строку против
+# JSON прямо из строк выборки (orjson или to_json из pydantic-core).
+#
+# Запуск из корня проекта: python -m benchmarks.bench_serialization
+import argparse
+import random
+import statistics
+import time
+from collections import namedtuple
+from typing import List
+
+from pydantic import TypeAdapter
+
+import serialization
+from benchmarks.datagen import generate_bodies, generate_text
+from handlers.notes import _get_list_items
+from schemes import NoteBodyMode, NoteListItemResponse
+from settings import settings
+
+Row = namedtuple('Row', ['id', 'title', 'user_id', 'body'])
+notes_list_adapter = TypeAdapter(List[NoteListItemResponse])
+
+
+def generate_rows(count, seed):
+    # Тела берутся из пула: 100k полных тел не поместились бы в память
+    rng = random.Random(seed)
+    bodies = generate_bodies(1000, seed)
+    return [
+        Row(
+            note_id,
+            generate_text(rng, rng.randint(5, 60)),
+            rng.randint(1, 1000),
+            bodies[note_id % len(bodies)]
+        )
+        for note_id in range(1, count + 1)
+    ]
+
+
+def pydantic_dump(rows, body_mode):
+    # Прежний путь: словарь на строку, валидация в модели, dump_json
+    items = []
+    for row in rows:
+        item = row._asdict()
+        if body_mode == NoteBodyMode.none:
+            del item['body']
+        elif body_mode == NoteBodyMode.preview:
+            item['body'] = item['body'][:settings.NOTE_PREVIEW_LENGTH]
+        items.append(item)
+    return notes_list_adapter.dump_json(
+        notes_list_adapter.validate_python(items), exclude_none=True
+    )
+
+
+def fast_dump(rows, body_mode):
+    return serialization.dumps(_get_list_items(rows, body_mode))
+
+
+def measure(fn, rows, body_mode, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        content = fn(rows, body_mode)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), content
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[1000, 10000, 100000]
+    )
+    parser.add_argument(
+        '--body', choices=[mode.value for mode in NoteBodyMode],
+        nargs='+', default=['full', 'preview', 'none']
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    orjson = serialization.orjson
+    variants = [('pydantic', pydantic_dump, orjson)]
+    if orjson is not None:
+        variants.append(('orjson', fast_dump, orjson))
+    variants.append(('pydantic-core', fast_dump, None))
+    for size in args.sizes:
+        rows = generate_rows(size, args.seed)
+        for body_mode in map(NoteBodyMode, args.body):
+            results = {}
+            for name, fn, module in variants:
+                serialization.orjson = module
+                results[name] = measure(fn, rows, body_mode, args.repeat)
+            serialization.orjson = orjson
+            base_time, base_content = results['pydantic']
+            for name, (elapsed, content) in results.items():
+                # Быстрый путь обязан давать те же байты
+                assert content == base_content, name
+                print(
+                    f'{size:>7} rows, body={body_mode.value:7} '
+                    f'{name:13}: {elapsed * 1000:8.1f}ms '
+                    f'{elapsed / size * 1e6:6.2f}us/row '
+                    f'x{base_time / elapsed:5.1f} '
+                    f'({len(content) / 1024 / 1024:.1f} MiB)'
+                )
+
+
+if __name__ == '__main__':
+    main()
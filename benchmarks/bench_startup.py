@@ -0,0 +1,124 @@
+# Время от запуска сервера до первого ответа с походом в БД и задержка
+# первых одновременных запросов: python -m launcher против
+# uvicorn --workers (каждый воркер заново импортирует приложение и
+# проверяет схему сам).
+#
+# Запуск из корня проекта: python -m benchmarks.bench_startup
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+COMMANDS = {
+    'launcher': [sys.executable, '-m', 'launcher'],
+    'uvicorn': [sys.executable, '-m', 'uvicorn', 'app:app'],
+}
+
+
+def _prepare_db():
+    from sqlmodel import Session
+
+    from models import User
+    from utils import _get_engine, create_db_and_tables, get_subject
+
+    create_db_and_tables()
+    with Session(_get_engine()) as session:
+        user = User(username='bench', email='bench@test.com', password='pw')
+        session.add(user)
+        session.commit()
+        return {'Authorization': f'Bearer {get_subject(user)}'}
+
+
+def _get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _burst(url, headers, concurrency):
+    async with httpx.AsyncClient(headers=headers) as client:
+        async def request():
+            start = time.perf_counter()
+            response = await client.get(url)
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        return await asyncio.gather(
+            *(request() for _ in range(concurrency))
+        )
+
+
+def measure(mode, workers, headers, concurrency, timeout):
+    port = _get_free_port()
+    url = f'http://127.0.0.1:{port}/api/notes/'
+    command = [
+        *COMMANDS[mode], '--host', '127.0.0.1', '--port', str(port),
+        '--workers', str(workers)
+    ]
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(headers=headers) as client:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f'{mode} did not start')
+                try:
+                    if client.get(url).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        first_response = time.perf_counter() - start
+        latencies = asyncio.run(_burst(url, headers, concurrency))
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+    return first_response, max(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault(
+            'DB_URL', f'sqlite:///{os.path.join(tmp, "bench.sqlite3")}'
+        )
+        os.environ['NOTES_ARCHIVE_INTERVAL'] = '0'
+        # launcher запускает несколько воркеров только с общими бэкендами:
+        # бенчмарк не отзывает токены, кеш ответов выключен у обоих режимов
+        os.environ['TOKEN_DENYLIST_URL'] = 'none://'
+        os.environ['RESPONSE_CACHE_URL'] = 'none://'
+        headers = _prepare_db()
+        for mode in COMMANDS:
+            results = [
+                measure(
+                    mode, args.workers, headers, args.concurrency,
+                    args.timeout
+                )
+                for _ in range(args.runs)
+            ]
+            first, burst = zip(*results)
+            print(
+                f'{mode:8} workers {args.workers}: first response '
+                f'{statistics.median(first) * 1000:7.1f}ms, '
+                f'max of first {args.concurrency} concurrent '
+                f'{statistics.median(burst) * 1000:7.1f}ms'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Количество SQL-запросов и время одного обращения к PUT, DELETE и
+# POST .../restore для заметок.
+#
+# Запуск из корня проекта: python -m benchmarks.bench_writes
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import event
+
+
+class StatementCounter:
+    # Считает запросы к БД (без COMMIT) и имитирует задержку сети на
+    # каждый из них
+    def __init__(self, engine, latency):
+        self.count = 0
+        self.latency = latency
+        event.listen(engine, 'before_cursor_execute', self)
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+async def run(size, latency):
+    from sqlmodel import Session
+
+    from app import app
+    from models import User
+    from utils import (_get_async_engine, _get_engine, create_db_and_tables,
+                       get_subject)
+
+    create_db_and_tables()
+    with Session(_get_engine()) as session:
+        user = User(
+            username='bench', email='bench@test.com', password='bench'
+        )
+        admin = User(
+            username='admin', email='admin@test.com', password='admin',
+            is_admin=True
+        )
+        session.add_all([user, admin])
+        session.commit()
+        user_headers = {'Authorization': f'Bearer {get_subject(user)}'}
+        admin_headers = {'Authorization': f'Bearer {get_subject(admin)}'}
+
+    counter = StatementCounter(_get_async_engine().sync_engine, latency)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(
+        transport=transport, base_url='http://test', headers=user_headers
+    ) as client:
+        response = await client.post('/api/notes/batch', json={'notes': [
+            {'title': f't{i}', 'body': 'b' * 512} for i in range(size)
+        ]})
+        ids = [note['id'] for note in response.json()]
+
+        operations = {
+            'update': lambda note_id: client.put(
+                f'/api/notes/{note_id}',
+                data={'title': f'new {note_id}', 'body': 'c' * 512}
+            ),
+            'delete': lambda note_id: client.delete(
+                f'/api/notes/{note_id}'
+            ),
+            'restore': lambda note_id: client.post(
+                f'/api/notes/{note_id}/restore', headers=admin_headers
+            ),
+        }
+        for name, operation in operations.items():
+            counter.count = 0
+            start = time.perf_counter()
+            for note_id in ids:
+                response = await operation(note_id)
+                response.raise_for_status()
+            elapsed = time.perf_counter() - start
+            print(
+                f'{name:8} {elapsed / size * 1000:7.3f}ms/request, '
+                f'SQL statements {counter.count / size:.1f}/request'
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=200)
+    parser.add_argument(
+        '--latency', type=float, default=0.001,
+        help='Задержка на один запрос к БД, секунды'
+    )
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault(
+            'DB_URL', f'sqlite:///{os.path.join(tmp, "bench.sqlite3")}'
+        )
+        asyncio.run(run(args.size, args.latency))
+
+
+if __name__ == '__main__':
+    main()
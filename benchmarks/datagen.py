@@ -0,0 +1,113 @@
+# Детерминированный генератор данных для бенчмарков: при одном и том же
+# seed получаются одни и те же пользователи, заметки и тела заметок.
+import random
+
+from sqlalchemy_utils import Password
+from sqlmodel import insert
+
+WORDS = (
+    'the of and to in is that it for on was with as be at by this had '
+    'not are but from or have an they which one you were her all she '
+    'there would their we him been has when who will more no if out so '
+    'заметка список задача встреча проект отчет идея купить позвонить '
+    'deadline meeting todo review release deploy database query index'
+).split()
+WORD_WEIGHTS = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+BENCH_PASSWORD = 'bench'
+
+
+def generate_text(rng, size):
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choices(WORDS, WORD_WEIGHTS)[0]
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def generate_body(rng):
+    # Логнормальное распределение размеров: много коротких заметок,
+    # немного очень длинных
+    size = int(min(max(rng.lognormvariate(7.5, 1.2), 50), 65536))
+    return generate_text(rng, size)
+
+
+def generate_bodies(count, seed):
+    rng = random.Random(seed)
+    return [generate_body(rng) for _ in range(count)]
+
+
+def generate_users(users):
+    return [
+        {
+            'username': f'user{i}',
+            'email': f'user{i}@bench.test',
+            'is_admin': False,
+        }
+        for i in range(users)
+    ] + [{
+        'username': 'admin',
+        'email': 'admin@bench.test',
+        'is_admin': True,
+    }]
+
+
+def generate_notes(rng, user_ids, notes_per_user, deleted_share):
+    for user_id in user_ids:
+        for _ in range(notes_per_user):
+            yield {
+                'title': generate_text(rng, rng.randint(5, 60)),
+                'body': generate_body(rng),
+                'is_deleted': rng.random() < deleted_share,
+                'user_id': user_id,
+            }
+
+
+async def seed_database(
+    session, users, notes_per_user, seed, deleted_share=0.05, batch_size=500
+):
+    # Возвращает пользователей (id, username, is_admin, shard) в порядке
+    # создания: этих полей достаточно для create_access_token
+    from models import User
+    from passwords import password_context
+
+    rng = random.Random(seed)
+    # Один хеш на всех: хеширование пароля для каждого пользователя
+    # заняло бы больше времени, чем весь остальной посев
+    password = Password(password_context.hash(BENCH_PASSWORD))
+    result = await session.exec(
+        insert(User).values([
+            {**user, 'password': password} for user in generate_users(users)
+        ]).returning(User.id, User.username, User.is_admin, User.shard)
+    )
+    created_users = sorted(result.all(), key=lambda user: user.id)
+    user_ids = [user.id for user in created_users if not user.is_admin]
+    batch = []
+    for note in generate_notes(rng, user_ids, notes_per_user, deleted_share):
+        batch.append(note)
+        if len(batch) == batch_size:
+            await _insert_notes(session, batch)
+            batch = []
+    if batch:
+        await _insert_notes(session, batch)
+    await session.commit()
+    return created_users
+
+
+async def _insert_notes(session, notes):
+    from models import Note
+    from search import index_notes, search_values
+
+    dialect = session.bind.dialect.name
+    result = await session.exec(
+        insert(Note).values([
+            {
+                **note,
+                **search_values(dialect, note['title'], note['body']),
+            }
+            for note in notes
+        ]).returning(Note.id, Note.title, Note.body)
+    )
+    await index_notes(session, result.all())
@@ -0,0 +1,498 @@
+# Нагрузочный бенчмарк всех эндпоинтов /api/notes и /api/auth на
+# детерминированных данных (benchmarks.datagen): p50/p95/p99 и число
+# запросов в секунду по каждому сценарию, сравнение с сохраненным
+# базовым результатом (benchmarks/baseline.json).
+#
+# Запуск из корня проекта:
+#   python -m benchmarks.suite
+#   python -m benchmarks.suite --postgres-url postgresql://u:p@localhost/bench
+#   python -m benchmarks.suite --save-baseline
+#
+# База PostgreSQL пересоздается, используйте отдельную базу для бенчмарка.
+# Код выхода 1, если сценарий медленнее базового больше чем на --tolerance.
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from multiprocessing import get_context
+from pathlib import Path
+
+from httpx import ASGITransport, AsyncClient
+
+BASELINE_PATH = Path(__file__).with_name('baseline.json')
+# Параметры, от которых зависят результаты: сравнивать можно только
+# прогоны с одинаковыми значениями
+OPTIONS = ('users', 'notes', 'requests', 'concurrency', 'seed', 'rounds')
+# p99 на сотнях запросов слишком шумный, он только выводится
+COMPARED_LATENCIES = ('p50', 'p95')
+
+
+def percentile(values, share):
+    # values отсортированы по возрастанию
+    return values[max(0, math.ceil(share * len(values)) - 1)]
+
+
+class BenchState:
+    # Пользователи и id заметок, которые сценарии выбирают случайно.
+    # Выбор и изменение списков идут без await, поэтому конкурентные
+    # запросы не получают одну и ту же заметку для удаления
+    def __init__(self, seed, users, notes):
+        from tokens import create_access_token
+
+        self.rng = random.Random(seed)
+        self.users = [user for user in users if not user.is_admin]
+        admin = next(user for user in users if user.is_admin)
+        self.admin_headers = self.get_headers(create_access_token(admin))
+        self.headers = {
+            user.id: self.get_headers(create_access_token(user))
+            for user in self.users
+        }
+        self.live = {user.id: [] for user in self.users}
+        self.deleted = []
+        for note in notes:
+            if note.is_deleted:
+                self.deleted.append(note.id)
+            else:
+                self.live[note.user_id].append(note.id)
+
+    @staticmethod
+    def get_headers(token):
+        return {'Authorization': f'Bearer {token}'}
+
+    def random_user(self):
+        return self.rng.choice(self.users)
+
+    def random_note(self):
+        user = self.rng.choice(
+            [user for user in self.users if self.live[user.id]]
+        )
+        return user, self.rng.choice(self.live[user.id])
+
+    def pop_notes(self, count):
+        user, _ = self.random_note()
+        notes = self.live[user.id]
+        self.rng.shuffle(notes)
+        return user, [notes.pop() for _ in range(min(count, len(notes)))]
+
+    def pop_deleted(self, count):
+        self.rng.shuffle(self.deleted)
+        return [
+            self.deleted.pop()
+            for _ in range(min(count, len(self.deleted)))
+        ]
+
+    def random_text(self, size):
+        from benchmarks.datagen import generate_text
+
+        return generate_text(self.rng, size)
+
+
+async def auth_login(client, state):
+    from benchmarks.datagen import BENCH_PASSWORD
+
+    return await client.post('/api/auth/login', data={
+        'username': state.random_user().username, 'password': BENCH_PASSWORD
+    })
+
+
+async def auth_logout(client, state):
+    from tokens import create_access_token
+
+    token = create_access_token(state.random_user())
+    return await client.post(
+        '/api/auth/logout', headers=state.get_headers(token)
+    )
+
+
+async def notes_list(client, state):
+    user = state.random_user()
+    return await client.get('/api/notes/', headers=state.headers[user.id])
+
+
+async def notes_list_cursor(client, state):
+    user, note_id = state.random_note()
+    return await client.get(
+        '/api/notes/',
+        params={'cursor': note_id, 'limit': 20, 'body': 'preview'},
+        headers=state.headers[user.id]
+    )
+
+
+async def notes_list_admin(client, state):
+    return await client.get(
+        '/api/notes/',
+        params={'note_user_id': state.random_user().id, 'body': 'none'},
+        headers=state.admin_headers
+    )
+
+
+async def notes_export(client, state):
+    return await client.get(
+        '/api/notes/export',
+        params={'note_user_id': state.random_user().id},
+        headers=state.admin_headers
+    )
+
+
+async def notes_search(client, state):
+    from benchmarks.datagen import WORDS
+
+    user = state.random_user()
+    return await client.get(
+        '/api/notes/search',
+        params={'q': state.rng.choice(WORDS), 'limit': 20},
+        headers=state.headers[user.id]
+    )
+
+
+async def notes_get(client, state):
+    user, note_id = state.random_note()
+    return await client.get(
+        f'/api/notes/{note_id}', headers=state.headers[user.id]
+    )
+
+
+async def notes_create(client, state):
+    user = state.random_user()
+    response = await client.post(
+        '/api/notes/',
+        data={
+            'title': state.random_text(30), 'body': state.random_text(2000)
+        },
+        headers=state.headers[user.id]
+    )
+    if response.status_code == 200:
+        state.live[user.id].append(response.json()['id'])
+    return response
+
+
+async def notes_update(client, state):
+    user, note_id = state.random_note()
+    return await client.put(
+        f'/api/notes/{note_id}',
+        data={
+            'title': state.random_text(30), 'body': state.random_text(2000)
+        },
+        headers=state.headers[user.id]
+    )
+
+
+async def notes_patch(client, state):
+    user, note_id = state.random_note()
+    return await client.patch(
+        f'/api/notes/{note_id}',
+        json={'title': state.random_text(30)},
+        headers=state.headers[user.id]
+    )
+
+
+async def notes_delete(client, state):
+    user, (note_id,) = state.pop_notes(1)
+    response = await client.delete(
+        f'/api/notes/{note_id}', headers=state.headers[user.id]
+    )
+    state.deleted.append(note_id)
+    return response
+
+
+async def notes_restore(client, state):
+    (note_id,) = state.pop_deleted(1)
+    return await client.post(
+        f'/api/notes/{note_id}/restore', headers=state.admin_headers
+    )
+
+
+async def notes_batch_create(client, state):
+    user = state.random_user()
+    response = await client.post(
+        '/api/notes/batch',
+        json={'notes': [
+            {'title': state.random_text(30), 'body': state.random_text(500)}
+            for _ in range(10)
+        ]},
+        headers=state.headers[user.id]
+    )
+    if response.status_code == 200:
+        state.live[user.id].extend(note['id'] for note in response.json())
+    return response
+
+
+async def notes_batch_delete(client, state):
+    user, note_ids = state.pop_notes(10)
+    response = await client.post(
+        '/api/notes/batch/delete',
+        json={'ids': note_ids},
+        headers=state.headers[user.id]
+    )
+    state.deleted.extend(note_ids)
+    return response
+
+
+async def notes_batch_restore(client, state):
+    return await client.post(
+        '/api/notes/batch/restore',
+        json={'ids': state.pop_deleted(10)},
+        headers=state.admin_headers
+    )
+
+
+# Порядок важен: сначала чтение на исходных данных, затем запись.
+# Удаления пополняют список удаленных заметок для восстановления
+SCENARIOS = {
+    scenario.__name__: scenario for scenario in (
+        auth_login,
+        auth_logout,
+        notes_list,
+        notes_list_cursor,
+        notes_list_admin,
+        notes_export,
+        notes_search,
+        notes_get,
+        notes_create,
+        notes_update,
+        notes_patch,
+        notes_delete,
+        notes_restore,
+        notes_batch_create,
+        notes_batch_delete,
+        notes_batch_restore,
+    )
+}
+
+
+async def run_scenario(client, state, scenario, requests, concurrency):
+    latencies = []
+    pending = iter(range(requests))
+
+    async def worker():
+        for _ in pending:
+            start = time.perf_counter()
+            response = await scenario(client, state)
+            # Тело ответа (в том числе потоковое) уже прочитано клиентом
+            latencies.append(time.perf_counter() - start)
+            # 412 - две конкурентные правки одной заметки, так и должно быть
+            if response.status_code >= 400 and \
+                    response.status_code != HTTPStatus.PRECONDITION_FAILED:
+                raise RuntimeError(
+                    f'{scenario.__name__}: {response.status_code} '
+                    f'{response.text[:200]}'
+                )
+
+    start = time.perf_counter()
+    # Ошибка в одном запросе отменяет остальные
+    async with asyncio.TaskGroup() as workers:
+        for _ in range(concurrency):
+            workers.create_task(worker())
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'rps': requests / elapsed,
+    }
+
+
+async def _run_scenarios(client, state, options, scenarios):
+    results = {}
+    for name in scenarios:
+        # Прогрев: пулы соединений и процессов, кеши запросов
+        await run_scenario(
+            client, state, SCENARIOS[name], options['concurrency'],
+            options['concurrency']
+        )
+        rounds = [
+            await run_scenario(
+                client, state, SCENARIOS[name], options['requests'],
+                options['concurrency']
+            )
+            for _ in range(options['rounds'])
+        ]
+        # Медиана по раундам сглаживает случайные паузы машины
+        results[name] = {
+            metric: round(
+                statistics.median(metrics[metric] for metrics in rounds), 3
+            )
+            for metric in rounds[0]
+        }
+    return results
+
+
+async def _run_database(options, scenarios):
+    from sqlmodel import select
+
+    from app import app
+    from benchmarks.datagen import seed_database
+    from models import Note
+    from passwords import shutdown_password_executor
+    from utils import (_get_async_engine, create_async_session,
+                       create_db_and_tables)
+
+    create_db_and_tables()
+    async with create_async_session() as session:
+        users = await seed_database(
+            session, options['users'], options['notes'], options['seed']
+        )
+        result = await session.exec(
+            select(Note.id, Note.user_id, Note.is_deleted).order_by(Note.id)
+        )
+        state = BenchState(options['seed'], users, result.all())
+
+    transport = ASGITransport(app=app)
+    try:
+        async with AsyncClient(
+            transport=transport, base_url='http://test'
+        ) as client:
+            return await _run_scenarios(client, state, options, scenarios)
+    finally:
+        shutdown_password_executor()
+        await _get_async_engine().dispose()
+
+
+def run_database(db_url, options, scenarios):
+    # Выполняется в отдельном процессе: настройки и движки читают DB_URL
+    # при импорте
+    os.environ['DB_URL'] = db_url
+    os.environ.pop('ASYNC_DB_URL', None)
+    if not db_url.startswith('sqlite'):
+        from sqlalchemy_utils import (create_database, database_exists,
+                                      drop_database)
+
+        if database_exists(db_url):
+            drop_database(db_url)
+        create_database(db_url)
+    return asyncio.run(_run_database(options, scenarios))
+
+
+def compare(results, baseline, tolerance, min_delta):
+    regressions = []
+    for database, scenarios in results.items():
+        expected = baseline.get(database)
+        if expected is None:
+            print(f'{database}: no baseline, skipping comparison')
+            continue
+        if expected['options'] != scenarios['options']:
+            print(
+                f'{database}: baseline was recorded with '
+                f'{expected["options"]}, skipping comparison'
+            )
+            continue
+        for name, metrics in scenarios['scenarios'].items():
+            base = expected['scenarios'].get(name)
+            if base is None:
+                continue
+            for metric in COMPARED_LATENCIES:
+                limit = max(base[metric] * (1 + tolerance),
+                            base[metric] + min_delta)
+                if metrics[metric] > limit:
+                    regressions.append(
+                        f'{database} {name} {metric}: '
+                        f'{metrics[metric]:.1f}ms > {base[metric]:.1f}ms'
+                    )
+            if metrics['rps'] < base['rps'] / (1 + tolerance):
+                regressions.append(
+                    f'{database} {name} rps: '
+                    f'{metrics["rps"]:.1f} < {base["rps"]:.1f}'
+                )
+    return regressions
+
+
+def print_results(database, scenarios):
+    print(f'\n{database}')
+    print(
+        f'{"scenario":22} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} '
+        f'{"req/s":>9}'
+    )
+    for name, metrics in scenarios.items():
+        print(
+            f'{name:22} {metrics["p50"]:9.2f} {metrics["p95"]:9.2f} '
+            f'{metrics["p99"]:9.2f} {metrics["rps"]:9.1f}'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument(
+        '--notes', type=int, default=100, help='Заметок на пользователя'
+    )
+    parser.add_argument(
+        '--requests', type=int, default=100,
+        help='Запросов на сценарий в одном раунде'
+    )
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument(
+        '--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    parser.add_argument('--no-sqlite', action='store_true')
+    parser.add_argument(
+        '--postgres-url', default=os.environ.get('BENCH_POSTGRES_URL')
+    )
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.5,
+        help='Допустимое ухудшение относительно базового результата'
+    )
+    parser.add_argument(
+        '--min-delta', type=float, default=5,
+        help='Разница задержек в мс, которая не считается ухудшением'
+    )
+    args = parser.parse_args()
+    options = {option: getattr(args, option) for option in OPTIONS}
+    scenarios = [name for name in SCENARIOS if name in args.scenarios]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        databases = {}
+        if not args.no_sqlite:
+            databases['sqlite'] = (
+                f'sqlite:///{os.path.join(tmp, "bench.sqlite3")}'
+            )
+        if args.postgres_url:
+            databases['postgresql'] = args.postgres_url
+        for database, db_url in databases.items():
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=get_context('spawn')
+            ) as executor:
+                scenario_results = executor.submit(
+                    run_database, db_url, options, scenarios
+                ).result()
+            print_results(database, scenario_results)
+            results[database] = {
+                'options': options, 'scenarios': scenario_results
+            }
+
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+    if args.save_baseline:
+        baseline.update(results)
+        args.baseline.write_text(
+            json.dumps(baseline, indent=2, sort_keys=True) + '\n'
+        )
+        print(f'\nBaseline saved to {args.baseline}')
+        return
+    regressions = compare(
+        results, baseline, args.tolerance, args.min_delta
+    )
+    if regressions:
+        print('\nRegressions:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+    print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
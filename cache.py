@@ -0,0 +1,269 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlparse
+
+from settings import settings
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        # Значения в порядке keys, None для отсутствующих
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class CacheFullError(Exception):
+    pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    # LRU с TTL на каждую запись, живет в памяти одного процесса.
+    # evict=False - для данных, которые нельзя терять (список отзыва
+    # токенов): при переполнении удаляются только истекшие записи, а если
+    # их нет, запись не добавляется и set выбрасывает CacheFullError
+
+    def __init__(self, maxsize, ttl=None, evict=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evict = evict
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if not self.evict and key not in self._data and \
+                    len(self._data) >= self.maxsize:
+                self._remove_expired()
+                if len(self._data) >= self.maxsize:
+                    raise CacheFullError(
+                        f'Cache is full ({self.maxsize} entries)'
+                    )
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def _remove_expired(self):
+        now = time.monotonic()
+        expired = [
+            key for key, (_, expires_at) in self._data.items()
+            if expires_at is not None and expires_at <= now
+        ]
+        for key in expired:
+            del self._data[key]
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class NullCacheBackend(CacheBackend):
+    # Кеширование выключено
+
+    def get(self, key):
+        return None
+
+    def get_many(self, keys):
+        return [None] * len(keys)
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class RedisCacheBackend(CacheBackend):
+    # Общий кеш для нескольких воркеров. Значения хранятся в JSON,
+    # ограничение по размеру задается политикой вытеснения Redis.
+
+    def __init__(self, url, prefix, ttl=None):
+        if redis is None:
+            raise RuntimeError(
+                'Redis cache backend requires the "redis" package'
+            )
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def get_many(self, keys):
+        # Один MGET вместо запроса на каждый ключ
+        values = self.client.mget([self._key(key) for key in keys])
+        return [
+            None if value is None else json.loads(value) for value in values
+        ]
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        self.client.set(self._key(key), json.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self._key('*')))
+        if keys:
+            self.client.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self._key('*')))
+
+
+def is_process_local(url):
+    # memory:// у каждого процесса свой: воркеры и команды его не разделяют
+    return urlparse(url).scheme == 'memory'
+
+
+def get_cache_backend(url, prefix, maxsize, ttl=None, evict=True):
+    # evict=False - Redis тоже должен быть настроен без вытеснения
+    # (maxmemory-policy noeviction)
+    scheme = urlparse(url).scheme
+    if scheme == 'none':
+        return NullCacheBackend()
+    if scheme == 'memory':
+        return MemoryCacheBackend(maxsize=maxsize, ttl=ttl, evict=evict)
+    if scheme in ('redis', 'rediss', 'unix'):
+        return RedisCacheBackend(url, prefix=prefix, ttl=ttl)
+    raise ValueError(f'Unknown cache backend: {url}')
+
+
+# Ключ записи ответа и поколения, прочитанные вместе с ней
+CacheKey = namedtuple('CacheKey', ['name', 'generations'])
+
+
+class ResponseCache:
+    # Запись хранится вместе с поколениями области видимости
+    # (пользователь, админ) и глобальным поколением, с которыми она
+    # сохранена. Инвалидация меняет поколение, старые записи перестают
+    # совпадать и перезаписываются или вытесняются по LRU/TTL.
+    GLOBAL_SCOPE = 'all'
+    ADMIN_SCOPE = 'admin'
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def get_user_scope(cls, user_id):
+        return f'user:{user_id}'
+
+    @classmethod
+    def get_owner_scopes(cls, user_ids):
+        # Изменение заметки видно владельцу и админам
+        return {cls.ADMIN_SCOPE} | {
+            cls.get_user_scope(user_id) for user_id in user_ids
+        }
+
+    def _new_generation(self, scope):
+        generation = uuid.uuid4().hex
+        self.backend.set(f'generation:{scope}', generation, ttl=0)
+        return generation
+
+    def lookup(self, scope, *parts):
+        # Поколения и запись читаются одним запросом к бэкенду (MGET
+        # в Redis). Возвращает ключ для set и значение или None
+        scopes = [self.GLOBAL_SCOPE, scope]
+        name = ':'.join([scope, *map(str, parts)])
+        *generations, entry = self.backend.get_many(
+            [f'generation:{scope}' for scope in scopes] + [name]
+        )
+        for index, generation in enumerate(generations):
+            if generation is None:
+                # Потерянное поколение нельзя восстановить, начинаем новое
+                generations[index] = self._new_generation(scopes[index])
+        # Значение сохраняется с поколениями, прочитанными до запроса
+        # к БД: изменение, сделанное за это время, его не пропустит
+        key = CacheKey(name, generations)
+        if entry is None or entry[0] != generations:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        return key, entry[1]
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key.name, [key.generations, value], ttl=ttl)
+
+    def invalidate(self, scopes):
+        for scope in scopes:
+            self._new_generation(scope)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'size': len(self.backend),
+        }
+
+
+response_cache = ResponseCache(
+    get_cache_backend(
+        settings.RESPONSE_CACHE_URL,
+        prefix='response',
+        maxsize=settings.RESPONSE_CACHE_MAXSIZE,
+        ttl=settings.RESPONSE_CACHE_TTL,
+    )
+)
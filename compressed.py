@@ -0,0 +1,113 @@
+import base64
+import zlib
+
+from sqlalchemy import LargeBinary, func, literal
+from sqlalchemy.types import TypeDecorator
+
+from settings import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Значение хранится в двоичной колонке: сжатое - маркер формата и сжатые
+# байты, обычный текст - UTF-8. Текст, который сам начинается с маркера,
+# экранируется префиксом PLAIN
+MARKER = b'\x01'
+PLAIN = MARKER + b'p:'
+ZLIB = MARKER + b'z:'
+ZSTD = MARKER + b's:'
+# Наибольшая длина символа в UTF-8: столько байт на символ читается для
+# обрезанного в БД текста
+MAX_CHAR_SIZE = 4
+
+
+def _compress(data, algorithm):
+    if algorithm == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd compression requires "zstandard"')
+        compressor = zstandard.ZstdCompressor(
+            level=settings.NOTE_BODY_COMPRESSION_LEVEL
+        )
+        return ZSTD, compressor.compress(data)
+    return ZLIB, zlib.compress(data, settings.NOTE_BODY_COMPRESSION_LEVEL)
+
+
+def compress_text(value, algorithm=None, threshold=None):
+    algorithm = algorithm or settings.NOTE_BODY_COMPRESSION
+    if threshold is None:
+        threshold = settings.NOTE_BODY_COMPRESSION_THRESHOLD
+    data = value.encode()
+    if algorithm != 'none' and len(value) >= threshold:
+        marker, compressed = _compress(data, algorithm)
+        # Несжимаемый текст храним как есть
+        if len(marker) + len(compressed) < len(data):
+            return marker + compressed
+    if data.startswith(MARKER):
+        return PLAIN + data
+    return data
+
+
+def decompress_text(value, truncated=False):
+    # truncated - обычный текст обрезан в БД по байтам, последний символ
+    # может быть неполным
+    if not value.startswith(MARKER):
+        return value.decode(errors='ignore' if truncated else 'strict')
+    marker, data = value[:3], value[3:]
+    if marker == PLAIN:
+        return data.decode(errors='ignore' if truncated else 'strict')
+    if marker == ZLIB:
+        return zlib.decompress(data).decode()
+    if marker == ZSTD:
+        if zstandard is None:
+            raise RuntimeError('zstd decompression requires "zstandard"')
+        return zstandard.ZstdDecompressor().decompress(data).decode()
+    raise ValueError(f'Unknown compression marker: {marker!r}')
+
+
+def to_base64_text(value):
+    # Прежний формат в текстовой колонке (миграции 0005 и 0009): сжатые
+    # байты после маркера в base64, остальное - текст
+    marker = value[:3]
+    if marker in (ZLIB, ZSTD):
+        return marker.decode() + base64.b64encode(value[3:]).decode()
+    return value.decode()
+
+
+def from_base64_text(value):
+    data = value.encode()
+    marker = data[:3]
+    if marker in (ZLIB, ZSTD):
+        return marker + base64.b64decode(data[3:])
+    return data
+
+
+def is_encoded(column):
+    # SQL-условие: значение хранится в закодированном виде
+    return func.substr(column, 1, len(MARKER)) == literal(
+        MARKER, LargeBinary
+    )
+
+
+class CompressedText(TypeDecorator):
+    # Текст, который сжимается при записи, если он длиннее порога.
+    # Распаковка происходит только для реально выбранных значений
+    # с маркером, короткие тексты только декодируются из UTF-8.
+    # truncated=True - для текста, обрезанного в БД по байтам
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, *args, truncated=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.truncated = truncated
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return value
+        return decompress_text(value, self.truncated)
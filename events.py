@@ -0,0 +1,247 @@
+# События изменений заметок для подписчиков GET /api/notes/events (SSE).
+#
+# Обработчики записи добавляют события в сессию (publish_note_events),
+# подписчики получают их только после COMMIT. Подписчик - очередь в
+# памяти воркера, без соединения с БД. В PostgreSQL события уходят через
+# NOTIFY в той же транзакции, каждый воркер слушает канал одним
+# соединением на шард и раздает события своим подписчикам. В SQLite
+# события доходят только до подписчиков того же процесса
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import event, make_url, text
+from sqlalchemy.orm import Session
+
+from settings import settings
+from tokens import token_denylist
+from utils import shards
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+NOTE_EVENTS_KEY = 'note_events'
+NOTE_EVENTS_CHANNEL = 'note_events'
+# Payload NOTIFY ограничен 8000 байтами
+NOTIFY_PAYLOAD_SIZE = 7000
+LISTEN_RETRY_INTERVAL = 5
+SSE_RETRY_MS = 3000
+RESYNC = {'type': 'resync'}
+
+
+class Subscription:
+    # События одного подключения. При переполнении очереди события
+    # теряются, и клиент получает resync: перечитать заметки целиком
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, note_event):
+        try:
+            self.queue.put_nowait(note_event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        # Следующее событие или None, если за timeout событий не было
+        if self.overflowed:
+            self.overflowed = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return RESYNC
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class NoteEventBroker:
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or settings.NOTE_EVENTS_QUEUE_SIZE
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._listeners = None
+
+    def subscribe(self, user_id):
+        self._start_listeners()
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def __len__(self):
+        with self._lock:
+            return sum(map(len, self._subscriptions.values()))
+
+    def publish(self, note_events):
+        # note_events - пары (user_id, событие). Очередь подписчика
+        # принадлежит его циклу событий, публикация может прийти из
+        # другого потока
+        with self._lock:
+            deliveries = [
+                (subscription, note_event)
+                for user_id, note_event in note_events
+                for subscription in self._subscriptions.get(user_id, ())
+            ]
+        for subscription, note_event in deliveries:
+            subscription.loop.call_soon_threadsafe(
+                subscription.put, note_event
+            )
+
+    def resync_all(self):
+        with self._lock:
+            user_ids = list(self._subscriptions)
+        self.publish([(user_id, RESYNC) for user_id in user_ids])
+
+    def _start_listeners(self):
+        if self._listeners is not None:
+            return
+        urls = [
+            shards.get_url(shard) for shard in range(len(shards))
+            if make_url(shards.get_url(shard)).get_backend_name() ==
+            'postgresql'
+        ]
+        if urls and asyncpg is None:
+            logger.warning('asyncpg is not installed, note events are local')
+            urls = []
+        self._listeners = [
+            asyncio.create_task(self._listen(url)) for url in urls
+        ]
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.publish(
+            (user_id, note_event)
+            for user_id, note_event in json.loads(payload)
+        )
+
+    async def _listen(self, url):
+        dsn = make_url(url).set(drivername='postgresql').render_as_string(
+            hide_password=False
+        )
+        reconnect = False
+        while True:
+            try:
+                connection = await asyncpg.connect(dsn)
+            except (OSError, asyncpg.PostgresError):
+                logger.exception('Failed to listen for note events')
+                await asyncio.sleep(LISTEN_RETRY_INTERVAL)
+                continue
+            try:
+                await connection.add_listener(
+                    NOTE_EVENTS_CHANNEL, self._on_notify
+                )
+                if reconnect:
+                    # Пока соединения не было, события могли потеряться
+                    self.resync_all()
+                reconnect = True
+                while True:
+                    # Разрыв соединения без закрытия замечаем по запросу
+                    await asyncio.sleep(settings.NOTE_EVENTS_PING_INTERVAL)
+                    await connection.execute('SELECT 1')
+            except (OSError, asyncpg.PostgresError,
+                    asyncpg.InterfaceError):
+                logger.exception('Note events connection lost')
+            finally:
+                connection.terminate()
+            await asyncio.sleep(LISTEN_RETRY_INTERVAL)
+
+    async def close(self):
+        listeners, self._listeners = self._listeners or [], None
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+
+
+note_event_broker = NoteEventBroker()
+
+
+def publish_note_events(session, event_type, notes):
+    # notes - строки или объекты с id, user_id и revision
+    session.info.setdefault(NOTE_EVENTS_KEY, []).extend(
+        (note.user_id, {
+            'type': event_type, 'id': note.id, 'revision': note.revision
+        })
+        for note in notes
+    )
+
+
+def _get_notify_payloads(note_events):
+    payload = []
+    size = 0
+    for item in note_events:
+        item_size = len(json.dumps(item)) + 1
+        if payload and size + item_size > NOTIFY_PAYLOAD_SIZE:
+            yield json.dumps(payload)
+            payload = []
+            size = 0
+        payload.append(item)
+        size += item_size
+    if payload:
+        yield json.dumps(payload)
+
+
+@event.listens_for(Session, 'before_commit')
+def _notify_note_events(session):
+    # NOTIFY доставляется слушателям при COMMIT и отменяется откатом
+    if not session.info.get(NOTE_EVENTS_KEY) or \
+            session.get_bind().dialect.name != 'postgresql':
+        return
+    for payload in _get_notify_payloads(session.info.pop(NOTE_EVENTS_KEY)):
+        session.execute(
+            text('SELECT pg_notify(:channel, :payload)'),
+            {'channel': NOTE_EVENTS_CHANNEL, 'payload': payload}
+        )
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_note_events(session):
+    note_events = session.info.pop(NOTE_EVENTS_KEY, None)
+    if note_events:
+        note_event_broker.publish(note_events)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_note_events(session, previous_transaction):
+    session.info.pop(NOTE_EVENTS_KEY, None)
+
+
+def _format_event(note_event):
+    event_type = 'resync' if note_event is RESYNC else 'note'
+    return f'event: {event_type}\ndata: {json.dumps(note_event)}\n\n'
+
+
+async def stream_note_events(subscription, claims):
+    # Поток закрывается, когда токен истекает или отозван: клиент
+    # переподключается с новым токеном. Пинг раз в
+    # NOTE_EVENTS_PING_INTERVAL секунд не дает прокси закрыть соединение
+    try:
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        while True:
+            timeout = min(
+                settings.NOTE_EVENTS_PING_INTERVAL, claims['exp'] - time.time()
+            )
+            if timeout <= 0 or token_denylist.is_revoked(claims):
+                return
+            note_event = await subscription.get(timeout)
+            yield ': ping\n\n' if note_event is None else _format_event(
+                note_event
+            )
+    finally:
+        note_event_broker.unsubscribe(subscription)
@@ -0,0 +1,208 @@
+from datetime import datetime, timezone
+from http import HTTPStatus
+from pathlib import PurePosixPath
+from typing import Annotated, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import exists
+from sqlmodel import false, select, true, update
+
+from media import FileTooLarge, get_media_path, save_stream
+from models import Attachment, Note, User
+from schemes import AttachmentResponse, SuccessOK
+from settings import settings
+from sharding import NoteSessionDep, assign_ids, attachment_id_allocator
+from utils import etag_matches, get_current_user, get_note_filters
+
+attachments_router = APIRouter(
+    prefix='/notes/{note_id}/attachments', tags=['Attachment']
+)
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+DEFAULT_FILENAME = 'attachment'
+
+
+def _get_attachment_filters(note_id, current_user, attachment_id=None):
+    # Те же правила, что у заметок: пользователь видит только свои
+    # неудаленные вложения живых заметок, админ - все
+    filters = [Attachment.note_id == note_id]
+    if attachment_id is not None:
+        filters.append(Attachment.id == attachment_id)
+    if current_user.is_admin:
+        return filters
+    return [
+        *filters,
+        Attachment.user_id == current_user.id,
+        Attachment.is_deleted == false(),
+        exists().where(Note.id == note_id, Note.is_deleted == false()),
+    ]
+
+
+def _get_etag(attachment):
+    # Содержимое по адресу неизменно, ETag - хеш содержимого
+    return f'"{attachment.sha256}"'
+
+
+def _raise_too_large():
+    raise HTTPException(
+        HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+        f'Attachment is larger than {settings.ATTACHMENT_MAX_SIZE} bytes'
+    )
+
+
+async def _get_attachment(session, note_id, attachment_id, current_user):
+    result = await session.exec(select(Attachment).filter(
+        *_get_attachment_filters(note_id, current_user, attachment_id)
+    ))
+    attachment = result.one_or_none()
+    if attachment is None:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail='Attachment not found'
+        )
+    return attachment
+
+
+@attachments_router.post('/', response_model=AttachmentResponse)
+async def upload_attachment(
+    note_id: int,
+    request: Request,
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: NoteSessionDep,
+    filename: Annotated[str, Query(min_length=1, max_length=255)],
+    content_type: Annotated[
+        str, Header(max_length=255)
+    ] = DEFAULT_CONTENT_TYPE,
+    content_length: Annotated[Optional[int], Header()] = None,
+) -> Attachment:
+    # Тело запроса - содержимое файла, имя передается в параметре filename
+    filename = PurePosixPath(
+        filename.replace('\\', '/')
+    ).name or DEFAULT_FILENAME
+    if content_length is not None and \
+            content_length > settings.ATTACHMENT_MAX_SIZE:
+        _raise_too_large()
+    result = await session.exec(
+        select(Note.user_id).filter(*get_note_filters(note_id, current_user))
+    )
+    owner_id = result.one_or_none()
+    if owner_id is None:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail='Note not found'
+        )
+    # Соединение с БД не занято, пока клиент передает файл
+    await session.rollback()
+    try:
+        sha256, size = await save_stream(
+            request.stream(), settings.ATTACHMENT_MAX_SIZE
+        )
+    except FileTooLarge:
+        _raise_too_large()
+    [values] = await assign_ids([{
+        'note_id': note_id,
+        'filename': filename,
+        'content_type': content_type,
+        'size': size,
+        'sha256': sha256,
+        'created_at': datetime.now(timezone.utc),
+        'user_id': owner_id,
+    }], attachment_id_allocator)
+    attachment = Attachment(**values)
+    session.add(attachment)
+    await session.commit()
+    return attachment
+
+
+@attachments_router.get('/', response_model=List[AttachmentResponse])
+async def get_attachments(
+    note_id: int,
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: NoteSessionDep,
+) -> List[Attachment]:
+    result = await session.exec(
+        select(Attachment).filter(
+            *_get_attachment_filters(note_id, current_user)
+        ).order_by(Attachment.id)
+    )
+    return result.all()
+
+
+@attachments_router.api_route('/{attachment_id}', methods=['GET', 'HEAD'])
+async def download_attachment(
+    note_id: int,
+    attachment_id: int,
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: NoteSessionDep,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+):
+    attachment = await _get_attachment(
+        session, note_id, attachment_id, current_user
+    )
+    etag = _get_etag(attachment)
+    if etag_matches(if_none_match, etag, weak=True):
+        return Response(
+            status_code=HTTPStatus.NOT_MODIFIED, headers={'ETag': etag}
+        )
+    # FileResponse сам обрабатывает Range/If-Range и отдает файл через
+    # http.response.pathsend (sendfile), если его поддерживает сервер
+    return FileResponse(
+        get_media_path(attachment.sha256),
+        media_type=attachment.content_type,
+        filename=attachment.filename,
+        headers={'ETag': etag, 'X-Content-Type-Options': 'nosniff'},
+    )
+
+
+@attachments_router.delete('/{attachment_id}', response_model=SuccessOK)
+async def delete_attachment(
+    note_id: int,
+    attachment_id: int,
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: NoteSessionDep,
+) -> SuccessOK:
+    result = await session.exec(
+        update(Attachment).filter(
+            *_get_attachment_filters(note_id, current_user, attachment_id),
+            Attachment.is_deleted == false()
+        ).values(
+            is_deleted=True, deleted_at=datetime.now(timezone.utc)
+        ).returning(Attachment.id).execution_options(
+            synchronize_session=False
+        )
+    )
+    if result.one_or_none() is not None:
+        await session.commit()
+    else:
+        # Админ удаляет уже удаленное вложение
+        await _get_attachment(session, note_id, attachment_id, current_user)
+    return SuccessOK()
+
+
+@attachments_router.post(
+    '/{attachment_id}/restore', response_model=AttachmentResponse
+)
+async def restore_attachment(
+    note_id: int,
+    attachment_id: int,
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: NoteSessionDep,
+) -> Attachment:
+    if not current_user.is_admin:
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            HTTPStatus.FORBIDDEN.description
+        )
+    await session.exec(
+        update(Attachment).filter(
+            *_get_attachment_filters(note_id, current_user, attachment_id),
+            Attachment.is_deleted == true()
+        ).values(is_deleted=False, deleted_at=None).execution_options(
+            synchronize_session=False
+        )
+    )
+    await session.commit()
+    return await _get_attachment(
+        session, note_id, attachment_id, current_user
+    )
@@ -3,34 +3,57 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import select
+from sqlalchemy_utils import Password
+from sqlmodel import select, update
 
 from models import User
-from utils import SessionDep, get_subject
+from passwords import dummy_verify_password, verify_password
+from schemes import SuccessOK
+from tokens import token_denylist
+from utils import AsyncSessionDep, get_subject, get_token_claims
 
 auth_router = APIRouter(prefix='/auth', tags=['Auth'])
 
 
 @auth_router.post('/login')
 async def login(
-    session: SessionDep,
+    session: AsyncSessionDep,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ):
     user_query = select(User).filter(User.username == form_data.username)
-    user = session.exec(user_query).one_or_none()
+    result = await session.exec(user_query)
+    user = result.one_or_none()
     if not user:
+        await dummy_verify_password()
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="Incorrect username or password"
         )
 
-    if not form_data.password == user.password:
+    valid, new_hash = await verify_password(
+        form_data.password, user.password.hash
+    )
+    if not valid:
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="Incorrect username or password"
         )
+    if new_hash:
+        # Хеш устаревшей схемы пересчитан. Обновляем таблицу напрямую:
+        # событие изменения User отозвало бы токены пользователя
+        user_table = User.__table__
+        await session.exec(
+            update(user_table).where(user_table.c.id == user.id).values(
+                password=Password(new_hash)
+            )
+        )
+        await session.commit()
 
-    # Тут, конечно, надо сделать нормальную авторизацию с JWT.
-    # Но для теста пока и так норм
     subject = get_subject(user)
     return {"access_token": subject, "token_type": "bearer"}
+
+
+@auth_router.post('/logout', response_model=SuccessOK)
+async def logout(claims: Annotated[dict, Depends(get_token_claims)]):
+    token_denylist.revoke(claims)
+    return SuccessOK()
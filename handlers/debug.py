@@ -0,0 +1,30 @@
+from http import HTTPStatus
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from models import User
+from settings import settings
+from tracing import traces
+from utils import get_current_user
+
+debug_router = APIRouter(prefix='/debug', tags=['Debug'])
+
+
+@debug_router.get('/traces/{trace_id}', include_in_schema=False)
+async def get_query_trace(
+    trace_id: str,
+    current_user: Annotated[User, Depends(get_current_user)],
+) -> dict:
+    if not current_user.is_admin:
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            HTTPStatus.FORBIDDEN.description
+        )
+    trace = traces.get(trace_id) if settings.QUERY_TRACE_ENABLED else None
+    if trace is None:
+        raise HTTPException(
+            HTTPStatus.NOT_FOUND,
+            HTTPStatus.NOT_FOUND.description
+        )
+    return trace
@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+
+from metrics import CONTENT_TYPE, render_metrics
+
+metrics_router = APIRouter(tags=['Metrics'])
+
+
+@metrics_router.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
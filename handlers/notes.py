@@ -1,68 +1,585 @@
+import heapq
+import json
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+from functools import partial
 from http import HTTPStatus
+from itertools import islice
+from operator import attrgetter, itemgetter
 from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Depends, Form, HTTPException
-from sqlmodel import false, select
+from fastapi import (APIRouter, Depends, Form, Header, HTTPException, Query,
+                     Response)
+from fastapi.responses import StreamingResponse
+from sqlalchemy import case, type_coerce
+from sqlmodel import false, func, insert, select, true, update
 
-from models import Note, User
-from schemes import NoteModel, NoteModelResponse, SuccessOK
-from utils import SessionDep, get_current_user
+from archive import restore_archived_notes
+from cache import response_cache
+from compressed import MAX_CHAR_SIZE, CompressedText, is_encoded
+from events import note_event_broker, publish_note_events, stream_note_events
+from models import Note, User, invalidate_note_cache
+from schemes import (NoteBatchCreate, NoteBatchIds, NoteBatchItemResult,
+                     NoteBodyMode, NoteListItemResponse, NoteModel,
+                     NoteModelResponse, NotePatch, NotePatchResponse,
+                     SuccessOK)
+from search import index_notes, search_notes_query, search_values
+from serialization import dumps
+from settings import settings
+from sharding import (NoteSessionDep, assign_note_ids, for_each_shard,
+                      merge_streams)
+from utils import (create_async_session, etag_matches, get_cache_ttl,
+                   get_current_user, get_note_filters, get_token_claims,
+                   shards)
 
 notes_router = APIRouter(prefix='/notes', tags=['Note'])
 
 
-@notes_router.get('/', response_model=List[NoteModelResponse])
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def _get_cache_scope(current_user):
+    if current_user.is_admin:
+        return response_cache.ADMIN_SCOPE
+    return response_cache.get_user_scope(current_user.id)
+
+
+def _json_response(content, headers=None):
+    return Response(content, media_type='application/json', headers=headers)
+
+
+def _get_etag(note):
+    return f'"{note.id}-{note.revision}"'
+
+
+def _check_if_match(if_match, note):
+    if if_match is not None and not etag_matches(if_match, _get_etag(note)):
+        raise HTTPException(
+            status_code=HTTPStatus.PRECONDITION_FAILED,
+            detail='Note has been modified'
+        )
+
+
+def _get_list_columns(body_mode):
+    columns = [Note.id, Note.title, Note.user_id]
+    if body_mode == NoteBodyMode.full:
+        columns.append(Note.body)
+    elif body_mode == NoteBodyMode.preview:
+        # Несжатое тело обрезается в БД по байтам с запасом на длину
+        # символа, сжатое (оно и так короче) приходит целиком; до длины
+        # превью обрезается после декодирования
+        columns.append(
+            type_coerce(
+                case(
+                    (is_encoded(Note.body), Note.body),
+                    else_=func.substr(
+                        Note.body, 1,
+                        settings.NOTE_PREVIEW_LENGTH * MAX_CHAR_SIZE
+                    )
+                ),
+                CompressedText(truncated=True)
+            ).label('body')
+        )
+    return columns
+
+
+def _get_list_items(rows, body_mode):
+    # Словари в порядке полей NoteListItemResponse прямо из строк выборки
+    # (id, title, user_id[, body]): JSON получается тем же, что у
+    # pydantic, но без построения модели на каждую строку
+    if body_mode == NoteBodyMode.none:
+        return [
+            {'id': note_id, 'title': title, 'user_id': user_id}
+            for note_id, title, user_id, *_ in rows
+        ]
+    length = None
+    if body_mode == NoteBodyMode.preview:
+        length = settings.NOTE_PREVIEW_LENGTH
+    return [
+        {
+            'id': note_id,
+            'title': title,
+            'body': body[:length],
+            'user_id': user_id
+        }
+        for note_id, title, user_id, body, *_ in rows
+    ]
+
+
+async def _get_rows(notes_query, session):
+    result = await session.exec(notes_query)
+    return result.all()
+
+
+@notes_router.get(
+    '/',
+    response_model=List[NoteListItemResponse],
+    response_model_exclude_none=True
+)
 async def get_all_notes(
     current_user: Annotated[User, Depends(get_current_user)],
-    session: SessionDep,
-    note_user_id: Optional[int] = None
-) -> List[NoteModel]:
+    session: NoteSessionDep,
+    note_user_id: Optional[int] = None,
+    cursor: Optional[int] = None,
+    limit: Annotated[
+        int, Query(ge=1, le=settings.NOTES_MAX_PAGE_SIZE)
+    ] = settings.NOTES_PAGE_SIZE,
+    body: NoteBodyMode = NoteBodyMode.full,
+) -> List[NoteListItemResponse]:
+    cache_key, cached = response_cache.lookup(
+        _get_cache_scope(current_user),
+        'list',
+        note_user_id,
+        cursor,
+        limit,
+        body.value
+    )
+    if cached is None:
+        notes_query = select(*_get_list_columns(body))
+        if current_user.is_admin:
+            if note_user_id:
+                notes_query = notes_query.filter(
+                    Note.user_id == note_user_id
+                )
+        else:
+            notes_query = notes_query.filter(
+                Note.user_id == current_user.id,
+                Note.is_deleted == false()
+            )
+        if cursor is not None:
+            notes_query = notes_query.filter(Note.id > cursor)
+        # Берем на одну запись больше, чтобы понять, есть ли следующая
+        # страница
+        notes_query = notes_query.order_by(Note.id).limit(limit + 1)
+        if current_user.is_admin:
+            # Заметки всех пользователей: запрос на каждом шарде и слияние
+            # по id
+            results = await for_each_shard(
+                partial(_get_rows, notes_query), session
+            )
+            rows = list(islice(
+                heapq.merge(*results, key=attrgetter('id')), limit + 1
+            ))
+        else:
+            rows = await _get_rows(notes_query, session)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1].id
+        cached = {
+            'content': dumps(_get_list_items(rows, body)).decode(),
+            'next_cursor': next_cursor,
+        }
+        response_cache.set(cache_key, cached, ttl=get_cache_ttl(session))
+    headers = {}
+    if cached['next_cursor'] is not None:
+        headers[NEXT_CURSOR_HEADER] = str(cached['next_cursor'])
+    return _json_response(cached['content'], headers)
+
+
+async def _batched(rows, size):
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _export_notes(notes_query):
+    # Сессии открываются внутри генератора: ответ отдается уже после
+    # выхода из зависимостей обработчика
+    notes_query = notes_query.execution_options(
+        yield_per=settings.NOTES_EXPORT_BATCH_SIZE
+    )
+    async with AsyncExitStack() as stack:
+        results = []
+        for shard in range(len(shards)):
+            session = await stack.enter_async_context(
+                create_async_session(shards.get_engine(shard))
+            )
+            results.append(await session.stream(notes_query))
+        if len(results) == 1:
+            batches = results[0].partitions()
+        else:
+            # Потоки шардов упорядочены по id, слияние их не буферизует
+            batches = _batched(
+                merge_streams(results, key=attrgetter('id')),
+                settings.NOTES_EXPORT_BATCH_SIZE
+            )
+        async for rows in batches:
+            yield ''.join(
+                json.dumps(row._asdict(), ensure_ascii=False) + '\n'
+                for row in rows
+            )
+
+
+@notes_router.get('/export')
+async def export_notes(
+    current_user: Annotated[User, Depends(get_current_user)],
+    note_user_id: Optional[int] = None,
+) -> StreamingResponse:
+    if not current_user.is_admin:
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            HTTPStatus.FORBIDDEN.description
+        )
+    notes_query = select(
+        Note.id,
+        Note.title,
+        Note.body,
+        Note.is_deleted,
+        Note.revision,
+        Note.user_id
+    ).order_by(Note.id)
+    if note_user_id:
+        notes_query = notes_query.filter(Note.user_id == note_user_id)
+    return StreamingResponse(
+        _export_notes(notes_query),
+        media_type='application/x-ndjson'
+    )
+
+
+@notes_router.get('/events')
+async def get_note_events(
+    current_user: Annotated[User, Depends(get_current_user)],
+    claims: Annotated[dict, Depends(get_token_claims)],
+) -> StreamingResponse:
+    # Server-sent events об изменениях заметок пользователя: created,
+    # updated, deleted, restored с id и ревизией. Подключение не держит
+    # соединение с БД
+    subscription = note_event_broker.subscribe(current_user.id)
+    return StreamingResponse(
+        stream_note_events(subscription, claims),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+async def _search_rows(
+    q, columns, filters, offset, limit, session, with_rank=False
+):
+    notes_query = search_notes_query(
+        session.bind.dialect.name, q, columns, with_rank
+    )
+    if notes_query is None:
+        return []
+    result = await session.exec(
+        notes_query.filter(*filters).offset(offset).limit(limit)
+    )
+    return result.all()
+
+
+@notes_router.get(
+    '/search',
+    response_model=List[NoteListItemResponse],
+    response_model_exclude_none=True
+)
+async def search_notes(
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: NoteSessionDep,
+    q: Annotated[str, Query(min_length=1, max_length=256)],
+    note_user_id: Optional[int] = None,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[
+        int, Query(ge=1, le=settings.NOTES_MAX_PAGE_SIZE)
+    ] = settings.NOTES_PAGE_SIZE,
+    body: NoteBodyMode = NoteBodyMode.preview,
+) -> List[NoteListItemResponse]:
+    # Удаленные заметки остаются в индексе (их видит админ и их можно
+    # восстановить), права доступа проверяются как в get_all_notes
     if current_user.is_admin:
-        notes_query = select(Note)
-        if note_user_id:
-            notes_query = notes_query.filter(Note.user_id == note_user_id)
+        filters = [Note.user_id == note_user_id] if note_user_id else []
     else:
-        notes_query = select(Note).filter(
+        filters = [Note.user_id == current_user.id, Note.is_deleted == false()]
+    columns = _get_list_columns(body)
+    if current_user.is_admin and len(shards) > 1:
+        # Каждый шард отдает первые offset + limit, слияние по
+        # релевантности
+        results = await for_each_shard(partial(
+            _search_rows, q, columns, filters, 0, offset + limit,
+            with_rank=True
+        ))
+        rows = islice(
+            heapq.merge(*results, key=attrgetter('rank', 'id')),
+            offset, offset + limit
+        )
+    else:
+        rows = await _search_rows(q, columns, filters, offset, limit, session)
+    return _json_response(dumps(_get_list_items(rows, body)))
+
+
+def _get_batch_changes(rows):
+    return {row.id for row in rows}, {row.user_id for row in rows}
+
+
+def _get_batch_results(ids, found_ids):
+    return [
+        NoteBatchItemResult(
+            id=note_id,
+            status=HTTPStatus.OK if note_id in found_ids
+            else HTTPStatus.NOT_FOUND
+        )
+        for note_id in ids
+    ]
+
+
+async def _update_notes_batch(
+    ids, notes_query, note_event, session, restore_archived=False
+):
+    result = await session.exec(notes_query)
+    rows = result.all()
+    found_ids, owner_ids = _get_batch_changes(rows)
+    invalidate_note_cache(session, response_cache.get_owner_scopes(owner_ids))
+    publish_note_events(session, note_event, rows)
+    archived_ids = set(ids) - found_ids
+    if restore_archived and archived_ids:
+        notes = await restore_archived_notes(session, archived_ids)
+        found_ids.update(note.id for note in notes)
+        publish_note_events(session, note_event, notes)
+    await session.commit()
+    return found_ids
+
+
+@notes_router.post('/batch', response_model=List[NoteModelResponse])
+async def create_notes_batch(
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: NoteSessionDep,
+    batch: NoteBatchCreate,
+) -> List[NoteModelResponse]:
+    # Один многострочный INSERT ... RETURNING. id выдаются по порядку
+    # строк в VALUES, сортировка по id возвращает порядок входных данных
+    dialect = session.bind.dialect.name
+    notes_query = insert(Note).values(await assign_note_ids([
+        {
+            'user_id': current_user.id,
+            **new_note.model_dump(),
+            **search_values(dialect, new_note.title, new_note.body),
+        }
+        for new_note in batch.notes
+    ])).returning(
+        Note.id, Note.title, Note.body, Note.user_id, Note.revision
+    ).execution_options(note_cache_invalidation='manual')
+    result = await session.exec(notes_query)
+    rows = result.all()
+    publish_note_events(session, 'created', rows)
+    notes = sorted((row._asdict() for row in rows), key=itemgetter('id'))
+    await index_notes(
+        session,
+        [(note['id'], note['title'], note['body']) for note in notes]
+    )
+    invalidate_note_cache(
+        session, response_cache.get_owner_scopes([current_user.id])
+    )
+    await session.commit()
+    return notes
+
+
+@notes_router.post(
+    '/batch/delete', response_model=List[NoteBatchItemResult]
+)
+async def delete_notes_batch(
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: NoteSessionDep,
+    batch: NoteBatchIds,
+) -> List[NoteBatchItemResult]:
+    notes_query = update(Note).filter(Note.id.in_(batch.ids))
+    if not current_user.is_admin:
+        notes_query = notes_query.filter(
             Note.user_id == current_user.id,
             Note.is_deleted == false()
         )
-    result = session.exec(notes_query)
-    return result.all()
+    notes_query = notes_query.values(
+        is_deleted=True,
+        deleted_at=datetime.now(timezone.utc),
+        revision=Note.revision + 1
+    ).returning(
+        Note.id, Note.user_id, Note.revision
+    ).execution_options(
+        synchronize_session=False, note_cache_invalidation='manual'
+    )
+    if current_user.is_admin:
+        # id заметок могут быть на любых шардах
+        results = await for_each_shard(
+            partial(_update_notes_batch, batch.ids, notes_query, 'deleted'),
+            session
+        )
+    else:
+        results = [
+            await _update_notes_batch(
+                batch.ids, notes_query, 'deleted', session
+            )
+        ]
+    return _get_batch_results(batch.ids, set().union(*results))
+
+
+@notes_router.post(
+    '/batch/restore', response_model=List[NoteBatchItemResult]
+)
+async def restore_notes_batch(
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: NoteSessionDep,
+    batch: NoteBatchIds,
+) -> List[NoteBatchItemResult]:
+    if not current_user.is_admin:
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            HTTPStatus.FORBIDDEN.description
+        )
+    notes_query = update(Note).filter(
+        Note.id.in_(batch.ids)
+    ).values(
+        is_deleted=False, deleted_at=None, revision=Note.revision + 1
+    ).returning(
+        Note.id, Note.user_id, Note.revision
+    ).execution_options(
+        synchronize_session=False, note_cache_invalidation='manual'
+    )
+    results = await for_each_shard(
+        partial(
+            _update_notes_batch, batch.ids, notes_query, 'restored',
+            restore_archived=True
+        ),
+        session
+    )
+    return _get_batch_results(batch.ids, set().union(*results))
 
 
 @notes_router.get('/{note_id}', response_model=NoteModelResponse)
 async def get_note(
     note_id: int,
     current_user: Annotated[User, Depends(get_current_user)],
-    session: SessionDep
+    session: NoteSessionDep,
+    if_none_match: Annotated[Optional[str], Header()] = None,
 ) -> List[NoteModel]:
-    if current_user.is_admin:
-        notes_query = select(Note).filter(Note.id == note_id)
-    else:
-        notes_query = select(Note).filter(
-            Note.id == note_id,
-            Note.user_id == current_user.id,
-            Note.is_deleted == false()
+    cache_key, cached = response_cache.lookup(
+        _get_cache_scope(current_user), 'note', note_id
+    )
+    note_filters = get_note_filters(note_id, current_user)
+    if cached is None and if_none_match is not None:
+        # Сначала сверяем только ревизию, не читая тело заметки
+        result = await session.exec(
+            select(Note.id, Note.revision).filter(*note_filters)
         )
-    result = session.exec(notes_query)
-    note = result.one_or_none()
-    if not note:
-        raise HTTPException(
-            status_code=HTTPStatus.NOT_FOUND,
-            detail='Note not found'
+        current = result.one_or_none()
+        if current and etag_matches(
+            if_none_match, _get_etag(current), weak=True
+        ):
+            return Response(
+                status_code=HTTPStatus.NOT_MODIFIED,
+                headers={'ETag': _get_etag(current)}
+            )
+    if cached is None:
+        result = await session.exec(select(Note).filter(*note_filters))
+        note = result.one_or_none()
+        if not note:
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND,
+                detail='Note not found'
+            )
+        cached = {
+            'etag': _get_etag(note),
+            'content': NoteModelResponse.model_validate(
+                note, from_attributes=True
+            ).model_dump_json(),
+        }
+        response_cache.set(cache_key, cached, ttl=get_cache_ttl(session))
+    if etag_matches(if_none_match, cached['etag'], weak=True):
+        return Response(
+            status_code=HTTPStatus.NOT_MODIFIED,
+            headers={'ETag': cached['etag']}
         )
-    return note
+    return _json_response(cached['content'], {'ETag': cached['etag']})
 
 
 @notes_router.post('/', response_model=NoteModelResponse)
 async def create_note(
     current_user: Annotated[User, Depends(get_current_user)],
-    session: SessionDep,
+    session: NoteSessionDep,
+    response: Response,
     new_note: NoteModel = Form(),
 ) -> List[NoteModel]:
-    note = Note(user_id=current_user.id, **new_note.model_dump())
-    session.add(note)
-    session.commit()
+    [values] = await assign_note_ids([{
+        'user_id': current_user.id,
+        **new_note.model_dump(),
+        **search_values(
+            session.bind.dialect.name, new_note.title, new_note.body
+        ),
+    }])
+    result = await session.exec(
+        insert(Note).values(values).returning(Note).execution_options(
+            note_cache_invalidation='manual'
+        )
+    )
+    note = result.scalar_one()
+    await index_notes(session, [(note.id, note.title, note.body)])
+    invalidate_note_cache(
+        session, response_cache.get_owner_scopes([current_user.id])
+    )
+    publish_note_events(session, 'created', [note])
+    await session.commit()
+    response.headers['ETag'] = _get_etag(note)
+    return note
+
+
+def _get_if_match_revisions(if_match, note_id):
+    # Ревизии заметки из If-Match, None - заголовок не ограничивает запись
+    if if_match is None or if_match.strip() == '*':
+        return None
+    prefix = f'"{note_id}-'
+    revisions = []
+    for tag in if_match.split(','):
+        tag = tag.strip()
+        if tag.startswith(prefix) and tag.endswith('"'):
+            revision = tag[len(prefix):-1]
+            if revision.isdigit():
+                revisions.append(int(revision))
+    return revisions
+
+
+def _get_note_update_query(note_id, current_user, if_match=None):
+    # Проверка владельца, удаления и ревизии делается в самом UPDATE,
+    # запись и чтение результата - один запрос к БД
+    notes_query = update(Note).filter(
+        *get_note_filters(note_id, current_user)
+    )
+    revisions = _get_if_match_revisions(if_match, note_id)
+    if revisions is not None:
+        notes_query = notes_query.filter(Note.revision.in_(revisions))
+    return notes_query.values(revision=Note.revision + 1)
+
+
+async def _execute_note_update(session, notes_query, *columns):
+    result = await session.exec(
+        notes_query.returning(*columns).execution_options(
+            synchronize_session=False, note_cache_invalidation='manual'
+        )
+    )
+    note = result.one_or_none()
+    if note:
+        invalidate_note_cache(
+            session, response_cache.get_owner_scopes([note.user_id])
+        )
+    return note
+
+
+async def _get_unchanged_note(
+    session, note_id, current_user, if_match, *columns
+):
+    # UPDATE не затронул строк: выясняем, нет заметки, не совпала
+    # ревизия или менять было нечего
+    result = await session.exec(
+        select(*columns).filter(*get_note_filters(note_id, current_user))
+    )
+    note = result.one_or_none()
+    if not note:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail='Note not found'
+        )
+    _check_if_match(if_match, note)
     return note
 
 
@@ -70,30 +587,105 @@ async def create_note(
 async def update_note(
     note_id: int,
     current_user: Annotated[User, Depends(get_current_user)],
-    session: SessionDep,
+    session: NoteSessionDep,
+    response: Response,
     new_note: NoteModel = Form(),
+    if_match: Annotated[Optional[str], Header()] = None,
 ) -> List[NoteModel]:
-    if current_user.is_admin:
-        notes_query = select(Note).filter(Note.id == note_id)
+    columns = (Note.id, Note.title, Note.body, Note.user_id, Note.revision)
+    notes_query = _get_note_update_query(
+        note_id, current_user, if_match
+    ).filter(
+        (Note.title != new_note.title) | (Note.body != new_note.body)
+    ).values(
+        title=new_note.title,
+        body=new_note.body,
+        **search_values(
+            session.bind.dialect.name, new_note.title, new_note.body
+        ),
+    )
+    note = await _execute_note_update(session, notes_query, *columns)
+    if note:
+        await index_notes(session, [(note.id, note.title, note.body)])
+        publish_note_events(session, 'updated', [note])
+        await session.commit()
     else:
-        notes_query = select(Note).filter(
-            Note.id == note_id,
-            Note.user_id == current_user.id,
-            Note.is_deleted == false()
+        note = await _get_unchanged_note(
+            session, note_id, current_user, if_match, *columns
         )
-    result = session.exec(notes_query)
+    response.headers['ETag'] = _get_etag(note)
+    return note
+
+
+def _apply_edits(body, edits):
+    parts = []
+    position = 0
+    for edit in sorted(edits, key=lambda edit: (edit.start, edit.end)):
+        if edit.start < position or edit.end > len(body):
+            raise HTTPException(
+                status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+                detail='Invalid text patch'
+            )
+        parts.append(body[position:edit.start])
+        parts.append(edit.text)
+        position = edit.end
+    parts.append(body[position:])
+    return ''.join(parts)
+
+
+@notes_router.patch('/{note_id}', response_model=NotePatchResponse)
+async def patch_note(
+    note_id: int,
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: NoteSessionDep,
+    response: Response,
+    note_patch: NotePatch,
+    if_match: Annotated[Optional[str], Header()] = None,
+) -> NotePatchResponse:
+    columns = (Note.id, Note.title, Note.body, Note.user_id, Note.revision)
+    result = await session.exec(
+        select(*columns).filter(*get_note_filters(note_id, current_user))
+    )
     note = result.one_or_none()
     if not note:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND,
             detail='Note not found'
         )
-    if note.title != new_note.title:
-        note.title = new_note.title
-    if note.body != new_note.body:
-        note.body = new_note.body
-    session.commit()
-    session.refresh(note)
+    _check_if_match(if_match, note)
+    if note_patch.revision is not None and \
+            note_patch.revision != note.revision:
+        raise HTTPException(
+            status_code=HTTPStatus.PRECONDITION_FAILED,
+            detail='Note has been modified'
+        )
+    title, body = note.title, note.body
+    if note_patch.title is not None:
+        title = note_patch.title
+    if note_patch.body is not None:
+        body = note_patch.body
+    elif note_patch.edits:
+        body = _apply_edits(body, note_patch.edits)
+    if note.title != title or note.body != body:
+        # Изменения посчитаны по прочитанной ревизии, UPDATE проходит,
+        # только если заметку с тех пор никто не изменил
+        notes_query = _get_note_update_query(note_id, current_user).filter(
+            Note.revision == note.revision
+        ).values(
+            title=title,
+            body=body,
+            **search_values(session.bind.dialect.name, title, body),
+        )
+        note = await _execute_note_update(session, notes_query, *columns)
+        if not note:
+            raise HTTPException(
+                status_code=HTTPStatus.PRECONDITION_FAILED,
+                detail='Note has been modified'
+            )
+        await index_notes(session, [(note.id, note.title, note.body)])
+        publish_note_events(session, 'updated', [note])
+        await session.commit()
+    response.headers['ETag'] = _get_etag(note)
     return note
 
 
@@ -101,26 +693,25 @@ async def update_note(
 async def delete_note(
     note_id: int,
     current_user: Annotated[User, Depends(get_current_user)],
-    session: SessionDep
+    session: NoteSessionDep,
+    if_match: Annotated[Optional[str], Header()] = None,
 ) -> List[NoteModel]:
-    if current_user.is_admin:
-        notes_query = select(Note).filter(Note.id == note_id)
+    notes_query = _get_note_update_query(
+        note_id, current_user, if_match
+    ).filter(Note.is_deleted == false()).values(
+        is_deleted=True, deleted_at=datetime.now(timezone.utc)
+    )
+    note = await _execute_note_update(
+        session, notes_query, Note.id, Note.user_id, Note.revision
+    )
+    if note:
+        publish_note_events(session, 'deleted', [note])
+        await session.commit()
     else:
-        notes_query = select(Note).filter(
-            Note.id == note_id,
-            Note.user_id == current_user.id,
-            Note.is_deleted == false()
+        # Админ удаляет уже удаленную заметку
+        await _get_unchanged_note(
+            session, note_id, current_user, if_match, Note.id, Note.revision
         )
-    result = session.exec(notes_query)
-    note = result.one_or_none()
-    if not note:
-        raise HTTPException(
-            status_code=HTTPStatus.NOT_FOUND,
-            detail='Note not found'
-        )
-    note.is_deleted = True
-    session.commit()
-    session.refresh(note)
     return SuccessOK()
 
 
@@ -128,24 +719,28 @@ async def delete_note(
 async def restore_note(
     note_id: int,
     current_user: Annotated[User, Depends(get_current_user)],
-    session: SessionDep
+    session: NoteSessionDep,
+    response: Response,
 ) -> List[NoteModel]:
-    if current_user.is_admin:
-        notes_query = select(Note).filter(Note.id == note_id)
-        result = session.exec(notes_query)
-        note = result.one_or_none()
-        if not note:
-            raise HTTPException(
-                status_code=HTTPStatus.NOT_FOUND,
-                detail='Note not found'
-            )
-        if note.is_deleted:
-            note.is_deleted = False
-            session.commit()
-            session.refresh(note)
-    else:
+    if not current_user.is_admin:
         raise HTTPException(
             HTTPStatus.FORBIDDEN,
             HTTPStatus.FORBIDDEN.description
         )
+    columns = (Note.id, Note.title, Note.body, Note.user_id, Note.revision)
+    notes_query = _get_note_update_query(note_id, current_user).filter(
+        Note.is_deleted == true()
+    ).values(is_deleted=False, deleted_at=None)
+    note = await _execute_note_update(session, notes_query, *columns)
+    if not note:
+        notes = await restore_archived_notes(session, [note_id])
+        note = notes[0] if notes else None
+    if note:
+        publish_note_events(session, 'restored', [note])
+        await session.commit()
+    else:
+        note = await _get_unchanged_note(
+            session, note_id, current_user, None, *columns
+        )
+    response.headers['ETag'] = _get_etag(note)
     return note
@@ -0,0 +1,188 @@
+# Запуск в продакшене: python -m launcher --workers 4
+#
+# Схема БД проверяется (и при необходимости мигрирует) один раз в главном
+# процессе, затем он форкается на воркеры uvicorn с общим сокетом. Модули
+# приложения импортированы до fork и не загружаются заново в каждом
+# воркере, соединения пулов воркер открывает до первого запроса. Время до
+# готовности и до первого ответа каждого воркера пишется в журнал.
+# Упавший воркер перезапускается. Больше одного воркера запускается только
+# с общими для воркеров бэкендами (redis://) отзыва токенов, кеша ответов,
+# отметок записи для реплик и трасс
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+
+import uvicorn
+from uvicorn.server import STARTUP_FAILURE
+
+from app import app
+from cache import is_process_local
+from settings import settings
+from utils import create_db_and_tables
+
+logger = logging.getLogger('launcher')
+
+
+class StartupTimer:
+    def __init__(self, app, index, started):
+        self.app = app
+        self.index = index
+        self.started = started
+        self.first_request = True
+
+    def _log(self, event):
+        logger.info(
+            'Worker %d (pid %d) %s in %.3fs', self.index, os.getpid(), event,
+            time.monotonic() - self.started
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            async def send_wrapper(message):
+                if message['type'] == 'lifespan.startup.complete':
+                    self._log('ready')
+                await send(message)
+        elif scope['type'] == 'http' and self.first_request:
+            self.first_request = False
+
+            async def send_wrapper(message):
+                if message['type'] == 'http.response.start':
+                    self._log('answered first request')
+                await send(message)
+        else:
+            send_wrapper = send
+        await self.app(scope, receive, send_wrapper)
+
+
+def get_process_local_settings():
+    # Настройки состояния, которое хранится в памяти процесса: в каждом
+    # воркере оно было бы своим (отзыв токенов и инвалидация кеша видны
+    # одному воркеру, трасса отдается только им)
+    names = ['TOKEN_DENYLIST_URL', 'RESPONSE_CACHE_URL']
+    if settings.DB_REPLICA_URLS:
+        names.append('DB_REPLICA_STICKY_URL')
+    if settings.QUERY_TRACE_ENABLED:
+        names.append('QUERY_TRACE_URL')
+    return [
+        name for name in names if is_process_local(getattr(settings, name))
+    ]
+
+
+def _run_worker(index, config, sock, started):
+    # Обработчики сигналов главного процесса воркеру не нужны, uvicorn
+    # ставит свои
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    if index:
+        # Фоновая архивация нужна одна на все воркеры
+        settings.NOTES_ARCHIVE_INTERVAL = 0
+    config.app = StartupTimer(app, index, started)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _spawn(index, config, sock, started):
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 0
+    try:
+        _run_worker(index, config, sock, started)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        logger.exception('Worker %d failed', index)
+        code = 1
+    finally:
+        logging.shutdown()
+        os._exit(code)
+
+
+def run(host, port, workers, warm_connections, started):
+    start = time.monotonic()
+    create_db_and_tables()
+    logger.info('Schema checked in %.3fs', time.monotonic() - start)
+    # Воркеры наследуют настройки: схему больше не проверяют
+    settings.DB_SCHEMA_CHECK = False
+    settings.DB_POOL_WARMUP = warm_connections
+    config = uvicorn.Config(app, host=host, port=port)
+    sock = config.bind_socket()
+    children = {
+        _spawn(index, config, sock, started): index
+        for index in range(workers)
+    }
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    exit_code = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        if code == STARTUP_FAILURE:
+            # Перезапуск не поможет: ошибка при старте приложения
+            logger.error('Worker %d failed to start, stopping', index)
+            exit_code = 1
+            stop(None, None)
+            continue
+        logger.warning('Worker %d exited with %d, restarting', index, code)
+        children[_spawn(index, config, sock, time.monotonic())] = index
+    sock.close()
+    return exit_code
+
+
+def main():
+    started = time.monotonic()
+    parser = argparse.ArgumentParser(
+        description='Запуск приложения в нескольких воркерах'
+    )
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument(
+        '--workers', type=int,
+        help='по умолчанию число CPU, а с бэкендами memory:// - 1'
+    )
+    parser.add_argument(
+        '--warm-connections', type=int, default=settings.DB_POOL_SIZE,
+        help='соединений каждого пула, открываемых при старте воркера'
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format='%(levelname)s:     %(message)s'
+    )
+    local = get_process_local_settings()
+    if args.workers is None:
+        args.workers = 1 if local else os.cpu_count()
+        if local:
+            logger.warning(
+                'Starting 1 worker: %s use memory://', ', '.join(local)
+            )
+    elif args.workers > 1 and local:
+        parser.error(
+            f'{args.workers} workers require shared backends, '
+            f'set {", ".join(local)} to redis://...'
+        )
+    sys.exit(run(
+        args.host, args.port, args.workers, args.warm_connections, started
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Файлы вложений в MEDIA_ROOT/sha256/ab/cd/<sha256>: одинаковое
+# содержимое хранится один раз. Загрузка пишется во временный файл в
+# MEDIA_ROOT/tmp и переносится на место атомарно, поэтому по адресу
+# всегда лежит целый файл. Файлы не удаляются: на них могут ссылаться
+# другие вложения, в том числе на других шардах
+import hashlib
+import os
+import tempfile
+from contextlib import suppress
+from pathlib import Path
+
+from starlette.concurrency import run_in_threadpool
+
+from settings import settings
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def get_media_path(sha256):
+    return Path(
+        settings.MEDIA_ROOT, 'sha256', sha256[:2], sha256[2:4], sha256
+    )
+
+
+def _create_temp_file():
+    tmp_dir = Path(settings.MEDIA_ROOT, 'tmp')
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    return os.fdopen(fd, 'wb'), tmp_path
+
+
+def _write_chunk(file, digest, chunk):
+    # Хеш и запись в одном потоке, цикл событий не занят ни тем, ни другим
+    digest.update(chunk)
+    file.write(chunk)
+
+
+def _store_file(file, tmp_path, path):
+    file.close()
+    if path.exists():
+        os.unlink(tmp_path)
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def _discard_file(file, tmp_path):
+    file.close()
+    with suppress(FileNotFoundError):
+        os.unlink(tmp_path)
+
+
+async def save_stream(chunks, max_size):
+    # Сохраняет поток байтов по частям, не держа файл в памяти.
+    # Возвращает (sha256, размер)
+    file, tmp_path = await run_in_threadpool(_create_temp_file)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise FileTooLarge(max_size)
+            if chunk:
+                await run_in_threadpool(_write_chunk, file, digest, chunk)
+        sha256 = digest.hexdigest()
+        await run_in_threadpool(
+            _store_file, file, tmp_path, get_media_path(sha256)
+        )
+    except BaseException:
+        # В том числе обрыв соединения клиентом
+        await run_in_threadpool(_discard_file, file, tmp_path)
+        raise
+    return sha256, size
@@ -0,0 +1,265 @@
+import bisect
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from settings import settings
+from utils import get_pool_stats
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n'
+    )
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    labels = ','.join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return f'{{{labels}}}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, self.labelnames, labels, value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, description, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [счетчики по корзинам..., +Inf, сумма]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts))
+                      for labels, counts in self._values.items()]
+        bucket_labelnames = (*self.labelnames, 'le')
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                total += count
+                yield (
+                    f'{self.name}_bucket', bucket_labelnames,
+                    (*labels, bound), total
+                )
+            yield f'{self.name}_sum', self.labelnames, labels, counts[-1]
+            yield f'{self.name}_count', self.labelnames, labels, total
+
+
+class Gauge:
+    # Значения считываются в момент запроса /metrics
+    type = 'gauge'
+
+    def __init__(self, name, description, labelnames, collect):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name, self.labelnames, labels, value
+
+
+def _collect_pool_stats(key):
+    def collect():
+        for engine, stats in get_pool_stats().items():
+            if key in stats:
+                yield (engine,), stats[key]
+    return collect
+
+
+http_requests = Counter(
+    'http_requests_total', 'HTTP requests', ('method', 'route', 'status')
+)
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency',
+    ('method', 'route')
+)
+db_queries_per_request = Histogram(
+    'db_queries_per_request', 'SQL statements per HTTP request',
+    ('method', 'route'), buckets=QUERY_COUNT_BUCKETS
+)
+db_time_per_request = Histogram(
+    'db_time_per_request_seconds', 'Time spent in SQL per HTTP request',
+    ('method', 'route')
+)
+db_query_duration = Histogram(
+    'db_query_duration_seconds', 'SQL statement latency'
+)
+db_slow_queries = Counter(
+    'db_slow_queries_total', 'SQL statements slower than the threshold'
+)
+REGISTRY = [
+    http_requests,
+    http_request_duration,
+    db_queries_per_request,
+    db_time_per_request,
+    db_query_duration,
+    db_slow_queries,
+    Gauge(
+        'db_pool_checked_out', 'Connections checked out of the pool',
+        ('engine',), _collect_pool_stats('checked_out')
+    ),
+    Gauge(
+        'db_pool_checkouts', 'Connection checkouts since start',
+        ('engine',), _collect_pool_stats('checkouts')
+    ),
+    Gauge(
+        'db_pool_wait_seconds', 'Total time spent waiting for a connection',
+        ('engine',), _collect_pool_stats('wait_time_total')
+    ),
+]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labelnames, labels, value in metric.samples():
+            lines.append(
+                f'{name}{_format_labels(labelnames, labels)} {value}'
+            )
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Статистика текущего HTTP-запроса. Контекст копируется в задачи и
+# потоки, поэтому объект общий, а не значение
+request_stats = ContextVar('request_stats', default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    db_query_duration.observe((), elapsed)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+    threshold = settings.SLOW_QUERY_THRESHOLD
+    if threshold and elapsed >= threshold:
+        db_slow_queries.inc()
+        logger.warning('Slow query (%.3fs): %s', elapsed, statement)
+
+
+def listen_query_events():
+    # Все движки, включая sync_engine асинхронного
+    if not event.contains(
+        Engine, 'before_cursor_execute', _before_cursor_execute
+    ):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def get_route_template(scope):
+    # Шаблон пути, а не сам путь: число меток не растет с числом заметок
+    route = scope.get('route')
+    if route is None:
+        return 'unmatched'
+    template = route.path
+    # Маршрут вложенного роутера может хранить путь без префикса
+    # include_router, восстанавливаем его по фактическому пути
+    try:
+        suffix = template.format(**scope.get('path_params', {}))
+    except (KeyError, IndexError, ValueError):
+        return template
+    path = scope['path']
+    if path.endswith(suffix):
+        return path[:len(path) - len(suffix)] + template
+    return template
+
+
+class MetricsMiddleware:
+    # Чистый ASGI без BaseHTTPMiddleware: не буферизует ответ и не
+    # добавляет задач на каждый запрос
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_stats.reset(token)
+            labels = (scope['method'], get_route_template(scope))
+            http_requests.inc((*labels, status))
+            http_request_duration.observe(labels, elapsed)
+            db_queries_per_request.observe(labels, stats.queries)
+            db_time_per_request.observe(labels, stats.db_time)
@@ -0,0 +1,51 @@
+"""initial
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Базы, созданные через create_all() до появления миграций,
+    # уже содержат эти таблицы
+    existing_tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'user' not in existing_tables:
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(), nullable=False),
+            sa.Column('email', sa.String(), nullable=False),
+            sa.Column('password', sa.LargeBinary(), nullable=False),
+            sa.Column('is_admin', sa.Boolean(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('email'),
+        )
+    if 'note' not in existing_tables:
+        op.create_table(
+            'note',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(length=256), nullable=False),
+            sa.Column('body', sa.String(length=65536), nullable=False),
+            sa.Column('is_deleted', sa.Boolean(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(
+                ['user_id'], ['user.id'], ondelete='CASCADE'
+            ),
+            sa.PrimaryKeyConstraint('id'),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('note')
+    op.drop_table('user')
@@ -0,0 +1,36 @@
+"""note indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:10:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_note_user_id_is_deleted_id',
+        'note',
+        ['user_id', 'is_deleted', 'id'],
+    )
+    op.create_index(
+        'ix_note_user_id_id_not_deleted',
+        'note',
+        ['user_id', 'id'],
+        postgresql_where=sa.text('NOT is_deleted'),
+        sqlite_where=sa.text('is_deleted = 0'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_note_user_id_id_not_deleted', table_name='note')
+    op.drop_index('ix_note_user_id_is_deleted_id', table_name='note')
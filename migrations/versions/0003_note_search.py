@@ -0,0 +1,58 @@
+"""note full-text search
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 12:20:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+from settings import settings
+
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.add_column(
+            'note',
+            sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True)
+        )
+        op.execute(
+            sa.text(
+                'UPDATE note SET search_vector = to_tsvector('
+                "CAST(:config AS regconfig), title || ' ' || body)"
+            ).bindparams(config=settings.SEARCH_CONFIG)
+        )
+        op.create_index(
+            'ix_note_search_vector',
+            'note',
+            ['search_vector'],
+            postgresql_using='gin'
+        )
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE note_fts "
+            "USING fts5(title, body, tokenize='unicode61 remove_diacritics 2')"
+        )
+        op.execute(
+            'INSERT INTO note_fts (rowid, title, body) '
+            'SELECT id, title, body FROM note'
+        )
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_note_search_vector', table_name='note')
+        op.drop_column('note', 'search_vector')
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE note_fts')
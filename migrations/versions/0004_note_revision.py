@@ -0,0 +1,33 @@
+"""note revision
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:30:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'note',
+        sa.Column(
+            'revision',
+            sa.Integer(),
+            nullable=False,
+            server_default=sa.text('1')
+        )
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('note') as batch_op:
+        batch_op.drop_column('revision')
@@ -0,0 +1,73 @@
+"""note body compression
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 12:40:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from compressed import (MARKER, compress_text, decompress_text,
+                        from_base64_text, to_base64_text)
+from settings import settings
+
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+# До 0009 тело хранится в текстовой колонке
+TEXT_MARKER = MARKER.decode()
+
+note = sa.table(
+    'note',
+    sa.column('id', sa.Integer),
+    sa.column('body', sa.String),
+)
+
+
+def _convert_bodies(condition, convert):
+    # Проходим таблицу пачками по id, чтобы не держать ее в памяти
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(note.c.id, note.c.body).where(
+                note.c.id > last_id, condition
+            ).order_by(note.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        bind.execute(
+            note.update().where(
+                note.c.id == sa.bindparam('note_id')
+            ).values(body=sa.bindparam('new_body')),
+            [
+                {'note_id': note_id, 'new_body': convert(body)}
+                for note_id, body in rows
+            ]
+        )
+        last_id = rows[-1].id
+
+
+def upgrade() -> None:
+    _convert_bodies(
+        sa.or_(
+            sa.func.length(note.c.body)
+            >= settings.NOTE_BODY_COMPRESSION_THRESHOLD,
+            note.c.body.startswith(TEXT_MARKER)
+        ),
+        lambda body: to_base64_text(compress_text(body))
+    )
+
+
+def downgrade() -> None:
+    _convert_bodies(
+        note.c.body.startswith(TEXT_MARKER),
+        lambda body: decompress_text(from_base64_text(body))
+    )
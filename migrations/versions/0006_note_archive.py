@@ -0,0 +1,55 @@
+"""note archive
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 13:30:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'note',
+        sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True)
+    )
+    # Время удаления уже удаленных заметок неизвестно, срок хранения
+    # для них отсчитывается от миграции
+    note = sa.table(
+        'note',
+        sa.column('is_deleted', sa.Boolean),
+        sa.column('deleted_at', sa.DateTime(timezone=True)),
+    )
+    op.execute(
+        note.update().where(note.c.is_deleted == sa.true()).values(
+            deleted_at=sa.func.current_timestamp()
+        )
+    )
+    op.create_table(
+        'note_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('title', sa.String(length=256), nullable=False),
+        sa.Column('body', sa.String(length=65536), nullable=False),
+        sa.Column('revision', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['user_id'], ['user.id'], ondelete='CASCADE'
+        ),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('note_archive')
+    with op.batch_alter_table('note') as batch_op:
+        batch_op.drop_column('deleted_at')
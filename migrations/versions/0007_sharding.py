@@ -0,0 +1,36 @@
+"""sharding
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 16:00:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Все существующие пользователи остаются в основной базе
+    op.add_column(
+        'user',
+        sa.Column('shard', sa.Integer(), nullable=False, server_default='0')
+    )
+    op.create_table(
+        'note_id_sequence',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('next_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('note_id_sequence')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('shard')
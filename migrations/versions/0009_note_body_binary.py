@@ -0,0 +1,78 @@
+"""binary note body
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 20:00:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from compressed import from_base64_text, to_base64_text
+
+revision: str = '0009'
+down_revision: Union[str, None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+TABLES = ('note', 'note_archive')
+
+
+def _replace_body(table_name, old_type, new_type, convert):
+    # Значения пачками по id переносятся в новую колонку, которая затем
+    # заменяет старую
+    op.add_column(
+        table_name, sa.Column('new_body', new_type, nullable=True)
+    )
+    table = sa.table(
+        table_name,
+        sa.column('id', sa.Integer),
+        sa.column('body', old_type),
+        sa.column('new_body', new_type),
+    )
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(table.c.id, table.c.body).where(
+                table.c.id > last_id
+            ).order_by(table.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        bind.execute(
+            table.update().where(
+                table.c.id == sa.bindparam('row_id')
+            ).values(new_body=sa.bindparam('value')),
+            [
+                {'row_id': row_id, 'value': convert(body)}
+                for row_id, body in rows
+            ]
+        )
+        last_id = rows[-1].id
+    with op.batch_alter_table(table_name) as batch_op:
+        batch_op.drop_column('body')
+        batch_op.alter_column(
+            'new_body', new_column_name='body', existing_type=new_type,
+            nullable=False
+        )
+
+
+def upgrade() -> None:
+    # Сжатые тела хранились в base64 в текстовой колонке
+    for table_name in TABLES:
+        _replace_body(
+            table_name, sa.String(length=65536), sa.LargeBinary(),
+            from_base64_text
+        )
+
+
+def downgrade() -> None:
+    for table_name in TABLES:
+        _replace_body(
+            table_name, sa.LargeBinary(), sa.String(length=65536),
+            to_base64_text
+        )
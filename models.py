@@ -1,32 +1,233 @@
+from datetime import datetime
+from itertools import chain
 from typing import List, Optional
 
 from pydantic import EmailStr
+from sqlalchemy import (DDL, BigInteger, Column, DateTime, Index, Integer,
+                        event, text)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy_utils import PasswordType
 from sqlmodel import Field, Relationship, SQLModel
 
+from cache import response_cache
+from compressed import CompressedText
+from passwords import PASSWORD_CONTEXT_OPTIONS
+from tokens import token_denylist
+
+NOTE_CACHE_SCOPES_KEY = 'note_cache_scopes'
+
 
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str
     email: EmailStr = Field(unique=True)
     password: bytes = Field(
-        sa_type=PasswordType(
-            schemes=[
-                'pbkdf2_sha512',
-                'md5_crypt'
-            ],
-        )
+        sa_type=PasswordType(**PASSWORD_CONTEXT_OPTIONS)
     )
     is_admin: bool = Field(default=False)
+    # Шард с заметками пользователя, см. sharding.py
+    shard: int = Field(default=0)
+    # Шард, с которого идет незавершенный перенос
+    moving_from: Optional[int] = Field(default=None)
 
     notes: List["Note"] = Relationship(back_populates="user")
 
 
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _revoke_user_tokens(mapper, connection, target):
+    # Токен несет is_admin и username, после изменения он устарел
+    token_denylist.revoke_user(target.id)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _revoke_tokens_on_bulk(orm_execute_state):
+    # Массовые UPDATE/DELETE не вызывают событий маппера
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if any(
+        mapper.class_ is User for mapper in orm_execute_state.all_mappers
+    ):
+        token_denylist.revoke_all()
+
+
+# Номер ревизии заметки: SQLAlchemy увеличивает его при каждом UPDATE
+# и добавляет проверку старого значения в WHERE
+note_revision_column = Column('revision', Integer, nullable=False, default=1)
+
+
 class Note(SQLModel, table=True):
+    __table_args__ = (
+        # Все запросы пользователя фильтруют по user_id и is_deleted
+        # и сортируют/ищут по id
+        Index('ix_note_user_id_is_deleted_id', 'user_id', 'is_deleted', 'id'),
+        # Частичный индекс только по живым заметкам
+        Index(
+            'ix_note_user_id_id_not_deleted',
+            'user_id',
+            'id',
+            postgresql_where=text('NOT is_deleted'),
+            sqlite_where=text('is_deleted = 0'),
+        ),
+    )
+    __mapper_args__ = {'version_id_col': note_revision_column}
+
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str = Field(max_length=256)
-    body: str = Field(max_length=65536)
+    body: str = Field(max_length=65536, sa_type=CompressedText())
     is_deleted: bool = Field(default=False)
+    deleted_at: Optional[datetime] = Field(
+        default=None, sa_type=DateTime(timezone=True)
+    )
+    revision: int = Field(default=1, sa_column=note_revision_column)
 
     user_id: int = Field(foreign_key='user.id', ondelete='CASCADE')
     user: User = Relationship(back_populates='notes')
+
+
+class ArchivedNote(SQLModel, table=True):
+    # Давно удаленные заметки, перенесенные из note. id сохраняется,
+    # чтобы заметку можно было восстановить под прежним номером
+    __tablename__ = 'note_archive'
+
+    id: int = Field(
+        primary_key=True, sa_column_kwargs={'autoincrement': False}
+    )
+    title: str = Field(max_length=256)
+    body: str = Field(max_length=65536, sa_type=CompressedText())
+    revision: int
+    deleted_at: Optional[datetime] = Field(
+        default=None, sa_type=DateTime(timezone=True)
+    )
+    archived_at: datetime = Field(sa_type=DateTime(timezone=True))
+
+    user_id: int = Field(foreign_key='user.id', ondelete='CASCADE')
+
+
+class NoteIdSequence(SQLModel, table=True):
+    # Счетчики id заметок и вложений в основной базе: при шардировании
+    # id выдаются отсюда, чтобы не пересекаться между шардами и
+    # переноситься вместе с заметкой
+    __tablename__ = 'note_id_sequence'
+
+    name: str = Field(primary_key=True)
+    next_id: int
+
+
+class Attachment(SQLModel, table=True):
+    # Файл лежит в MEDIA_ROOT по SHA-256 содержимого (см. media.py) и
+    # может быть общим для нескольких вложений. Владелец - владелец
+    # заметки. note_id без внешнего ключа: вложения остаются при переносе
+    # заметки в архив и возвращаются вместе с ней
+    __tablename__ = 'note_attachment'
+    __table_args__ = (
+        Index('ix_note_attachment_note_id_id', 'note_id', 'id'),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    note_id: int
+    filename: str = Field(max_length=255)
+    content_type: str = Field(max_length=255)
+    size: int = Field(sa_type=BigInteger)
+    sha256: str = Field(max_length=64)
+    is_deleted: bool = Field(default=False)
+    deleted_at: Optional[datetime] = Field(
+        default=None, sa_type=DateTime(timezone=True)
+    )
+    created_at: datetime = Field(sa_type=DateTime(timezone=True))
+
+    user_id: int = Field(
+        foreign_key='user.id', ondelete='CASCADE', index=True
+    )
+
+
+# Полнотекстовый индекс не описывается моделью: в PostgreSQL это колонка
+# tsvector с GIN-индексом, в SQLite - отдельная таблица FTS5. Колонка
+# есть в таблице, но не в модели: ORM ее не читает, значение задается
+# в INSERT/UPDATE заметки (см. search.search_values)
+Note.__table__.append_column(
+    Column('search_vector', TSVECTOR, info={'dialect': 'postgresql'})
+)
+
+
+@compiles(CreateColumn)
+def _create_dialect_column(element, compiler, **kw):
+    # Колонка с info['dialect'] создается только в этой СУБД
+    dialect = element.element.info.get('dialect')
+    if dialect is not None and dialect != compiler.dialect.name:
+        return None
+    return compiler.visit_create_column(element, **kw)
+
+
+for ddl, dialect in (
+    (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts "
+        "USING fts5(title, body, tokenize='unicode61 remove_diacritics 2')",
+        'sqlite'
+    ),
+    (
+        'CREATE INDEX IF NOT EXISTS ix_note_search_vector '
+        'ON note USING gin (search_vector)',
+        'postgresql'
+    ),
+):
+    event.listen(
+        Note.__table__, 'after_create', DDL(ddl).execute_if(dialect=dialect)
+    )
+event.listen(
+    Note.__table__,
+    'after_drop',
+    DDL('DROP TABLE IF EXISTS note_fts').execute_if(dialect='sqlite')
+)
+
+
+def invalidate_note_cache(session, scopes):
+    # Кеш сбрасывается только после COMMIT, иначе параллельный запрос
+    # успеет закешировать еще не измененные данные
+    session.info.setdefault(NOTE_CACHE_SCOPES_KEY, set()).update(scopes)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_note_cache_scopes(session, flush_context):
+    user_ids = {
+        obj.user_id
+        for obj in chain(session.new, session.dirty, session.deleted)
+        if isinstance(obj, Note)
+    }
+    if user_ids:
+        invalidate_note_cache(
+            session, response_cache.get_owner_scopes(user_ids)
+        )
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_note_cache_scopes_on_bulk(orm_execute_state):
+    # Массовые изменения, для которых обработчик сам не указал владельцев
+    # заметок, сбрасывают весь кеш
+    if orm_execute_state.is_select:
+        return
+    if orm_execute_state.execution_options.get(
+        'note_cache_invalidation'
+    ) == 'manual':
+        return
+    if any(
+        mapper.class_ is Note for mapper in orm_execute_state.all_mappers
+    ):
+        invalidate_note_cache(
+            orm_execute_state.session, {response_cache.GLOBAL_SCOPE}
+        )
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_note_cache(session):
+    scopes = session.info.pop(NOTE_CACHE_SCOPES_KEY, None)
+    if scopes:
+        response_cache.invalidate(scopes)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_note_cache_scopes(session, previous_transaction):
+    session.info.pop(NOTE_CACHE_SCOPES_KEY, None)
@@ -0,0 +1,81 @@
+import asyncio
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+from settings import settings
+
+# Параметры общие для колонки User.password и пула проверки паролей.
+# Хеши устаревших схем и хеши с меньшим числом раундов, чем задано
+# в настройках, пересчитываются при успешном входе
+PASSWORD_CONTEXT_OPTIONS = {
+    'schemes': ['pbkdf2_sha512', 'md5_crypt'],
+    'deprecated': ['md5_crypt'],
+    'pbkdf2_sha512__default_rounds': settings.PASSWORD_HASH_ROUNDS,
+    'pbkdf2_sha512__min_rounds': settings.PASSWORD_HASH_ROUNDS,
+}
+
+password_context = CryptContext(**PASSWORD_CONTEXT_OPTIONS)
+
+_executor = None
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _verify_and_update(password, password_hash):
+    return password_context.verify_and_update(password, password_hash)
+
+
+def _dummy_verify():
+    return password_context.dummy_verify()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: дочерние процессы не наследуют потоки и соединения
+        # приложения
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor
+
+
+def _get_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(
+            settings.PASSWORD_HASH_CONCURRENCY
+        )
+    return semaphore
+
+
+async def _run(func, *args):
+    # KDF занимает процессор на десятки миллисекунд, в цикле событий он
+    # остановил бы все остальные запросы воркера. Семафор ограничивает
+    # очередь к пулу: лишние запросы ждут здесь, не занимая память пула
+    async with _get_semaphore():
+        return await asyncio.get_running_loop().run_in_executor(
+            _get_executor(), func, *args
+        )
+
+
+async def verify_password(password, password_hash):
+    # Возвращает (верен ли пароль, новый хеш или None)
+    return await _run(_verify_and_update, password, password_hash)
+
+
+async def dummy_verify_password():
+    # Для несуществующего пользователя: время ответа не выдает,
+    # есть ли такой логин
+    await _run(_dummy_verify)
+
+
+def shutdown_password_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
@@ -1,4 +1,15 @@
-from pydantic import BaseModel
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, model_validator
+
+from settings import settings
+
+
+class NoteBodyMode(str, Enum):
+    full = 'full'
+    preview = 'preview'
+    none = 'none'
 
 
 class NoteModel(BaseModel):
@@ -13,5 +24,72 @@ class NoteModelResponse(BaseModel):
     user_id: int
 
 
+class NotePatchResponse(NoteModelResponse):
+    revision: int
+
+
+class NoteTextEdit(BaseModel):
+    # Замена символов [start, end) тела заметки на text
+    start: int = Field(ge=0)
+    end: int = Field(ge=0)
+    text: str = ''
+
+    @model_validator(mode='after')
+    def check_range(self):
+        if self.end < self.start:
+            raise ValueError('end must not be less than start')
+        return self
+
+
+class NotePatch(BaseModel):
+    title: Optional[str] = None
+    body: Optional[str] = None
+    # Правки применяются к телу той ревизии, относительно которой они
+    # посчитаны, позиции - в символах исходного тела
+    edits: Optional[List[NoteTextEdit]] = None
+    revision: Optional[int] = None
+
+    @model_validator(mode='after')
+    def check_body(self):
+        if self.body is not None and self.edits is not None:
+            raise ValueError('body and edits are mutually exclusive')
+        if self.edits is not None and self.revision is None:
+            raise ValueError('edits require revision')
+        return self
+
+
+class NoteListItemResponse(BaseModel):
+    id: int
+    title: str
+    body: Optional[str] = None
+    user_id: int
+
+
+class NoteBatchCreate(BaseModel):
+    notes: List[NoteModel] = Field(
+        min_length=1, max_length=settings.NOTES_BATCH_MAX_SIZE
+    )
+
+
+class NoteBatchIds(BaseModel):
+    ids: List[int] = Field(
+        min_length=1, max_length=settings.NOTES_BATCH_MAX_SIZE
+    )
+
+
+class NoteBatchItemResult(BaseModel):
+    id: int
+    status: int
+
+
+class AttachmentResponse(BaseModel):
+    id: int
+    note_id: int
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+
 class SuccessOK(BaseModel):
     success: str = 'ok'
@@ -0,0 +1,98 @@
+import re
+
+from sqlalchemy import (cast, column, delete, func, insert, literal_column,
+                        table)
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlmodel import select
+
+from models import Note
+from settings import settings
+
+note_fts = table('note_fts', column('rowid'), column('title'), column('body'))
+search_vector = Note.__table__.c.search_vector
+
+SEARCH_OBJECTS = {'note_fts', 'search_vector', 'ix_note_search_vector'}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    # Для alembic: объекты поиска создаются миграциями, а не моделями
+    if name in SEARCH_OBJECTS or (name or '').startswith('note_fts_'):
+        return False
+    return True
+
+
+def _fts5_query(query):
+    # Каждое слово в кавычках: пользовательский ввод не ломает синтаксис
+    # MATCH, слова объединяются через AND
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def search_values(dialect, title, body):
+    # Значения для INSERT/UPDATE заметки: в PostgreSQL tsvector считается
+    # в том же запросе, что и запись заметки
+    if dialect != 'postgresql':
+        return {}
+    return {
+        'search_vector': func.to_tsvector(
+            cast(settings.SEARCH_CONFIG, REGCONFIG), f'{title} {body}'
+        )
+    }
+
+
+async def index_notes(session, notes):
+    # notes - последовательность (id, title, body). Нужна только в SQLite:
+    # в PostgreSQL индекс пишется самой заметкой через search_values
+    if session.bind.dialect.name != 'sqlite':
+        return
+    notes = [
+        {'rowid': note_id, 'title': title, 'body': body}
+        for note_id, title, body in notes
+    ]
+    if not notes:
+        return
+    await session.exec(
+        delete(note_fts).where(
+            note_fts.c.rowid.in_([note['rowid'] for note in notes])
+        )
+    )
+    await session.exec(insert(note_fts).values(notes))
+
+
+async def unindex_notes(session, note_ids):
+    # В PostgreSQL индекс хранится в строке заметки и удаляется вместе с ней
+    if note_ids and session.bind.dialect.name == 'sqlite':
+        await session.exec(
+            delete(note_fts).where(note_fts.c.rowid.in_(note_ids))
+        )
+
+
+def search_notes_query(dialect, query, columns, with_rank=False):
+    # with_rank добавляет колонку rank (меньше - релевантнее), по ней
+    # сливаются результаты с разных шардов
+    if dialect == 'postgresql':
+        ts_query = func.websearch_to_tsquery(
+            cast(settings.SEARCH_CONFIG, REGCONFIG), query
+        )
+        rank = -func.ts_rank(search_vector, ts_query)
+        notes_query = select(*columns).filter(
+            search_vector.op('@@')(ts_query)
+        )
+    elif dialect == 'sqlite':
+        fts_query = _fts5_query(query)
+        if not fts_query:
+            return None
+        # В FTS5 меньший bm25 означает более релевантный документ
+        rank = func.bm25(literal_column('note_fts'))
+        notes_query = select(*columns).join(
+            note_fts, note_fts.c.rowid == Note.id
+        ).filter(
+            literal_column('note_fts').op('MATCH')(fts_query)
+        )
+    else:
+        raise NotImplementedError(
+            f'Full-text search is not supported for {dialect}'
+        )
+    if with_rank:
+        notes_query = notes_query.add_columns(rank.label('rank'))
+    return notes_query.order_by(rank, Note.id)
@@ -0,0 +1,14 @@
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value):
+    # Компактный JSON в UTF-8 без экранирования не-ASCII, как у
+    # model_dump_json в pydantic. orjson быстрее, если установлен
+    if orjson is not None:
+        return orjson.dumps(value)
+    return to_json(value)
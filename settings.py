@@ -1,10 +1,107 @@
+from typing import List, Optional
+
+from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# Ключи-заглушки, с которыми приложение не запускается
+INSECURE_SECRET_KEYS = {'', 'change-me'}
+
 
 class Settings(BaseSettings):
     class Config(SettingsConfigDict):
         env_file = '.env'
     DB_URL: str = "sqlite:///db.sqlite3"
+    # По умолчанию выводится из DB_URL: aiosqlite для SQLite,
+    # asyncpg для PostgreSQL
+    ASYNC_DB_URL: Optional[str] = None
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # При старте воркера: проверить версию схемы и применить миграции,
+    # открыть DB_POOL_WARMUP соединений каждого пула (0 - не открывать).
+    # python -m launcher проверяет схему сам, до запуска воркеров
+    DB_SCHEMA_CHECK: bool = True
+    DB_POOL_WARMUP: int = 0
+    # Реплики для чтения (URL как у DB_URL, асинхронный драйвер выводится
+    # так же). GET-запросы идут на реплику, кроме запросов пользователя,
+    # писавшего в последние DB_REPLICA_STICKINESS секунд. Реплика с
+    # ошибкой соединения исключается на DB_REPLICA_RETRY_INTERVAL секунд
+    DB_REPLICA_URLS: List[str] = []
+    DB_REPLICA_STICKINESS: float = 5
+    DB_REPLICA_STICKY_URL: str = 'memory://'
+    DB_REPLICA_STICKY_MAXSIZE: int = 100000
+    DB_REPLICA_RETRY_INTERVAL: float = 30
+    # Дополнительные базы для заметок (шарды 1, 2, ...), шард 0 - DB_URL.
+    # Пользователь переносится между шардами командой python -m sharding,
+    # id заметок выдаются блоками по NOTE_ID_BLOCK_SIZE из основной базы
+    DB_SHARD_URLS: List[str] = []
+    NOTE_ID_BLOCK_SIZE: int = 100
+    NOTES_PAGE_SIZE: int = 100
+    NOTES_MAX_PAGE_SIZE: int = 1000
+    NOTE_PREVIEW_LENGTH: int = 200
+    # zlib, zstd (нужен пакет zstandard) или none
+    NOTE_BODY_COMPRESSION: str = 'zlib'
+    NOTE_BODY_COMPRESSION_LEVEL: int = 6
+    NOTE_BODY_COMPRESSION_THRESHOLD: int = 1024
+    NOTES_EXPORT_BATCH_SIZE: int = 1000
+    NOTES_BATCH_MAX_SIZE: int = 1000
+    # Удаленные заметки старше срока хранения (секунды) переносятся
+    # в архив фоновой задачей раз в NOTES_ARCHIVE_INTERVAL секунд,
+    # 0 выключает задачу (архивацию можно запускать через python -m archive)
+    NOTES_ARCHIVE_RETENTION: int = 30 * 24 * 3600
+    NOTES_ARCHIVE_INTERVAL: int = 3600
+    NOTES_ARCHIVE_BATCH_SIZE: int = 1000
+    # Вложения заметок: файлы в MEDIA_ROOT по SHA-256 содержимого,
+    # загрузка больше ATTACHMENT_MAX_SIZE байт отклоняется с 413
+    MEDIA_ROOT: str = 'media'
+    ATTACHMENT_MAX_SIZE: int = 50 * 1024 * 1024
+    # Поток событий заметок (GET /api/notes/events): пинг раз в
+    # NOTE_EVENTS_PING_INTERVAL секунд, до NOTE_EVENTS_QUEUE_SIZE
+    # недоставленных событий на подключение, дальше клиент получает resync
+    NOTE_EVENTS_PING_INTERVAL: float = 15
+    NOTE_EVENTS_QUEUE_SIZE: int = 100
+    # Конфигурация текстового поиска PostgreSQL
+    SEARCH_CONFIG: str = 'simple'
+    # Ключ подписи токенов, обязателен: значения по умолчанию нет
+    SECRET_KEY: str
+    # Хеширование паролей выполняется в пуле процессов: число процессов
+    # и число одновременных проверок на воркер приложения
+    PASSWORD_HASH_ROUNDS: int = 25000
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_CONCURRENCY: int = 32
+    ACCESS_TOKEN_TTL: int = 3600
+    # memory:// - в памяти процесса, redis://... - общий для воркеров.
+    # Записи не вытесняются: Redis списка отзыва отдельный, с
+    # maxmemory-policy noeviction, в памяти при TOKEN_DENYLIST_MAXSIZE
+    # неистекших записей отзыв завершается ошибкой
+    TOKEN_DENYLIST_URL: str = 'memory://'
+    TOKEN_DENYLIST_MAXSIZE: int = 100000
+    # Кеш ответов чтения заметок; none:// выключает кеширование
+    RESPONSE_CACHE_URL: str = 'memory://'
+    RESPONSE_CACHE_MAXSIZE: int = 10000
+    RESPONSE_CACHE_TTL: int = 300
+    # Метрики Prometheus на /metrics и журнал медленных запросов к БД
+    # (порог в секундах, 0 выключает журнал)
+    METRICS_ENABLED: bool = True
+    SLOW_QUERY_THRESHOLD: float = 0.5
+    # Отладочная трасса SQL-запросов по заголовку X-Debug-Trace от админа:
+    # хранится QUERY_TRACE_MAXSIZE последних трасс, EXPLAIN выполняется
+    # для QUERY_TRACE_EXPLAIN самых медленных запросов. В нескольких
+    # воркерах трассы хранятся в общем QUERY_TRACE_URL (redis://...)
+    QUERY_TRACE_ENABLED: bool = False
+    QUERY_TRACE_EXPLAIN: int = 3
+    QUERY_TRACE_URL: str = 'memory://'
+    QUERY_TRACE_MAXSIZE: int = 100
+    QUERY_TRACE_TTL: int = 600
+
+    @field_validator('SECRET_KEY')
+    @classmethod
+    def check_secret_key(cls, value):
+        if value.strip() in INSECURE_SECRET_KEYS:
+            raise ValueError('SECRET_KEY must be set to a secret value')
+        return value
 
 
 settings = Settings()
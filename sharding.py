@@ -0,0 +1,355 @@
+# Шардирование заметок по пользователям.
+#
+# Пользователи живут в основной базе (шард 0), заметки, архив заметок и
+# вложения пользователя - на шарде User.shard. На шардах, кроме основного,
+# хранится копия строки пользователя для внешних ключей. Перенос пользователя:
+# python -m sharding USER_ID SHARD
+import argparse
+import asyncio
+import heapq
+import threading
+from functools import partial
+from typing import Annotated
+
+from fastapi import Depends, Request
+from sqlalchemy import exists, or_
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import delete, func, insert, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from cache import is_process_local, response_cache
+from models import ArchivedNote, Attachment, Note, NoteIdSequence, User
+from search import index_notes, search_values, unindex_notes
+from settings import settings
+from utils import (create_async_session, get_current_user,
+                   open_request_session, shards)
+
+NOTE_ID_SEQUENCE = 'note'
+ATTACHMENT_ID_SEQUENCE = 'attachment'
+NOTE_COLUMNS = (
+    'id', 'title', 'body', 'is_deleted', 'deleted_at', 'revision', 'user_id'
+)
+ARCHIVED_NOTE_COLUMNS = (
+    'id', 'title', 'body', 'revision', 'deleted_at', 'archived_at', 'user_id'
+)
+ATTACHMENT_COLUMNS = (
+    'id', 'note_id', 'filename', 'content_type', 'size', 'sha256',
+    'is_deleted', 'deleted_at', 'created_at', 'user_id'
+)
+USER_COLUMNS = ('id', 'username', 'email', 'password', 'is_admin', 'shard')
+
+
+async def for_each_shard(fn, session=None):
+    # fn(session) на всех шардах параллельно, каждый в своей сессии.
+    # Без шардирования используется переданная сессия запроса
+    if len(shards) == 1 and session is not None:
+        return [await fn(session)]
+
+    async def _run(shard):
+        async with create_async_session(
+            shards.get_engine(shard)
+        ) as shard_session:
+            return await fn(shard_session)
+
+    return await asyncio.gather(*map(_run, range(len(shards))))
+
+
+async def merge_streams(streams, key):
+    # Слияние асинхронных потоков строк, упорядоченных по key
+    streams = [aiter(stream) for stream in streams]
+    heap = []
+    for index, stream in enumerate(streams):
+        row = await anext(stream, None)
+        if row is not None:
+            heap.append((key(row), index, row))
+    heapq.heapify(heap)
+    while heap:
+        _, index, row = heap[0]
+        yield row
+        row = await anext(streams[index], None)
+        if row is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (key(row), index, row))
+
+
+async def _get_max_id(models, session):
+    max_id = 0
+    for model in models:
+        result = await session.exec(select(func.max(model.id)))
+        max_id = max(max_id, result.one() or 0)
+    return max_id
+
+
+async def _reserve_ids(name, models, size):
+    async with create_async_session() as session:
+        result = await session.exec(
+            update(NoteIdSequence).filter(
+                NoteIdSequence.name == name
+            ).values(
+                next_id=NoteIdSequence.next_id + size
+            ).returning(NoteIdSequence.next_id)
+        )
+        end = result.scalar_one_or_none()
+        if end is not None:
+            await session.commit()
+            return end - size, end
+        # Первый запуск с шардами: продолжаем после уже выданных id
+        start = max(
+            await for_each_shard(partial(_get_max_id, models))
+        ) + 1
+        session.add(NoteIdSequence(name=name, next_id=start + size))
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Счетчик одновременно создал другой процесс
+            await session.rollback()
+            return await _reserve_ids(name, models, size)
+        return start, start + size
+
+
+class IdAllocator:
+    # Блок id резервируется одним UPDATE счетчика name в основной базе и
+    # раздается из памяти процесса. Неиспользованные id блока пропадают
+    # при остановке
+
+    def __init__(self, name, models, block_size=None):
+        self.name = name
+        self.models = models
+        self.block_size = block_size or settings.NOTE_ID_BLOCK_SIZE
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _take(self, count):
+        with self._lock:
+            start = self._next
+            self._next = min(self._end, start + count)
+            return list(range(start, self._next))
+
+    async def allocate(self, count):
+        ids = self._take(count)
+        while len(ids) < count:
+            missing = count - len(ids)
+            start, end = await _reserve_ids(
+                self.name, self.models, max(self.block_size, missing)
+            )
+            ids.extend(range(start, start + missing))
+            with self._lock:
+                if self._next >= self._end:
+                    self._next, self._end = start + missing, end
+        return ids
+
+    def reset(self):
+        with self._lock:
+            self._next = self._end = 0
+
+
+note_id_allocator = IdAllocator(NOTE_ID_SEQUENCE, (Note, ArchivedNote))
+# Вложения переносятся между шардами вместе с заметками, поэтому их id
+# тоже не должны пересекаться
+attachment_id_allocator = IdAllocator(ATTACHMENT_ID_SEQUENCE, (Attachment,))
+
+
+async def assign_ids(rows, allocator):
+    # rows - словари новых строк. Без шардирования id выдает БД
+    if len(shards) > 1:
+        row_ids = await allocator.allocate(len(rows))
+        for row, row_id in zip(rows, row_ids):
+            row['id'] = row_id
+    return rows
+
+
+async def assign_note_ids(notes):
+    return await assign_ids(notes, note_id_allocator)
+
+
+async def find_note_shard(note_id):
+    async def _has_note(session):
+        result = await session.exec(select(or_(
+            exists().where(Note.id == note_id),
+            exists().where(ArchivedNote.id == note_id)
+        )))
+        return result.one()
+
+    found = await for_each_shard(_has_note)
+    return found.index(True) if True in found else None
+
+
+async def get_note_session(
+    request: Request,
+    current_user: Annotated[User, Depends(get_current_user)],
+):
+    shard = current_user.shard
+    note_id = request.path_params.get('note_id', '')
+    if current_user.is_admin and note_id.isdigit() and len(shards) > 1:
+        # Админ работает с чужими заметками: шард ищется по id заметки
+        note_shard = await find_note_shard(int(note_id))
+        if note_shard is not None:
+            shard = note_shard
+    async with open_request_session(
+        request, current_user.id, shard
+    ) as session:
+        yield session
+
+
+NoteSessionDep = Annotated[AsyncSession, Depends(get_note_session)]
+
+
+async def _copy_rows(source, target, model, columns, user_id, batch_size):
+    # Копирует строки пользователя пачками, возвращает id по пачкам
+    batches = []
+    last_id = 0
+    while True:
+        result = await source.exec(
+            select(*(getattr(model, column) for column in columns)).filter(
+                model.user_id == user_id, model.id > last_id
+            ).order_by(model.id).limit(batch_size)
+        )
+        rows = result.all()
+        if not rows:
+            return batches
+        ids = [row.id for row in rows]
+        # Строки, уже скопированные прерванным переносом, пропускаются:
+        # на целевом шарде они могли измениться после копирования
+        result = await target.exec(select(model.id).filter(model.id.in_(ids)))
+        copied = set(result.all())
+        rows = [row for row in rows if row.id not in copied]
+        if rows:
+            dialect = target.bind.dialect.name
+            await target.exec(
+                insert(model).values([
+                    {
+                        **row._asdict(),
+                        **(
+                            search_values(dialect, row.title, row.body)
+                            if model is Note else {}
+                        ),
+                    }
+                    for row in rows
+                ]).execution_options(note_cache_invalidation='manual')
+            )
+            if model is Note:
+                await index_notes(
+                    target, [(row.id, row.title, row.body) for row in rows]
+                )
+        batches.append(ids)
+        last_id = ids[-1]
+
+
+async def move_user(user_id, target_shard, batch_size=None):
+    batch_size = batch_size or settings.NOTES_EXPORT_BATCH_SIZE
+    if not 0 <= target_shard < len(shards):
+        raise ValueError(f'Unknown shard {target_shard}')
+    # Перенос идет в отдельном процессе: с memory:// отзыв токенов и
+    # инвалидация кеша не дошли бы до серверов приложения, и старые токены
+    # продолжали бы писать в исходный шард
+    local = [
+        name for name in ('TOKEN_DENYLIST_URL', 'RESPONSE_CACHE_URL')
+        if is_process_local(getattr(settings, name))
+    ]
+    if local:
+        raise RuntimeError(
+            f'Moving users requires shared backends, set '
+            f'{", ".join(local)} to redis://...'
+        )
+    async with create_async_session() as session:
+        user = await session.get(User, user_id)
+        if user is None:
+            raise ValueError(f'User {user_id} not found')
+        if user.moving_from is None:
+            if user.shard == target_shard:
+                return 0
+            # Сначала переключаем пользователя: изменение User отзывает его
+            # токены, новые указывают на новый шард, и в старый больше
+            # никто не пишет. Пока идет копирование, часть заметок не
+            # видна. Исходный шард хранится до конца переноса: прерванный
+            # перенос продолжается повторным запуском
+            user.moving_from = user.shard
+            user.shard = target_shard
+            await session.commit()
+        elif user.shard != target_shard:
+            raise ValueError(
+                f'User {user_id} is being moved to shard {user.shard}'
+            )
+        source_shard = user.moving_from
+        user_row = {column: getattr(user, column) for column in USER_COLUMNS}
+    user_table = User.__table__
+    async with create_async_session(
+        shards.get_engine(source_shard)
+    ) as source, create_async_session(
+        shards.get_engine(target_shard)
+    ) as target:
+        # Строки пользователя меняются в обход ORM: события User отозвали
+        # бы токены всех пользователей
+        if target_shard != 0:
+            result = await target.exec(
+                select(user_table.c.id).where(user_table.c.id == user_id)
+            )
+            if result.first() is None:
+                await target.exec(insert(user_table).values(user_row))
+        note_batches = await _copy_rows(
+            source, target, Note, NOTE_COLUMNS, user_id, batch_size
+        )
+        await _copy_rows(
+            source, target, ArchivedNote, ARCHIVED_NOTE_COLUMNS, user_id,
+            batch_size
+        )
+        # Файлы вложений общие для всех шардов, переносятся только строки
+        await _copy_rows(
+            source, target, Attachment, ATTACHMENT_COLUMNS, user_id,
+            batch_size
+        )
+        await target.commit()
+        for note_ids in note_batches:
+            await source.exec(
+                delete(Note).filter(Note.id.in_(note_ids)).execution_options(
+                    synchronize_session=False,
+                    note_cache_invalidation='manual'
+                )
+            )
+            await unindex_notes(source, note_ids)
+        await source.exec(
+            delete(ArchivedNote).filter(ArchivedNote.user_id == user_id)
+        )
+        await source.exec(
+            delete(Attachment).filter(Attachment.user_id == user_id)
+        )
+        if source_shard != 0:
+            await source.exec(
+                delete(user_table).where(user_table.c.id == user_id)
+            )
+        await source.commit()
+    async with create_async_session() as session:
+        await session.exec(
+            update(user_table).where(user_table.c.id == user_id).values(
+                moving_from=None
+            )
+        )
+        await session.commit()
+    response_cache.invalidate(response_cache.get_owner_scopes([user_id]))
+    return sum(map(len, note_batches))
+
+
+async def _main(user_id, shard, batch_size):
+    moved = await move_user(user_id, shard, batch_size)
+    print(f'Moved {moved} notes of user {user_id} to shard {shard}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Перенос заметок пользователя на другой шард'
+    )
+    parser.add_argument('user_id', type=int)
+    parser.add_argument(
+        'shard', type=int, help='0 - основная база, N - DB_SHARD_URLS[N-1]'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=settings.NOTES_EXPORT_BATCH_SIZE
+    )
+    args = parser.parse_args()
+    asyncio.run(_main(args.user_id, args.shard, args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
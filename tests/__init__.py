@@ -0,0 +1,4 @@
+import os
+
+# settings требует SECRET_KEY, тесты подписывают токены своим ключом
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
@@ -1,11 +1,14 @@
+import asyncio
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy_utils import create_database, database_exists, drop_database
 from sqlmodel import SQLModel, delete
 
 from app import app
+from cache import response_cache
 from models import Note, User
-from utils import get_session, get_subject
+from utils import _get_async_engine, get_session, get_subject
 
 
 @pytest.fixture(scope='module')
@@ -14,6 +17,11 @@ def test_session():
     if database_exists(session.bind.engine.url):
         drop_database(session.bind.engine.url)
     create_database(session.bind.engine.url)
+    # Соединения пула могли остаться открытыми к удаленной базе
+    session.bind.engine.dispose()
+    asyncio.run(_get_async_engine().dispose())
+    # База пересоздана в обход приложения
+    response_cache.invalidate({response_cache.GLOBAL_SCOPE})
     SQLModel.metadata.create_all(session.bind.engine)
     yield session
     session.close()
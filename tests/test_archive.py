@@ -0,0 +1,113 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlmodel import select
+
+from archive import archive_deleted_notes
+from models import ArchivedNote, Note
+from utils import create_async_session
+
+
+def _archive(**kwargs):
+    async def _run():
+        async with create_async_session() as session:
+            return await archive_deleted_notes(session, **kwargs)
+    return asyncio.run(_run())
+
+
+def test_archive_deleted_notes(
+    test_session,
+    get_user,
+    get_authorized_client,
+    get_note
+):
+    admin = get_user(
+        username='admin',
+        email='admin@test.com',
+        password='admin',
+        is_admin=True
+    )
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    old = datetime.now(timezone.utc) - timedelta(days=60)
+    old_notes = [
+        get_note(f'old {i}', f'archived body {i}', user.id, is_deleted=True)
+        for i in range(3)
+    ]
+    recent_note = get_note('recent', 'body', user.id, is_deleted=True)
+    live_note = get_note('live', 'body', user.id)
+    # Последнюю заметку архивировать нельзя, даже если она удалена давно
+    last_note = get_note('last', 'body', user.id, is_deleted=True)
+    for note in [*old_notes, last_note]:
+        note.deleted_at = old
+        test_session.add(note)
+    recent_note.deleted_at = datetime.now(timezone.utc)
+    test_session.add(recent_note)
+    test_session.commit()
+    old_ids = [note.id for note in old_notes]
+
+    assert _archive(retention=30 * 24 * 3600, batch_size=2) == 3
+    assert _archive(retention=30 * 24 * 3600) == 0
+    test_session.expire_all()
+    assert set(test_session.exec(select(Note.id)).all()) == {
+        recent_note.id, live_note.id, last_note.id
+    }
+    archived = test_session.exec(
+        select(ArchivedNote).order_by(ArchivedNote.id)
+    ).all()
+    assert [note.id for note in archived] == old_ids
+    assert archived[0].body == 'archived body 0'
+
+    admin_client = get_authorized_client(admin)
+    response = admin_client.get(f'/api/notes/{old_ids[0]}')
+    assert response.status_code == 404
+
+    response = admin_client.post(f'/api/notes/{old_ids[0]}/restore')
+    assert response.status_code == 200
+    assert response.json() == {
+        'id': old_ids[0],
+        'title': 'old 0',
+        'body': 'archived body 0',
+        'user_id': user.id
+    }
+    assert response.headers['ETag'] == f'"{old_ids[0]}-3"'
+
+    response = admin_client.post(
+        '/api/notes/batch/restore',
+        json={'ids': [old_ids[1], old_ids[2], 0]}
+    )
+    assert [item['status'] for item in response.json()] == [200, 200, 404]
+    test_session.expire_all()
+    assert test_session.exec(select(ArchivedNote)).all() == []
+
+    user_client = get_authorized_client(user)
+    response = user_client.get('/api/notes', params={'body': 'none'})
+    assert [note['id'] for note in response.json()] == [
+        *old_ids, live_note.id
+    ]
+    response = user_client.get('/api/notes/search', params={'q': 'archived'})
+    assert len(response.json()) == 3
+
+
+def test_delete_note_sets_deleted_at(
+    test_session,
+    get_user,
+    get_authorized_client,
+    get_note
+):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    notes = [get_note(f'title {i}', 'body', user.id) for i in range(2)]
+    auth_client = get_authorized_client(user)
+    auth_client.delete(f'/api/notes/{notes[0].id}')
+    auth_client.post('/api/notes/batch/delete', json={'ids': [notes[1].id]})
+    for note in notes:
+        test_session.refresh(note)
+        assert note.is_deleted
+        assert note.deleted_at is not None
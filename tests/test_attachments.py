@@ -0,0 +1,144 @@
+import hashlib
+from http import HTTPStatus
+
+import pytest
+from sqlmodel import delete
+
+from media import get_media_path
+from models import Attachment
+from settings import settings
+
+CONTENT = b'0123456789' * 1000
+
+
+@pytest.fixture(autouse=True)
+def media_root(tmp_path, test_session, monkeypatch):
+    monkeypatch.setattr(settings, 'MEDIA_ROOT', str(tmp_path))
+    yield tmp_path
+    test_session.exec(delete(Attachment))
+    test_session.commit()
+
+
+def _upload(client, note_id, content=CONTENT, filename='data.txt'):
+    return client.post(
+        f'/api/notes/{note_id}/attachments/',
+        params={'filename': filename},
+        content=content,
+        headers={'Content-Type': 'text/plain'}
+    )
+
+
+def test_upload_and_download(get_user, get_note, get_authorized_client):
+    user = get_user(username='test', email='test@test.com', password='test')
+    note = get_note('title', 'body', user.id)
+    auth_client = get_authorized_client(user)
+
+    response = _upload(auth_client, note.id, filename='../dir/data.txt')
+    assert response.status_code == HTTPStatus.OK
+    attachment = response.json()
+    sha256 = hashlib.sha256(CONTENT).hexdigest()
+    assert attachment['filename'] == 'data.txt'
+    assert attachment['size'] == len(CONTENT)
+    assert attachment['sha256'] == sha256
+    assert get_media_path(sha256).read_bytes() == CONTENT
+
+    url = f'/api/notes/{note.id}/attachments/{attachment["id"]}'
+    response = auth_client.get(url)
+    assert response.status_code == HTTPStatus.OK
+    assert response.content == CONTENT
+    assert response.headers['content-type'].startswith('text/plain')
+    assert response.headers['etag'] == f'"{sha256}"'
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert 'filename="data.txt"' in response.headers['content-disposition']
+
+    response = auth_client.get(url, headers={'Range': 'bytes=10-19'})
+    assert response.status_code == HTTPStatus.PARTIAL_CONTENT
+    assert response.content == CONTENT[10:20]
+    assert response.headers['content-range'] == f'bytes 10-19/{len(CONTENT)}'
+
+    response = auth_client.get(url, headers={'If-None-Match': f'"{sha256}"'})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    response = auth_client.get(f'/api/notes/{note.id}/attachments/')
+    assert [item['id'] for item in response.json()] == [attachment['id']]
+
+
+def test_same_content_stored_once(
+    get_user, get_note, get_authorized_client, media_root
+):
+    user = get_user(username='test', email='test@test.com', password='test')
+    notes = [get_note(f'note {i}', 'body', user.id) for i in range(2)]
+    auth_client = get_authorized_client(user)
+
+    attachments = [
+        _upload(auth_client, note.id, filename=f'{note.id}.txt').json()
+        for note in notes
+    ]
+    assert attachments[0]['id'] != attachments[1]['id']
+    assert attachments[0]['sha256'] == attachments[1]['sha256']
+    stored = [path for path in media_root.rglob('*') if path.is_file()]
+    assert stored == [get_media_path(attachments[0]['sha256'])]
+
+
+def test_upload_too_large(
+    get_user, get_note, get_authorized_client, media_root, monkeypatch
+):
+    monkeypatch.setattr(settings, 'ATTACHMENT_MAX_SIZE', len(CONTENT) - 1)
+    user = get_user(username='test', email='test@test.com', password='test')
+    note = get_note('title', 'body', user.id)
+    auth_client = get_authorized_client(user)
+
+    response = _upload(auth_client, note.id)
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+    # Без Content-Length размер проверяется во время записи
+    response = _upload(auth_client, note.id, content=iter([CONTENT]))
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+    assert not [path for path in media_root.rglob('*') if path.is_file()]
+    response = auth_client.get(f'/api/notes/{note.id}/attachments/')
+    assert response.json() == []
+
+
+def test_attachment_access(get_user, get_note, get_authorized_client):
+    user = get_user(username='test', email='test@test.com', password='test')
+    other = get_user(username='other', email='other@test.com', password='x')
+    admin = get_user(
+        username='admin', email='admin@test.com', password='admin',
+        is_admin=True
+    )
+    note = get_note('title', 'body', user.id)
+    deleted_note = get_note('deleted', 'body', user.id, is_deleted=True)
+    auth_client = get_authorized_client(user)
+    other_client = get_authorized_client(other)
+    admin_client = get_authorized_client(admin)
+
+    assert _upload(other_client, note.id).status_code == HTTPStatus.NOT_FOUND
+    assert _upload(
+        auth_client, deleted_note.id
+    ).status_code == HTTPStatus.NOT_FOUND
+    # Вложение, загруженное админом, принадлежит владельцу заметки
+    attachment = _upload(admin_client, note.id).json()
+    url = f'/api/notes/{note.id}/attachments/{attachment["id"]}'
+    assert auth_client.get(url).status_code == HTTPStatus.OK
+    assert other_client.get(url).status_code == HTTPStatus.NOT_FOUND
+    assert auth_client.post(
+        f'{url}/restore'
+    ).status_code == HTTPStatus.FORBIDDEN
+
+    assert auth_client.delete(url).status_code == HTTPStatus.OK
+    assert auth_client.get(url).status_code == HTTPStatus.NOT_FOUND
+    assert auth_client.delete(url).status_code == HTTPStatus.NOT_FOUND
+    assert admin_client.get(url).status_code == HTTPStatus.OK
+    assert admin_client.delete(url).status_code == HTTPStatus.OK
+
+    response = admin_client.post(f'{url}/restore')
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['id'] == attachment['id']
+    assert auth_client.get(url).status_code == HTTPStatus.OK
+
+    # Вложения удаленной заметки не видны владельцу
+    assert auth_client.delete(
+        f'/api/notes/{note.id}'
+    ).status_code == HTTPStatus.OK
+    assert auth_client.get(url).status_code == HTTPStatus.NOT_FOUND
+    assert admin_client.get(url).status_code == HTTPStatus.OK
@@ -1,5 +1,10 @@
-import json
-from base64 import b64encode
+from passlib.hash import md5_crypt
+from sqlalchemy_utils import Password
+from sqlmodel import update
+
+from models import User
+from passwords import password_context
+from tokens import decode_token
 
 
 def test_user_login(get_user, client):
@@ -15,7 +20,80 @@ def test_user_login(get_user, client):
         data={'username': username, 'password': password}
     )
 
-    payload = {'id': user.id, 'username': user.username}
-    subject = b64encode(json.dumps(payload).encode()).decode()
     assert response.status_code == 200
-    assert response.json() == {'access_token': subject, 'token_type': 'bearer'}
+    assert response.json()['token_type'] == 'bearer'
+    claims = decode_token(response.json()['access_token'])
+    assert claims['id'] == user.id
+    assert claims['username'] == user.username
+    assert claims['is_admin'] is False
+
+
+def test_user_logout(get_user, client):
+    username = 'test'
+    password = 'test'
+    get_user(
+        username=username,
+        email='test@test.com',
+        password=password
+    )
+    response = client.post(
+        '/api/auth/login',
+        data={'username': username, 'password': password}
+    )
+    headers = {
+        'Authorization': f'Bearer {response.json()["access_token"]}'
+    }
+    assert client.get('/api/notes', headers=headers).status_code == 200
+
+    response = client.post('/api/auth/logout', headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {'success': 'ok'}
+    assert client.get('/api/notes', headers=headers).status_code == 401
+
+
+def test_invalid_token(client):
+    headers = {'Authorization': 'Bearer not-a-token'}
+    response = client.get('/api/notes', headers=headers)
+    assert response.status_code == 401
+
+
+def test_user_login_invalid_password(get_user, client):
+    get_user(username='test', email='test@test.com', password='test')
+    for username, password in (('test', 'wrong'), ('unknown', 'test')):
+        response = client.post(
+            '/api/auth/login',
+            data={'username': username, 'password': password}
+        )
+        assert response.status_code == 400
+        assert response.json() == {
+            'detail': 'Incorrect username or password'
+        }
+
+
+def test_user_login_rehashes_legacy_password(
+    test_session, get_user, get_authorized_client, client
+):
+    user = get_user(username='test', email='test@test.com', password='x')
+    user_table = User.__table__
+    test_session.exec(
+        update(user_table).where(user_table.c.id == user.id).values(
+            password=Password(md5_crypt.hash('test'))
+        )
+    )
+    test_session.commit()
+    auth_client = get_authorized_client(user)
+
+    response = client.post(
+        '/api/auth/login', data={'username': 'test', 'password': 'test'}
+    )
+    assert response.status_code == 200
+    test_session.refresh(user)
+    assert password_context.identify(user.password.hash) == 'pbkdf2_sha512'
+    assert not password_context.needs_update(user.password.hash)
+    # Пересчет хеша не отзывает выданные токены
+    assert auth_client.get('/api/notes').status_code == 200
+
+    response = client.post(
+        '/api/auth/login', data={'username': 'test', 'password': 'test'}
+    )
+    assert response.status_code == 200
@@ -0,0 +1,20 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_suite_smoke(tmp_path):
+    # Один короткий раунд всех сценариев: бенчмарк должен оставаться
+    # рабочим, иначе проверка на ухудшение молча перестает работать
+    result = subprocess.run(
+        [
+            sys.executable, '-m', 'benchmarks.suite', '--users', '2',
+            '--notes', '3', '--requests', '2', '--concurrency', '1',
+            '--rounds', '1', '--baseline', str(tmp_path / 'baseline.json')
+        ],
+        cwd=ROOT, capture_output=True, text=True, timeout=300
+    )
+    assert result.returncode == 0, result.stderr
+    assert 'No regressions' in result.stdout
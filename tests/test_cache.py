@@ -0,0 +1,124 @@
+import pytest
+
+from cache import (CacheFullError, MemoryCacheBackend, NullCacheBackend,
+                   ResponseCache, get_cache_backend)
+
+
+def test_memory_backend_lru():
+    backend = MemoryCacheBackend(maxsize=2)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    assert backend.get('a') == 1
+    backend.set('c', 3)
+    assert backend.get('b') is None
+    assert backend.get('a') == 1
+    assert backend.get('c') == 3
+    assert len(backend) == 2
+
+
+def test_memory_backend_ttl(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr('cache.time.monotonic', lambda: now)
+    backend = MemoryCacheBackend(maxsize=10, ttl=5)
+    backend.set('a', 1)
+    backend.set('b', 2, ttl=60)
+    now += 10
+    assert backend.get('a') is None
+    assert backend.get('b') == 2
+
+
+def test_memory_backend_without_eviction(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr('cache.time.monotonic', lambda: now)
+    backend = MemoryCacheBackend(maxsize=2, ttl=5, evict=False)
+    backend.set('a', 1)
+    backend.set('b', 2, ttl=60)
+    with pytest.raises(CacheFullError):
+        backend.set('c', 3)
+    assert backend.get('a') == 1
+    # Существующая запись обновляется и в полном кеше
+    backend.set('a', 4)
+    # Место освобождают только истекшие записи
+    now += 10
+    backend.set('c', 3)
+    assert backend.get('b') == 2
+    assert backend.get('c') == 3
+
+
+def test_memory_backend_delete_and_clear():
+    backend = MemoryCacheBackend(maxsize=10)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    backend.delete('a')
+    assert backend.get('a') is None
+    backend.clear()
+    assert len(backend) == 0
+
+
+def test_get_cache_backend():
+    assert isinstance(
+        get_cache_backend('memory://', prefix='test', maxsize=10),
+        MemoryCacheBackend
+    )
+    assert isinstance(
+        get_cache_backend('none://', prefix='test', maxsize=10),
+        NullCacheBackend
+    )
+    with pytest.raises(ValueError):
+        get_cache_backend('unknown://', prefix='test', maxsize=10)
+
+
+def test_response_cache_invalidation():
+    response_cache = ResponseCache(MemoryCacheBackend(maxsize=100))
+    for scope, note_id in (('user:1', 1), ('admin', 1), ('user:2', 2)):
+        key, value = response_cache.lookup(scope, 'note', note_id)
+        assert value is None
+        response_cache.set(key, {'content': key.name})
+
+    response_cache.invalidate(response_cache.get_owner_scopes([1]))
+    assert response_cache.lookup('user:1', 'note', 1)[1] is None
+    assert response_cache.lookup('admin', 'note', 1)[1] is None
+    assert response_cache.lookup('user:2', 'note', 2)[1] == {
+        'content': 'user:2:note:2'
+    }
+
+    response_cache.invalidate({response_cache.GLOBAL_SCOPE})
+    assert response_cache.lookup('user:2', 'note', 2)[1] is None
+    assert response_cache.stats() == {
+        'hits': 1, 'misses': 6, 'hit_rate': 1 / 7, 'size': 7
+    }
+
+
+def test_response_cache_single_read():
+    class CountingBackend(MemoryCacheBackend):
+        reads = 0
+
+        def get(self, key):
+            self.reads += 1
+            return super().get(key)
+
+        def get_many(self, keys):
+            self.reads += 1
+            return [super(CountingBackend, self).get(key) for key in keys]
+
+    backend = CountingBackend(maxsize=100)
+    response_cache = ResponseCache(backend)
+    key, _ = response_cache.lookup('user:1', 'note', 1)
+    response_cache.set(key, {'content': 'note'})
+    backend.reads = 0
+    assert response_cache.lookup('user:1', 'note', 1)[1] == {
+        'content': 'note'
+    }
+    # Поколения и значение - одно обращение к бэкенду (MGET в Redis)
+    assert backend.reads == 1
+
+
+def test_response_cache_lost_generation():
+    backend = MemoryCacheBackend(maxsize=100)
+    response_cache = ResponseCache(backend)
+    key, _ = response_cache.lookup('user:1', 'note', 1)
+    response_cache.set(key, {'content': 'old'})
+    backend.delete('generation:user:1')
+    new_key, value = response_cache.lookup('user:1', 'note', 1)
+    assert value is None
+    assert new_key.generations != key.generations
@@ -0,0 +1,54 @@
+import pytest
+
+from compressed import (MARKER, PLAIN, ZLIB, compress_text, decompress_text,
+                        from_base64_text, to_base64_text)
+
+
+@pytest.mark.parametrize('value', [
+    '',
+    'short body',
+    'x' * 5000,
+    'текст заметки ' * 500,
+    MARKER.decode() + 'looks like a marker',
+    MARKER.decode() + 'z:not compressed',
+])
+def test_roundtrip(value):
+    assert decompress_text(compress_text(value)) == value
+    # Прежний текстовый формат для миграций
+    stored = to_base64_text(compress_text(value))
+    assert decompress_text(from_base64_text(stored)) == value
+
+
+def test_compress_threshold():
+    assert compress_text('x' * 100, threshold=1024) == b'x' * 100
+    assert compress_text('x' * 2000, threshold=1024).startswith(ZLIB)
+    assert compress_text('x' * 2000, algorithm='none') == b'x' * 2000
+
+
+def test_compressed_value_is_binary():
+    value = 'x' * 2000
+    stored = compress_text(value, threshold=0)
+    # Сжатые байты хранятся без base64
+    assert len(stored) < len(to_base64_text(stored))
+
+
+def test_incompressible_text_is_stored_plain():
+    # Заголовок zlib длиннее самого текста
+    assert compress_text('short', threshold=0) == b'short'
+
+
+def test_marker_is_escaped():
+    value = MARKER.decode() + 'text'
+    assert compress_text(value) == PLAIN + value.encode()
+
+
+def test_truncated_text():
+    stored = 'текст'.encode()[:3]
+    assert decompress_text(stored, truncated=True) == 'т'
+    with pytest.raises(UnicodeDecodeError):
+        decompress_text(stored)
+
+
+def test_unknown_marker():
+    with pytest.raises(ValueError):
+        decompress_text(MARKER + b'q:data')
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from settings import settings
+from tracing import QueryTrace, build_trace_report
+
+
+@pytest.fixture
+def query_trace_enabled():
+    enabled = settings.QUERY_TRACE_ENABLED
+    settings.QUERY_TRACE_ENABLED = True
+    yield
+    settings.QUERY_TRACE_ENABLED = enabled
+
+
+def test_query_trace(
+    get_user, get_authorized_client, get_note, query_trace_enabled
+):
+    admin = get_user(
+        username='admin', email='admin@test.com', password='test',
+        is_admin=True
+    )
+    note = get_note('title', 'body', admin.id)
+    auth_client = get_authorized_client(admin)
+
+    response = auth_client.get(
+        '/api/notes/search', params={'q': 'body'},
+        headers={'X-Debug-Trace': '1'}
+    )
+    assert response.status_code == 200
+    assert response.headers['X-Debug-Trace'].startswith('queries=')
+    trace_id = response.headers['X-Debug-Trace-Id']
+
+    response = auth_client.get(f'/api/debug/traces/{trace_id}')
+    assert response.status_code == 200
+    trace = response.json()
+    assert trace['method'] == 'GET'
+    assert trace['path'] == '/api/notes/search'
+    assert trace['status'] == 200
+    assert trace['queries']
+    assert all(query['duration_ms'] >= 0 for query in trace['queries'])
+    assert 1 <= len(trace['explain']) <= settings.QUERY_TRACE_EXPLAIN
+    assert all(item['plan'] for item in trace['explain'])
+    assert not any(
+        item['plan'][0].startswith('EXPLAIN failed')
+        for item in trace['explain']
+    )
+    # Сама отладочная ручка не трассируется
+    assert 'X-Debug-Trace-Id' not in response.headers
+    assert auth_client.get(f'/api/notes/{note.id}').status_code == 200
+
+
+def test_query_trace_requires_admin(
+    get_user, get_authorized_client, client, query_trace_enabled
+):
+    user = get_user(username='test', email='test@test.com', password='test')
+    auth_client = get_authorized_client(user)
+    response = auth_client.get(
+        '/api/notes', headers={'X-Debug-Trace': '1'}
+    )
+    assert response.status_code == 200
+    assert 'X-Debug-Trace-Id' not in response.headers
+    assert auth_client.get('/api/debug/traces/0').status_code == 403
+    assert client.get('/api/debug/traces/0').status_code == 401
+
+
+def test_query_trace_disabled(get_user, get_authorized_client):
+    admin = get_user(
+        username='admin', email='admin@test.com', password='test',
+        is_admin=True
+    )
+    auth_client = get_authorized_client(admin)
+    response = auth_client.get(
+        '/api/notes', headers={'X-Debug-Trace': '1'}
+    )
+    assert response.status_code == 200
+    assert 'X-Debug-Trace-Id' not in response.headers
+
+
+def test_repeated_queries(test_session):
+    engine = test_session.bind.engine
+    trace = QueryTrace()
+    for user_id in (1, 1, 2):
+        trace.queries.append({
+            'engine': engine,
+            'statement': 'SELECT id FROM user WHERE id = ?',
+            'parameters': (user_id,),
+            'executemany': False,
+            'duration': 0.001,
+        })
+    assert trace.summary() == 'queries=3; db_time=3.0ms; repeated=1'
+    report = asyncio.run(build_trace_report(
+        trace, {'method': 'GET', 'path': '/'}, 200, 0.01
+    ))
+    assert report['repeated'] == [{
+        'statement': 'SELECT id FROM user WHERE id = ?',
+        'count': 3,
+        'identical': 2,
+    }]
+    assert len(report['explain']) == 1
+    assert 'user' in report['explain'][0]['plan'][0].lower()
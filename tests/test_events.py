@@ -0,0 +1,103 @@
+import asyncio
+import threading
+
+from events import RESYNC, note_event_broker
+from settings import settings
+
+
+def _receive(subscription):
+    note_events = []
+    while not subscription.queue.empty():
+        note_events.append(subscription.queue.get_nowait())
+    return [(note_event['type'], note_event['id'])
+            for note_event in note_events]
+
+
+def test_note_events(get_user, get_authorized_client):
+    user = get_user(username='test', email='test@test.com', password='test')
+    other = get_user(username='other', email='other@test.com', password='x')
+    admin = get_user(
+        username='admin', email='admin@test.com', password='admin',
+        is_admin=True
+    )
+    auth_client = get_authorized_client(user)
+    admin_client = get_authorized_client(admin)
+
+    async def run():
+        subscription = note_event_broker.subscribe(user.id)
+        other_subscription = note_event_broker.subscribe(other.id)
+        note_id = auth_client.post(
+            '/api/notes/', data={'title': 'title', 'body': 'body'}
+        ).json()['id']
+        auth_client.put(
+            f'/api/notes/{note_id}', data={'title': 'new', 'body': 'body'}
+        )
+        # Без изменений событий нет
+        auth_client.put(
+            f'/api/notes/{note_id}', data={'title': 'new', 'body': 'body'}
+        )
+        auth_client.delete(f'/api/notes/{note_id}')
+        admin_client.post(f'/api/notes/{note_id}/restore')
+        batch_ids = [note['id'] for note in auth_client.post(
+            '/api/notes/batch', json={'notes': [
+                {'title': 'a', 'body': 'a'}, {'title': 'b', 'body': 'b'}
+            ]}
+        ).json()]
+        auth_client.post('/api/notes/batch/delete', json={'ids': batch_ids})
+        # События публикуются из потока другого цикла событий
+        await asyncio.sleep(0.1)
+        note_event_broker.unsubscribe(subscription)
+        note_event_broker.unsubscribe(other_subscription)
+        assert _receive(subscription) == [
+            ('created', note_id),
+            ('updated', note_id),
+            ('deleted', note_id),
+            ('restored', note_id),
+            *(('created', batch_id) for batch_id in batch_ids),
+            *(('deleted', batch_id) for batch_id in batch_ids),
+        ]
+        assert _receive(other_subscription) == []
+
+    asyncio.run(run())
+    assert len(note_event_broker) == 0
+
+
+def test_subscription_overflow(monkeypatch):
+    monkeypatch.setattr(note_event_broker, 'queue_size', 2)
+
+    async def run():
+        subscription = note_event_broker.subscribe(1)
+        note_event_broker.publish(
+            (1, {'type': 'created', 'id': note_id}) for note_id in range(3)
+        )
+        await asyncio.sleep(0)
+        note_event_broker.unsubscribe(subscription)
+        assert await subscription.get(0) is RESYNC
+        assert await subscription.get(0) is None
+
+    asyncio.run(run())
+
+
+def test_event_stream(
+    get_user, get_authorized_client, test_session, monkeypatch
+):
+    user = get_user(username='test', email='test@test.com', password='test')
+    auth_client = get_authorized_client(user)
+    # Поток закрывается, когда истекает токен
+    monkeypatch.setattr(settings, 'ACCESS_TOKEN_TTL', 1)
+    stream_client = get_authorized_client(user)
+
+    def create_note():
+        while not len(note_event_broker):
+            threading.Event().wait(0.01)
+        auth_client.post('/api/notes/', data={'title': 'a', 'body': 'b'})
+
+    writer = threading.Thread(target=create_note)
+    writer.start()
+    response = stream_client.get('/api/notes/events')
+    writer.join()
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert response.text.startswith('retry: ')
+    assert 'event: note\ndata: {"type": "created"' in response.text
+    assert len(note_event_broker) == 0
@@ -0,0 +1,40 @@
+import sys
+
+import pytest
+
+import launcher
+from settings import settings
+
+
+def test_process_local_settings(monkeypatch):
+    monkeypatch.setattr(settings, 'TOKEN_DENYLIST_URL', 'memory://')
+    monkeypatch.setattr(settings, 'RESPONSE_CACHE_URL', 'none://')
+    monkeypatch.setattr(settings, 'DB_REPLICA_URLS', [])
+    monkeypatch.setattr(settings, 'QUERY_TRACE_ENABLED', True)
+    monkeypatch.setattr(settings, 'QUERY_TRACE_URL', 'memory://')
+    assert launcher.get_process_local_settings() == [
+        'TOKEN_DENYLIST_URL', 'QUERY_TRACE_URL'
+    ]
+    monkeypatch.setattr(settings, 'DB_REPLICA_URLS', ['sqlite://'])
+    monkeypatch.setattr(settings, 'DB_REPLICA_STICKY_URL', 'memory://')
+    monkeypatch.setattr(settings, 'TOKEN_DENYLIST_URL', 'redis://redis')
+    monkeypatch.setattr(settings, 'QUERY_TRACE_ENABLED', False)
+    assert launcher.get_process_local_settings() == ['DB_REPLICA_STICKY_URL']
+
+
+def test_workers_require_shared_backends(monkeypatch):
+    monkeypatch.setattr(settings, 'TOKEN_DENYLIST_URL', 'memory://')
+    runs = []
+    monkeypatch.setattr(
+        launcher, 'run', lambda *args: runs.append(args[2]) or 0
+    )
+    monkeypatch.setattr(sys, 'argv', ['launcher', '--workers', '2'])
+    with pytest.raises(SystemExit) as error:
+        launcher.main()
+    assert error.value.code == 2
+    assert runs == []
+    # Без --workers запускается один воркер
+    monkeypatch.setattr(sys, 'argv', ['launcher'])
+    with pytest.raises(SystemExit):
+        launcher.main()
+    assert runs == [1]
@@ -0,0 +1,76 @@
+import logging
+
+from metrics import Histogram, render_metrics
+from settings import settings
+
+
+def _get_sample(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0.0
+
+
+def test_histogram_render():
+    histogram = Histogram('test_seconds', 'Test', ('route',), (0.1, 1))
+    histogram.observe(('/a',), 0.05)
+    histogram.observe(('/a',), 0.5)
+    histogram.observe(('/a',), 5)
+    assert list(histogram.samples()) == [
+        ('test_seconds_bucket', ('route', 'le'), ('/a', 0.1), 1),
+        ('test_seconds_bucket', ('route', 'le'), ('/a', 1), 2),
+        ('test_seconds_bucket', ('route', 'le'), ('/a', '+Inf'), 3),
+        ('test_seconds_sum', ('route',), ('/a',), 5.55),
+        ('test_seconds_count', ('route',), ('/a',), 3),
+    ]
+
+
+def test_metrics_endpoint(get_user, get_authorized_client, get_note, client):
+    user = get_user(username='test', email='test@test.com', password='test')
+    note = get_note('title', 'body', user.id)
+    auth_client = get_authorized_client(user)
+
+    route = 'method="GET",route="/api/notes/{note_id}"'
+    before = client.get('/metrics').text
+    for _ in range(2):
+        assert auth_client.get(f'/api/notes/{note.id}').status_code == 200
+    assert auth_client.get('/api/notes/0').status_code == 404
+    assert client.get('/api/unknown').status_code == 404
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    after = response.text
+    for name, delta in (
+        (f'http_requests_total{{{route},status="200"}}', 2),
+        (f'http_requests_total{{{route},status="404"}}', 1),
+        (
+            'http_requests_total{method="GET",route="unmatched",'
+            'status="404"}', 1
+        ),
+        (f'http_request_duration_seconds_count{{{route}}}', 3),
+    ):
+        assert _get_sample(after, name) - _get_sample(before, name) == delta
+    # Первый запрос читает заметку из БД, остальные - из кеша ответов
+    assert _get_sample(
+        after, f'db_queries_per_request_sum{{{route}}}'
+    ) > _get_sample(before, f'db_queries_per_request_sum{{{route}}}')
+    assert 'db_pool_checkouts{engine="async"}' in after
+
+
+def test_slow_query_log(get_user, get_authorized_client, caplog):
+    user = get_user(username='test', email='test@test.com', password='test')
+    auth_client = get_authorized_client(user)
+    before = _get_sample(render_metrics(), 'db_slow_queries_total')
+    threshold = settings.SLOW_QUERY_THRESHOLD
+    settings.SLOW_QUERY_THRESHOLD = 1e-9
+    try:
+        with caplog.at_level(logging.WARNING, logger='metrics'):
+            auth_client.get('/api/notes')
+    finally:
+        settings.SLOW_QUERY_THRESHOLD = threshold
+    assert any(
+        record.getMessage().startswith('Slow query')
+        for record in caplog.records
+    )
+    assert _get_sample(render_metrics(), 'db_slow_queries_total') > before
@@ -0,0 +1,162 @@
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, text
+from sqlmodel import SQLModel, false, select
+
+from compressed import ZLIB
+from models import Note
+from search import include_object
+from utils import get_alembic_config, upgrade_schema
+
+NOTE_INDEXES = {
+    'ix_note_user_id_is_deleted_id',
+    'ix_note_user_id_id_not_deleted',
+}
+
+
+@pytest.fixture
+def migrated_db_url(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "migrations.sqlite3"}'
+    command.upgrade(get_alembic_config(db_url), 'head')
+    return db_url
+
+
+def test_upgrade_creates_note_indexes(migrated_db_url):
+    engine = create_engine(migrated_db_url)
+    indexes = {index['name'] for index in inspect(engine).get_indexes('note')}
+    assert indexes >= NOTE_INDEXES
+    engine.dispose()
+
+
+def test_migrations_match_models(migrated_db_url):
+    engine = create_engine(migrated_db_url)
+    with engine.connect() as connection:
+        context = MigrationContext.configure(
+            connection, opts={'include_object': include_object}
+        )
+        diff = compare_metadata(context, SQLModel.metadata)
+    engine.dispose()
+    assert diff == []
+
+
+def test_downgrade(migrated_db_url):
+    command.downgrade(get_alembic_config(migrated_db_url), 'base')
+    engine = create_engine(migrated_db_url)
+    assert inspect(engine).get_table_names() == ['alembic_version']
+    engine.dispose()
+
+
+def _get_query_plan(session, query):
+    dialect = session.bind.dialect.name
+    statement = str(
+        query.compile(
+            dialect=session.bind.dialect,
+            compile_kwargs={'literal_binds': True}
+        )
+    )
+    if dialect == 'postgresql':
+        session.exec(text('SET LOCAL enable_seqscan = off'))
+        rows = session.exec(text(f'EXPLAIN {statement}')).all()
+        return '\n'.join(row[0] for row in rows)
+    rows = session.exec(text(f'EXPLAIN QUERY PLAN {statement}')).all()
+    return '\n'.join(row[-1] for row in rows)
+
+
+@pytest.mark.parametrize('query', [
+    select(Note).filter(
+        Note.user_id == 1,
+        Note.is_deleted == false()
+    ).order_by(Note.id).limit(101),
+    select(Note).filter(
+        Note.user_id == 1,
+        Note.is_deleted == false(),
+        Note.id > 10
+    ).order_by(Note.id).limit(101),
+    select(Note).filter(
+        Note.id == 1,
+        Note.user_id == 1,
+        Note.is_deleted == false()
+    ),
+])
+def test_note_queries_use_index(test_session, query):
+    plan = _get_query_plan(test_session, query)
+    test_session.rollback()
+    assert 'Seq Scan' not in plan
+    assert 'SCAN note' not in plan
+    assert 'USING' in plan or 'Index' in plan
+
+
+def test_upgrade_indexes_existing_notes(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "migrations.sqlite3"}'
+    config = get_alembic_config(db_url)
+    command.upgrade(config, '0002')
+    engine = create_engine(db_url)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO user (id, username, email, password, is_admin) "
+            "VALUES (1, 'test', 'test@test.com', x'00', 0)"
+        ))
+        connection.execute(text(
+            "INSERT INTO note (id, title, body, is_deleted, user_id) "
+            "VALUES (1, 'title', 'searchable body', 0, 1)"
+        ))
+    command.upgrade(config, 'head')
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT rowid FROM note_fts WHERE note_fts MATCH 'searchable'"
+        )).all()
+    engine.dispose()
+    assert rows == [(1,)]
+
+
+def test_upgrade_compresses_note_bodies(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "migrations.sqlite3"}'
+    config = get_alembic_config(db_url)
+    command.upgrade(config, '0004')
+    engine = create_engine(db_url)
+    long_body = 'long body ' * 1000
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO user (id, username, email, password, is_admin) "
+            "VALUES (1, 'test', 'test@test.com', x'00', 0)"
+        ))
+        connection.execute(
+            text(
+                'INSERT INTO note (id, title, body, is_deleted, user_id) '
+                "VALUES (1, 'title', :long_body, 0, 1), "
+                "(2, 'title', 'short body', 0, 1)"
+            ),
+            {'long_body': long_body}
+        )
+    command.upgrade(config, 'head')
+    with engine.connect() as connection:
+        stored = connection.execute(
+            text('SELECT body FROM note ORDER BY id')
+        ).scalars().all()
+        assert stored[0].startswith(ZLIB)
+        assert len(stored[0]) < len(long_body)
+        assert stored[1] == b'short body'
+        bodies = connection.execute(
+            select(Note.body).order_by(Note.id)
+        ).scalars().all()
+        assert bodies == [long_body, 'short body']
+
+    command.downgrade(config, '0004')
+    with engine.connect() as connection:
+        stored = connection.execute(
+            text('SELECT body FROM note ORDER BY id')
+        ).scalars().all()
+    engine.dispose()
+    assert stored == [long_body, 'short body']
+
+
+def test_upgrade_schema_runs_once(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "schema.sqlite3"}'
+    assert upgrade_schema(db_url)
+    # Версия схемы совпадает с головной ревизией, миграции не запускаются
+    assert not upgrade_schema(db_url)
+    engine = create_engine(db_url)
+    assert 'note_attachment' in inspect(engine).get_table_names()
+    engine.dispose()
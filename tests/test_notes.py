@@ -1,7 +1,18 @@
+import json
 from http import HTTPStatus
 from unittest.mock import ANY
 
 import pytest
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import CreateTable
+from sqlmodel import text, update
+
+import handlers.notes as notes
+from cache import response_cache
+from compressed import MARKER
+from models import Note
+from search import search_values
+from settings import settings
 
 
 def test_user_notes(get_user, get_authorized_client):
@@ -258,7 +269,9 @@ def test_admin_notes(
         response = auth_client.get('/api/notes')
         assert response.status_code == 200
         assert response.json() == [
-            note.model_dump(exclude=('is_deleted'))
+            note.model_dump(
+                exclude={'is_deleted', 'deleted_at', 'revision'}
+            )
             for note in notes
         ]
     else:
@@ -269,7 +282,9 @@ def test_admin_notes(
         _notes = list(filter(lambda note: note.user_id == last_user.id, notes))
         assert response.status_code == 200
         assert response.json() == [
-            note.model_dump(exclude=('is_deleted'))
+            note.model_dump(
+                exclude={'is_deleted', 'deleted_at', 'revision'}
+            )
             for note in _notes
         ]
 
@@ -346,3 +361,693 @@ def test_user_restore_note(
     test_session.refresh(note)
 
     assert note.is_deleted is True
+
+
+def test_user_notes_pagination(get_user, get_authorized_client, get_note):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    notes = [get_note(f'title_{i}', f'body_{i}', user.id) for i in range(5)]
+    auth_client = get_authorized_client(user)
+
+    response = auth_client.get('/api/notes', params={'limit': 2})
+    assert response.status_code == 200
+    assert [note['id'] for note in response.json()] == [
+        note.id for note in notes[:2]
+    ]
+    cursor = response.headers['X-Next-Cursor']
+    assert cursor == str(notes[1].id)
+
+    response = auth_client.get(
+        '/api/notes', params={'limit': 2, 'cursor': cursor}
+    )
+    assert [note['id'] for note in response.json()] == [
+        note.id for note in notes[2:4]
+    ]
+
+    response = auth_client.get(
+        '/api/notes',
+        params={'limit': 2, 'cursor': response.headers['X-Next-Cursor']}
+    )
+    assert [note['id'] for note in response.json()] == [notes[4].id]
+    assert 'X-Next-Cursor' not in response.headers
+
+
+@pytest.mark.parametrize('body_mode', ['preview', 'none'])
+def test_user_notes_body_mode(
+    monkeypatch,
+    get_user,
+    get_authorized_client,
+    get_note,
+    body_mode
+):
+    monkeypatch.setattr(settings, 'NOTE_PREVIEW_LENGTH', 4)
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    note = get_note('title', 'long_body', user.id)
+    auth_client = get_authorized_client(user)
+    response = auth_client.get('/api/notes', params={'body': body_mode})
+    assert response.status_code == 200
+    expected = {'id': note.id, 'title': 'title', 'user_id': user.id}
+    if body_mode == 'preview':
+        expected['body'] = 'long'
+    assert response.json() == [expected]
+
+
+@pytest.mark.parametrize('use_last_user_in_query', [True, False])
+def test_admin_export_notes(
+    test_session,
+    get_user,
+    get_authorized_client,
+    get_note,
+    use_last_user_in_query
+):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test',
+        is_admin=True
+    )
+    users = [
+        get_user(f'test_{i}', f'test_{i}@test.ru', f'test_{i}')
+        for i in range(2)
+    ]
+    notes = [
+        get_note(
+            f'title_{_user.username}',
+            f'body_{_user.username}',
+            _user.id,
+            is_deleted=_user is users[0]
+        )
+        for _user in users
+    ]
+    params = {}
+    if use_last_user_in_query:
+        params['note_user_id'] = users[-1].id
+        notes = notes[-1:]
+    for note in notes:
+        test_session.refresh(note)
+    auth_client = get_authorized_client(user)
+    response = auth_client.get('/api/notes/export', params=params)
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert [
+        json.loads(line) for line in response.text.splitlines()
+    ] == [note.model_dump(exclude={'deleted_at'}) for note in notes]
+
+
+def test_user_export_notes(get_user, get_authorized_client):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    auth_client = get_authorized_client(user)
+    response = auth_client.get('/api/notes/export')
+    assert response.status_code == 403
+
+
+def test_create_notes_batch(get_user, get_authorized_client):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    auth_client = get_authorized_client(user)
+    notes = [{'title': f'title_{i}', 'body': f'body_{i}'} for i in range(3)]
+    response = auth_client.post('/api/notes/batch', json={'notes': notes})
+    assert response.status_code == 200
+    created = response.json()
+    assert created == [
+        {'id': ANY, 'user_id': user.id, **note} for note in notes
+    ]
+    assert created[0]['id'] < created[1]['id'] < created[2]['id']
+
+    response = auth_client.get('/api/notes')
+    assert response.json() == created
+
+
+def test_create_notes_batch_empty(get_user, get_authorized_client):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    auth_client = get_authorized_client(user)
+    response = auth_client.post('/api/notes/batch', json={'notes': []})
+    assert response.status_code == 422
+
+
+def test_delete_notes_batch(
+    test_session,
+    get_user,
+    get_authorized_client,
+    get_note
+):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    foreign_user = get_user(
+        username='other_user',
+        email='othertest@test.com',
+        password='other_pass'
+    )
+    note = get_note('title', 'body', user.id)
+    deleted_note = get_note('title', 'body', user.id, is_deleted=True)
+    foreign_note = get_note('title', 'body', foreign_user.id)
+    ids = [note.id, deleted_note.id, foreign_note.id]
+    auth_client = get_authorized_client(user)
+    response = auth_client.post('/api/notes/batch/delete', json={'ids': ids})
+    assert response.status_code == 200
+    assert response.json() == [
+        {'id': note.id, 'status': 200},
+        {'id': deleted_note.id, 'status': 404},
+        {'id': foreign_note.id, 'status': 404},
+    ]
+
+    test_session.refresh(note)
+    test_session.refresh(foreign_note)
+    assert note.is_deleted
+    assert not foreign_note.is_deleted
+
+
+@pytest.mark.parametrize('is_admin', [True, False])
+def test_restore_notes_batch(
+    test_session,
+    get_user,
+    get_authorized_client,
+    get_note,
+    is_admin
+):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test',
+        is_admin=is_admin
+    )
+    foreign_user = get_user(
+        username='other_user',
+        email='othertest@test.com',
+        password='other_pass'
+    )
+    note = get_note('title', 'body', foreign_user.id, is_deleted=True)
+    missing_id = note.id + 100
+    auth_client = get_authorized_client(user)
+    response = auth_client.post(
+        '/api/notes/batch/restore', json={'ids': [note.id, missing_id]}
+    )
+    test_session.refresh(note)
+    if is_admin:
+        assert response.status_code == 200
+        assert response.json() == [
+            {'id': note.id, 'status': 200},
+            {'id': missing_id, 'status': 404},
+        ]
+        assert note.is_deleted is False
+    else:
+        assert response.status_code == 403
+        assert note.is_deleted is True
+
+
+def test_search_notes(get_user, get_authorized_client):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    foreign_user = get_user(
+        username='other_user',
+        email='othertest@test.com',
+        password='other_pass'
+    )
+    auth_client = get_authorized_client(user)
+    foreign_client = get_authorized_client(foreign_user)
+    foreign_client.post(
+        '/api/notes', data={'title': 'zebra', 'body': 'zebra'}
+    )
+    response = auth_client.post('/api/notes/batch', json={'notes': [
+        {'title': 'giraffe', 'body': 'about a zebra'},
+        {'title': 'zebra', 'body': 'zebra zebra crossing'},
+        {'title': 'lion', 'body': 'nothing here'},
+        {'title': 'deleted', 'body': 'zebra'},
+    ]})
+    notes = response.json()
+    auth_client.delete(f'/api/notes/{notes[3]["id"]}')
+
+    response = auth_client.get(
+        '/api/notes/search', params={'q': 'Zebra!', 'body': 'none'}
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {'id': notes[1]['id'], 'title': 'zebra', 'user_id': user.id},
+        {'id': notes[0]['id'], 'title': 'giraffe', 'user_id': user.id},
+    ]
+
+    response = auth_client.get(
+        '/api/notes/search',
+        params={'q': 'zebra', 'body': 'none', 'offset': 1, 'limit': 1}
+    )
+    assert [note['id'] for note in response.json()] == [notes[0]['id']]
+
+    response = auth_client.get(
+        '/api/notes/search', params={'q': 'zebra crossing'}
+    )
+    assert response.json() == [{
+        'id': notes[1]['id'],
+        'title': 'zebra',
+        'body': 'zebra zebra crossing',
+        'user_id': user.id
+    }]
+
+    response = auth_client.get('/api/notes/search', params={'q': '"*'})
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_search_updated_note(get_user, get_authorized_client):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    auth_client = get_authorized_client(user)
+    note = auth_client.post(
+        '/api/notes', data={'title': 'title', 'body': 'walrus'}
+    ).json()
+    auth_client.put(
+        f'/api/notes/{note["id"]}', data={'title': 'title', 'body': 'otter'}
+    )
+    response = auth_client.get('/api/notes/search', params={'q': 'walrus'})
+    assert response.json() == []
+    response = auth_client.get('/api/notes/search', params={'q': 'otter'})
+    assert [found['id'] for found in response.json()] == [note['id']]
+
+
+def test_search_vector_in_note_update():
+    # В PostgreSQL вектор пишется тем же UPDATE, что и заметка
+    query = update(Note).values(
+        title='title',
+        body='otter',
+        **search_values('postgresql', 'title', 'otter'),
+    ).returning(Note.id)
+    sql = str(query.compile(dialect=postgresql.dialect()))
+    assert sql.count('UPDATE') == 1
+    assert 'search_vector=to_tsvector(' in sql
+    assert search_values('sqlite', 'title', 'otter') == {}
+    assert 'search_vector' not in str(
+        CreateTable(Note.__table__).compile(dialect=sqlite.dialect())
+    )
+
+
+def test_get_note_etag(get_user, get_authorized_client, get_note):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    note = get_note('title', 'body', user.id)
+    auth_client = get_authorized_client(user)
+    response = auth_client.get(f'/api/notes/{note.id}')
+    etag = response.headers['ETag']
+    assert etag == f'"{note.id}-1"'
+
+    response = auth_client.get(
+        f'/api/notes/{note.id}', headers={'If-None-Match': etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['ETag'] == etag
+
+    response = auth_client.get(
+        f'/api/notes/{note.id}', headers={'If-None-Match': f'W/{etag}'}
+    )
+    assert response.status_code == 304
+
+    auth_client.put(
+        f'/api/notes/{note.id}', data={'title': 'new', 'body': 'body'}
+    )
+    response = auth_client.get(
+        f'/api/notes/{note.id}', headers={'If-None-Match': etag}
+    )
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{note.id}-2"'
+    assert response.json()['title'] == 'new'
+
+
+def test_get_foreign_note_etag(get_user, get_authorized_client, get_note):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    foreign_user = get_user(
+        username='other_user',
+        email='othertest@test.com',
+        password='other_pass'
+    )
+    note = get_note('title', 'body', foreign_user.id)
+    auth_client = get_authorized_client(user)
+    response = auth_client.get(
+        f'/api/notes/{note.id}', headers={'If-None-Match': '*'}
+    )
+    assert response.status_code == 404
+
+
+def test_update_note_if_match(
+    test_session,
+    get_user,
+    get_authorized_client,
+    get_note
+):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    note = get_note('title', 'body', user.id)
+    auth_client = get_authorized_client(user)
+    etag = auth_client.get(f'/api/notes/{note.id}').headers['ETag']
+
+    response = auth_client.put(
+        f'/api/notes/{note.id}',
+        data={'title': 'first', 'body': 'body'},
+        headers={'If-Match': etag}
+    )
+    assert response.status_code == 200
+    new_etag = response.headers['ETag']
+    assert new_etag != etag
+
+    response = auth_client.put(
+        f'/api/notes/{note.id}',
+        data={'title': 'second', 'body': 'body'},
+        headers={'If-Match': etag}
+    )
+    assert response.status_code == 412
+    assert response.json() == {'detail': 'Note has been modified'}
+
+    response = auth_client.delete(
+        f'/api/notes/{note.id}', headers={'If-Match': etag}
+    )
+    assert response.status_code == 412
+    test_session.refresh(note)
+    assert note.title == 'first'
+    assert not note.is_deleted
+
+    response = auth_client.delete(
+        f'/api/notes/{note.id}', headers={'If-Match': new_etag}
+    )
+    assert response.status_code == 200
+    test_session.refresh(note)
+    assert note.is_deleted
+    assert note.revision == 3
+
+
+def test_note_response_cache(
+    test_session,
+    get_user,
+    get_authorized_client,
+    get_note
+):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    note = get_note('title', 'body', user.id)
+    auth_client = get_authorized_client(user)
+    stats = response_cache.stats()
+    first = auth_client.get(f'/api/notes/{note.id}')
+    second = auth_client.get(f'/api/notes/{note.id}')
+    assert response_cache.stats()['misses'] == stats['misses'] + 1
+    assert response_cache.stats()['hits'] == stats['hits'] + 1
+    assert first.content == second.content
+    assert first.headers['ETag'] == second.headers['ETag']
+
+    auth_client.put(
+        f'/api/notes/{note.id}', data={'title': 'new', 'body': 'body'}
+    )
+    response = auth_client.get(f'/api/notes/{note.id}')
+    assert response.json()['title'] == 'new'
+
+    test_session.refresh(note)
+    note.title = 'changed_in_db'
+    test_session.add(note)
+    test_session.commit()
+    response = auth_client.get(f'/api/notes/{note.id}')
+    assert response.json()['title'] == 'changed_in_db'
+
+
+def test_notes_list_response_cache(get_user, get_authorized_client):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test',
+    )
+    admin = get_user(
+        username='admin',
+        email='admin@test.com',
+        password='admin',
+        is_admin=True
+    )
+    auth_client = get_authorized_client(user)
+    admin_client = get_authorized_client(admin)
+    assert auth_client.get('/api/notes').json() == []
+    assert admin_client.get('/api/notes').json() == []
+
+    note = auth_client.post(
+        '/api/notes', data={'title': 'title', 'body': 'body'}
+    ).json()
+    assert auth_client.get('/api/notes').json() == [note]
+    assert admin_client.get('/api/notes').json() == [note]
+
+    auth_client.post('/api/notes/batch/delete', json={'ids': [note['id']]})
+    assert auth_client.get('/api/notes').json() == []
+    assert admin_client.get('/api/notes').json() == [note]
+
+
+def test_compressed_note_body(test_session, get_user, get_authorized_client):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    auth_client = get_authorized_client(user)
+    body = 'compressible penguin body ' * 1000
+    note = auth_client.post(
+        '/api/notes', data={'title': 'title', 'body': body}
+    ).json()
+    assert note['body'] == body
+    stored = test_session.exec(
+        text('SELECT body FROM note WHERE id = :id'),
+        params={'id': note['id']}
+    ).scalar()
+    assert stored.startswith(MARKER)
+    assert len(stored) < len(body) / 10
+
+    response = auth_client.get(f'/api/notes/{note["id"]}')
+    assert response.json()['body'] == body
+
+    response = auth_client.get('/api/notes', params={'body': 'preview'})
+    assert response.json()[0]['body'] == body[:settings.NOTE_PREVIEW_LENGTH]
+
+    # Несжатое тело обрезается в БД по байтам, посреди символа
+    short_body = '€' * 500
+    auth_client.post('/api/notes', data={'title': 'short', 'body': short_body})
+    response = auth_client.get('/api/notes', params={'body': 'preview'})
+    assert response.json()[1]['body'] == (
+        short_body[:settings.NOTE_PREVIEW_LENGTH]
+    )
+
+    response = auth_client.get('/api/notes/search', params={'q': 'penguin'})
+    assert [found['id'] for found in response.json()] == [note['id']]
+
+
+def test_patch_note(test_session, get_user, get_authorized_client, get_note):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    note = get_note('title', 'hello wrold', user.id)
+    auth_client = get_authorized_client(user)
+
+    response = auth_client.patch(
+        f'/api/notes/{note.id}', json={'title': 'new_title'}
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        'id': note.id,
+        'title': 'new_title',
+        'body': 'hello wrold',
+        'user_id': user.id,
+        'revision': 2
+    }
+    assert response.headers['ETag'] == f'"{note.id}-2"'
+
+    response = auth_client.patch(
+        f'/api/notes/{note.id}',
+        json={
+            'edits': [
+                {'start': 6, 'end': 11, 'text': 'world'},
+                {'start': 0, 'end': 0, 'text': '> '}
+            ],
+            'revision': 2
+        }
+    )
+    assert response.status_code == 200
+    assert response.json()['body'] == '> hello world'
+    assert response.json()['revision'] == 3
+
+    # Правки посчитаны относительно устаревшей ревизии
+    response = auth_client.patch(
+        f'/api/notes/{note.id}',
+        json={'edits': [{'start': 0, 'end': 2}], 'revision': 2}
+    )
+    assert response.status_code == 412
+
+    response = auth_client.patch(
+        f'/api/notes/{note.id}',
+        json={'edits': [{'start': 0, 'end': 100}], 'revision': 3}
+    )
+    assert response.status_code == 422
+    assert response.json() == {'detail': 'Invalid text patch'}
+
+    response = auth_client.patch(
+        f'/api/notes/{note.id}',
+        json={
+            'edits': [
+                {'start': 0, 'end': 5, 'text': 'a'},
+                {'start': 3, 'end': 7, 'text': 'b'}
+            ],
+            'revision': 3
+        }
+    )
+    assert response.status_code == 422
+
+    response = auth_client.patch(
+        f'/api/notes/{note.id}', json={'edits': [{'start': 0, 'end': 2}]}
+    )
+    assert response.status_code == 422
+
+    response = auth_client.patch(
+        f'/api/notes/{note.id}',
+        json={'body': 'body', 'edits': [], 'revision': 3}
+    )
+    assert response.status_code == 422
+
+    test_session.refresh(note)
+    assert note.title == 'new_title'
+    assert note.body == '> hello world'
+    assert note.revision == 3
+
+    response = auth_client.get('/api/notes/search', params={'q': 'world'})
+    assert [item['id'] for item in response.json()] == [note.id]
+
+
+def test_patch_foreign_note(get_user, get_authorized_client, get_note):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    other_user = get_user(
+        username='other',
+        email='other@test.com',
+        password='test'
+    )
+    note = get_note('title', 'body', other_user.id)
+    auth_client = get_authorized_client(user)
+    response = auth_client.patch(
+        f'/api/notes/{note.id}', json={'title': 'new_title'}
+    )
+    assert response.status_code == 404
+    assert response.json() == {'detail': 'Note not found'}
+
+
+def test_patch_stale_revision(
+    test_session, get_user, get_authorized_client, get_note, monkeypatch
+):
+    user = get_user(
+        username='test',
+        email='test@test.com',
+        password='test'
+    )
+    note = get_note('title', 'hello', user.id)
+    auth_client = get_authorized_client(user)
+    apply_edits = notes._apply_edits
+
+    def apply_edits_after_change(body, edits):
+        # Заметку изменили после того, как PATCH ее прочитал
+        test_session.exec(
+            update(Note).filter(Note.id == note.id).values(
+                title='other', revision=Note.revision + 1
+            )
+        )
+        test_session.commit()
+        return apply_edits(body, edits)
+
+    monkeypatch.setattr(notes, '_apply_edits', apply_edits_after_change)
+    response = auth_client.patch(
+        f'/api/notes/{note.id}',
+        json={'edits': [{'start': 0, 'end': 0, 'text': '> '}], 'revision': 1}
+    )
+    assert response.status_code == 412
+    assert response.json() == {'detail': 'Note has been modified'}
+
+    test_session.refresh(note)
+    assert note.title == 'other'
+    assert note.body == 'hello'
+    assert note.revision == 2
+
+
+def test_unchanged_note_writes(
+    test_session,
+    get_user,
+    get_authorized_client,
+    get_note
+):
+    admin = get_user(
+        username='admin',
+        email='admin@test.com',
+        password='admin',
+        is_admin=True
+    )
+    note = get_note('title', 'body', admin.id)
+    auth_client = get_authorized_client(admin)
+
+    # Запись без изменений не меняет ревизию
+    response = auth_client.put(
+        f'/api/notes/{note.id}',
+        data={'title': 'title', 'body': 'body'},
+        headers={'If-Match': f'"{note.id}-1"'}
+    )
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{note.id}-1"'
+
+    response = auth_client.put(
+        f'/api/notes/{note.id}',
+        data={'title': 'title', 'body': 'body'},
+        headers={'If-Match': f'"{note.id}-2"'}
+    )
+    assert response.status_code == 412
+
+    response = auth_client.post(f'/api/notes/{note.id}/restore')
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{note.id}-1"'
+
+    for _ in range(2):
+        response = auth_client.delete(f'/api/notes/{note.id}')
+        assert response.status_code == 200
+    test_session.refresh(note)
+    assert note.is_deleted
+    assert note.revision == 2
+
+    response = auth_client.delete('/api/notes/0')
+    assert response.status_code == 404
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+import utils
+from models import Note, User
+from utils import ReplicaSet
+
+
+@pytest.fixture
+def replicas(tmp_path, monkeypatch):
+    urls = [
+        f'sqlite:///{tmp_path / f"replica{index}.sqlite3"}'
+        for index in range(2)
+    ]
+    for url in urls:
+        engine = create_engine(url)
+        SQLModel.metadata.create_all(engine)
+        engine.dispose()
+    replica_set = ReplicaSet(urls)
+    monkeypatch.setattr(utils, 'read_replicas', replica_set)
+    yield replica_set
+    asyncio.run(replica_set.dispose())
+    utils.replica_stickiness.clear()
+
+
+def _add_replica_note(url, user, note_id, title):
+    engine = create_engine(url)
+    with Session(engine) as session:
+        session.add(User(
+            id=user.id, username=user.username, email=user.email,
+            password='test'
+        ))
+        session.add(Note(id=note_id, title=title, body='body',
+                         user_id=user.id))
+        session.commit()
+    engine.dispose()
+
+
+def test_reads_go_to_replicas(get_user, get_authorized_client, replicas):
+    user = get_user(username='test', email='test@test.com', password='test')
+    for url in replicas.urls:
+        _add_replica_note(url, user, 1000, 'replica')
+    auth_client = get_authorized_client(user)
+
+    response = auth_client.get('/api/notes/1000')
+    assert response.status_code == 200
+    assert response.json()['title'] == 'replica'
+    response = auth_client.get('/api/notes')
+    assert [note['title'] for note in response.json()] == ['replica']
+    assert set(utils.get_pool_stats()) >= {'replica0', 'replica1'}
+
+    # После своей записи пользователь читает из основной базы
+    response = auth_client.post(
+        '/api/notes/', data={'title': 'primary', 'body': 'body'}
+    )
+    assert response.status_code == 200
+    response = auth_client.get('/api/notes')
+    assert [note['title'] for note in response.json()] == ['primary']
+    assert auth_client.get('/api/notes/1000').status_code == 404
+
+
+def test_sticky_only_for_writer(
+    get_user, get_authorized_client, replicas
+):
+    writer = get_user(
+        username='writer', email='writer@test.com', password='test'
+    )
+    reader = get_user(
+        username='reader', email='reader@test.com', password='test'
+    )
+    for url in replicas.urls:
+        _add_replica_note(url, reader, 1000, 'replica')
+    response = get_authorized_client(writer).post(
+        '/api/notes/', data={'title': 'primary', 'body': 'body'}
+    )
+    assert response.status_code == 200
+    response = get_authorized_client(reader).get('/api/notes/1000')
+    assert response.json()['title'] == 'replica'
+
+
+def test_replica_selection(tmp_path):
+    good = f'sqlite+aiosqlite:///{tmp_path / "good.sqlite3"}'
+    bad = f'sqlite+aiosqlite:///{tmp_path / "missing" / "bad.sqlite3"}'
+    replica_set = ReplicaSet([bad, good], retry_interval=60)
+
+    async def _check():
+        engines = {replica_set.get_engine() for _ in range(2)}
+        # Обе простаивают: выбор идет по кругу
+        assert len(engines) == 2
+        for engine in engines:
+            try:
+                async with engine.connect():
+                    pass
+            except Exception:
+                pass
+        assert replica_set.get_healthy_urls() == [good]
+        assert {replica_set.get_engine() for _ in range(4)} == {
+            replica_set._get_engine(good)
+        }
+        await replica_set.dispose()
+
+    asyncio.run(_check())
+    failed = ReplicaSet([bad])
+    failed.mark_failed(bad)
+    assert failed.get_engine() is None
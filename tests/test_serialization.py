@@ -0,0 +1,49 @@
+from collections import namedtuple
+from typing import List
+
+import pytest
+from pydantic import TypeAdapter
+
+import serialization
+from handlers.notes import _get_list_items
+from schemes import NoteBodyMode, NoteListItemResponse
+from settings import settings
+
+Row = namedtuple('Row', ['id', 'title', 'user_id', 'body'])
+notes_list_adapter = TypeAdapter(List[NoteListItemResponse])
+TEXTS = [
+    '',
+    'plain',
+    'кириллица и 漢字 😀',
+    'quotes " and \\ backslash / slash',
+    'controls \x00\x01\x1f\x7f\b\f\n\r\t',
+    'separators    bom ﻿',
+    'x' * 5000,
+]
+
+
+@pytest.fixture(params=['orjson', 'pydantic-core'])
+def encoder(request, monkeypatch):
+    if request.param == 'pydantic-core':
+        monkeypatch.setattr(serialization, 'orjson', None)
+    elif serialization.orjson is None:
+        pytest.skip('orjson is not installed')
+
+
+@pytest.mark.parametrize('body_mode', list(NoteBodyMode))
+def test_list_matches_pydantic(encoder, body_mode):
+    rows = [
+        Row(i, title, 2 ** 40 + i, TEXTS[-1 - i])
+        for i, title in enumerate(TEXTS)
+    ]
+    if body_mode == NoteBodyMode.none:
+        rows = [row[:3] for row in rows]
+    items = _get_list_items(rows, body_mode)
+    expected = notes_list_adapter.dump_json(
+        notes_list_adapter.validate_python(items), exclude_none=True
+    )
+    assert serialization.dumps(items) == expected
+    if body_mode == NoteBodyMode.preview:
+        assert max(
+            len(item['body']) for item in items
+        ) == settings.NOTE_PREVIEW_LENGTH
@@ -0,0 +1,227 @@
+import asyncio
+import json
+
+import pytest
+from sqlmodel import SQLModel, create_engine, delete, select
+
+import models
+import sharding
+from cache import MemoryCacheBackend
+from models import Attachment, Note, NoteIdSequence
+from settings import settings
+from sharding import attachment_id_allocator, move_user, note_id_allocator
+from tokens import TokenDenyList
+from utils import shards
+
+
+@pytest.fixture
+def sharded(tmp_path, test_session, monkeypatch):
+    urls = [
+        f'sqlite:///{tmp_path / f"shard{index}.sqlite3"}'
+        for index in (1, 2)
+    ]
+    for url in urls:
+        engine = create_engine(url)
+        SQLModel.metadata.create_all(engine)
+        engine.dispose()
+    monkeypatch.setattr(shards, 'urls', urls)
+    # В тестах перенос идет в процессе приложения, бэкенды в памяти общие
+    monkeypatch.setattr(settings, 'TOKEN_DENYLIST_URL', 'redis://redis')
+    monkeypatch.setattr(settings, 'RESPONSE_CACHE_URL', 'redis://redis')
+    note_id_allocator.reset()
+    attachment_id_allocator.reset()
+    yield urls
+    asyncio.run(shards.dispose())
+    note_id_allocator.reset()
+    attachment_id_allocator.reset()
+    test_session.exec(delete(NoteIdSequence))
+    test_session.commit()
+
+
+def _move(test_session, user, shard):
+    moved = asyncio.run(move_user(user.id, shard))
+    test_session.refresh(user)
+    assert user.shard == shard
+    return moved
+
+
+def _create_note(client, title):
+    response = client.post(
+        '/api/notes/', data={'title': title, 'body': f'{title} body'}
+    )
+    assert response.status_code == 200
+    return response.json()['id']
+
+
+def test_move_user(
+    get_user, get_note, get_authorized_client, test_session, sharded,
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(settings, 'MEDIA_ROOT', str(tmp_path))
+    user = get_user(username='test', email='test@test.com', password='test')
+    note_ids = [get_note(f'note {i}', 'body', user.id).id for i in range(2)]
+    old_client = get_authorized_client(user)
+
+    assert _move(test_session, user, 1) == 2
+    assert not test_session.exec(
+        select(Note).filter(Note.user_id == user.id)
+    ).all()
+    # Токен со старым шардом отозван
+    assert old_client.get('/api/notes').status_code == 401
+
+    auth_client = get_authorized_client(user)
+    response = auth_client.get('/api/notes')
+    assert [note['id'] for note in response.json()] == note_ids
+    note_id = _create_note(auth_client, 'new')
+    assert note_id > max(note_ids)
+    response = auth_client.get('/api/notes/search', params={'q': 'new'})
+    assert [note['id'] for note in response.json()] == [note_id]
+    attachment = auth_client.post(
+        f'/api/notes/{note_id}/attachments/', params={'filename': 'a.txt'},
+        content=b'data'
+    ).json()
+
+    # Обратно в основную базу
+    assert _move(test_session, user, 0) == 3
+    auth_client = get_authorized_client(user)
+    response = auth_client.get('/api/notes')
+    assert [note['id'] for note in response.json()] == [*note_ids, note_id]
+    # Вложение переносится вместе с заметкой под тем же id
+    response = auth_client.get(
+        f'/api/notes/{note_id}/attachments/{attachment["id"]}'
+    )
+    assert response.content == b'data'
+    test_session.exec(delete(Attachment))
+    test_session.commit()
+
+
+def _fail_once(monkeypatch, module, name):
+    fn = getattr(module, name)
+    failed = False
+
+    async def fail_once(*args, **kwargs):
+        nonlocal failed
+        if not failed:
+            failed = True
+            raise RuntimeError('interrupted')
+        return await fn(*args, **kwargs)
+
+    monkeypatch.setattr(module, name, fail_once)
+
+
+@pytest.mark.parametrize('failing', ['_copy_rows', 'unindex_notes'])
+def test_move_user_resumes(
+    get_user, get_note, get_authorized_client, test_session, sharded,
+    monkeypatch, failing
+):
+    user = get_user(username='test', email='test@test.com', password='test')
+    note_ids = [get_note(f'note {i}', 'body', user.id).id for i in range(3)]
+    # Перенос прерывается до записи на целевой шард (_copy_rows) или
+    # после нее, при удалении с исходного (unindex_notes)
+    _fail_once(monkeypatch, sharding, failing)
+    with pytest.raises(RuntimeError):
+        asyncio.run(move_user(user.id, 1, batch_size=2))
+    test_session.refresh(user)
+    assert (user.shard, user.moving_from) == (1, 0)
+
+    assert _move(test_session, user, 1) == 3
+    assert user.moving_from is None
+    assert not test_session.exec(
+        select(Note).filter(Note.user_id == user.id)
+    ).all()
+    response = get_authorized_client(user).get('/api/notes')
+    assert [note['id'] for note in response.json()] == note_ids
+    # Завершенный перенос повторно ничего не делает
+    assert _move(test_session, user, 1) == 0
+    # Трасса прерванного переноса держит кадр теста, а с ним и user:
+    # пользователь не должен остаться в сессии для следующих тестов
+    test_session.expunge(user)
+
+
+def test_move_user_requires_shared_backends(
+    get_user, get_note, get_authorized_client, test_session, sharded,
+    monkeypatch
+):
+    # У команды переноса свой список отзыва, приложение его не видит
+    mover_denylist = TokenDenyList(MemoryCacheBackend(maxsize=100))
+    monkeypatch.setattr(models, 'token_denylist', mover_denylist)
+    monkeypatch.setattr(settings, 'TOKEN_DENYLIST_URL', 'memory://')
+    user = get_user(username='test', email='test@test.com', password='test')
+    note = get_note('note', 'body', user.id)
+    auth_client = get_authorized_client(user)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(move_user(user.id, 1))
+    test_session.refresh(user)
+    assert user.shard == 0
+    # Токен приложения действует, и его записи остаются на шарде
+    # пользователя
+    response = auth_client.put(
+        f'/api/notes/{note.id}', data={'title': 'new', 'body': 'body'}
+    )
+    assert response.status_code == 200
+    test_session.refresh(note)
+    assert note.title == 'new'
+
+
+def test_admin_scatter_gather(
+    get_user, get_authorized_client, test_session, sharded
+):
+    admin = get_user(
+        username='admin', email='admin@test.com', password='test',
+        is_admin=True
+    )
+    users = [
+        get_user(username=f'user{i}', email=f'user{i}@test.com',
+                 password='test')
+        for i in range(3)
+    ]
+    for shard, user in enumerate(users):
+        _move(test_session, user, shard)
+    clients = [get_authorized_client(user) for user in users]
+    note_ids = [
+        _create_note(clients[i % 3], f'note{i}') for i in range(6)
+    ]
+    assert note_ids == sorted(note_ids)
+    admin_client = get_authorized_client(admin)
+
+    response = admin_client.get('/api/notes', params={'limit': 4})
+    assert [note['id'] for note in response.json()] == note_ids[:4]
+    cursor = response.headers['X-Next-Cursor']
+    response = admin_client.get(
+        '/api/notes', params={'limit': 4, 'cursor': cursor}
+    )
+    assert [note['id'] for note in response.json()] == note_ids[4:]
+
+    response = admin_client.get(f'/api/notes/{note_ids[2]}')
+    assert response.json()['title'] == 'note2'
+    response = admin_client.put(
+        f'/api/notes/{note_ids[2]}', data={'title': 'new', 'body': 'new'}
+    )
+    assert response.status_code == 200
+    assert clients[2].get(f'/api/notes/{note_ids[2]}').json()['title'] == \
+        'new'
+
+    response = admin_client.post(
+        '/api/notes/batch/delete', json={'ids': note_ids[:3]}
+    )
+    assert [item['status'] for item in response.json()] == [200] * 3
+    for i, client in enumerate(clients):
+        response = client.get('/api/notes')
+        assert [note['id'] for note in response.json()] == [note_ids[i + 3]]
+    response = admin_client.post(
+        '/api/notes/batch/restore', json={'ids': note_ids[:3]}
+    )
+    assert [item['status'] for item in response.json()] == [200] * 3
+
+    response = admin_client.get('/api/notes/export')
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [note['id'] for note in exported] == note_ids
+
+    response = admin_client.get(
+        '/api/notes/search', params={'q': 'body', 'limit': 10}
+    )
+    # note2 изменена админом и больше не содержит слова body
+    assert sorted(note['id'] for note in response.json()) == [
+        note_id for note_id in note_ids if note_id != note_ids[2]
+    ]
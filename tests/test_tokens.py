@@ -0,0 +1,88 @@
+import pytest
+
+from cache import CacheFullError, MemoryCacheBackend
+from models import User
+from settings import Settings
+from tokens import (TokenDenyList, TokenError, create_access_token,
+                    decode_token, encode_token)
+
+
+def test_token_roundtrip():
+    user = User(id=1, username='test', is_admin=True)
+    claims = decode_token(create_access_token(user))
+    assert claims['sub'] == '1'
+    assert claims['id'] == 1
+    assert claims['username'] == 'test'
+    assert claims['is_admin'] is True
+    assert claims['exp'] > claims['iat']
+
+
+def test_token_tampered():
+    user = User(id=1, username='test', is_admin=False)
+    header, payload, signature = create_access_token(user).split('.')
+    forged = create_access_token(
+        User(id=1, username='test', is_admin=True)
+    ).split('.')[1]
+    with pytest.raises(TokenError):
+        decode_token(f'{header}.{forged}.{signature}')
+    with pytest.raises(TokenError):
+        decode_token(f'{header}.{payload}.{signature}', secret='other')
+    with pytest.raises(TokenError):
+        decode_token('garbage')
+
+
+@pytest.mark.parametrize('secret_key', ['', ' ', 'change-me'])
+def test_insecure_secret_key(secret_key):
+    with pytest.raises(ValueError):
+        Settings(SECRET_KEY=secret_key)
+
+
+def test_token_expired():
+    user = User(id=1, username='test', is_admin=False)
+    with pytest.raises(TokenError):
+        decode_token(create_access_token(user, ttl=-10))
+
+
+def test_token_missing_claims():
+    with pytest.raises(TokenError):
+        decode_token(encode_token({'id': 1, 'exp': 2 ** 40}))
+
+
+def test_deny_list():
+    denylist = TokenDenyList(MemoryCacheBackend(maxsize=10))
+    first = decode_token(
+        create_access_token(User(id=1, username='test', is_admin=False))
+    )
+    second = decode_token(
+        create_access_token(User(id=1, username='test', is_admin=False))
+    )
+    other = decode_token(
+        create_access_token(User(id=2, username='other', is_admin=False))
+    )
+    denylist.revoke(first)
+    assert denylist.is_revoked(first)
+    assert not denylist.is_revoked(second)
+
+    denylist.revoke_user(1)
+    assert denylist.is_revoked(second)
+    assert not denylist.is_revoked(other)
+    fresh = decode_token(
+        create_access_token(User(id=1, username='test', is_admin=False))
+    )
+    assert not denylist.is_revoked(fresh)
+
+    denylist.revoke_all()
+    assert denylist.is_revoked(other)
+
+
+def test_deny_list_does_not_evict():
+    denylist = TokenDenyList(MemoryCacheBackend(maxsize=2, evict=False))
+    denylist.revoke_all()
+    denylist.revoke_user(1)
+    with pytest.raises(CacheFullError):
+        denylist.revoke_user(2)
+    claims = decode_token(
+        create_access_token(User(id=3, username='test', is_admin=False))
+    )
+    claims['iat'] -= 10
+    assert denylist.is_revoked(claims)
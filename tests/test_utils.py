@@ -0,0 +1,73 @@
+import asyncio
+
+from settings import settings
+from utils import (_get_async_engine, _get_engine, get_async_db_url,
+                   get_pool_stats, get_session, warm_up_pools)
+
+
+def test_engine_is_shared(test_session):
+    first_session = next(get_session())
+    second_session = next(get_session())
+    assert first_session.bind is second_session.bind
+    assert first_session.bind is _get_engine()
+
+
+def test_pool_stats(test_session):
+    engine = _get_engine()
+    before = get_pool_stats()['sync']
+    with engine.connect():
+        stats = get_pool_stats()['sync']
+        assert stats['checked_out'] == before['checked_out'] + 1
+    stats = get_pool_stats()['sync']
+    assert stats['checked_out'] == before['checked_out']
+    assert stats['checkouts'] == before['checkouts'] + 1
+    assert stats['wait_time_total'] >= before['wait_time_total']
+    assert set(stats) >= {'size', 'overflow', 'wait_time_avg'}
+
+
+def test_warm_up_pools(test_session):
+    asyncio.run(_get_async_engine().dispose())
+    asyncio.run(warm_up_pools(3))
+    stats = get_pool_stats()['async']
+    assert stats['checked_in'] == 3
+    assert stats['checked_out'] == 0
+
+
+def test_async_db_url(monkeypatch):
+    monkeypatch.setattr(settings, 'ASYNC_DB_URL', None)
+    monkeypatch.setattr(settings, 'DB_URL', 'sqlite:///db.sqlite3')
+    assert get_async_db_url() == 'sqlite+aiosqlite:///db.sqlite3'
+    monkeypatch.setattr(
+        settings, 'DB_URL', 'postgresql://user:pass@db:5432/easy_check'
+    )
+    assert get_async_db_url() == (
+        'postgresql+asyncpg://user:pass@db:5432/easy_check'
+    )
+
+
+def test_async_pool_stats(get_user, get_authorized_client):
+    user = get_user(username='test', email='test@test.com', password='test')
+    auth_client = get_authorized_client(user)
+    before = get_pool_stats()['async']
+    auth_client.get('/api/notes/search', params={'q': 'test'})
+    stats = get_pool_stats()['async']
+    assert stats['checkouts'] > before['checkouts']
+    assert stats['checked_out'] == 0
+
+
+def test_user_change_revokes_tokens(
+    test_session,
+    get_user,
+    get_authorized_client
+):
+    user = get_user(username='test', email='test@test.com', password='test')
+    auth_client = get_authorized_client(user)
+    assert auth_client.get('/api/notes/export').status_code == 403
+
+    user.is_admin = True
+    test_session.add(user)
+    test_session.commit()
+    assert auth_client.get('/api/notes/export').status_code == 401
+
+    auth_client = get_authorized_client(user)
+    assert auth_client.get('/api/notes/export').status_code == 200
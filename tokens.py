@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import hmac
+import json
+import math
+import time
+import uuid
+
+from cache import get_cache_backend
+from settings import settings
+
+TOKEN_ALGORITHM = 'HS256'
+REQUIRED_CLAIMS = {'id', 'username', 'is_admin', 'iat', 'exp', 'jti'}
+
+
+class TokenError(Exception):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def _sign(signing_input, secret):
+    return hmac.new(
+        secret.encode(), signing_input.encode(), hashlib.sha256
+    ).digest()
+
+
+_TOKEN_HEADER = _b64encode(_dumps({'alg': TOKEN_ALGORITHM, 'typ': 'JWT'}))
+
+
+def encode_token(claims, secret=None):
+    secret = secret or settings.SECRET_KEY
+    signing_input = f'{_TOKEN_HEADER}.{_b64encode(_dumps(claims))}'
+    signature = _b64encode(_sign(signing_input, secret))
+    return f'{signing_input}.{signature}'
+
+
+def decode_token(token, secret=None):
+    secret = secret or settings.SECRET_KEY
+    try:
+        header, payload, signature = token.split('.')
+        if json.loads(_b64decode(header)).get('alg') != TOKEN_ALGORITHM:
+            raise TokenError('Unsupported token algorithm')
+        expected_signature = _sign(f'{header}.{payload}', secret)
+        if not hmac.compare_digest(expected_signature, _b64decode(signature)):
+            raise TokenError('Invalid token signature')
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, AttributeError) as e:
+        raise TokenError('Malformed token') from e
+    if not isinstance(claims, dict) or not REQUIRED_CLAIMS <= claims.keys():
+        raise TokenError('Missing token claims')
+    if claims['exp'] <= time.time():
+        raise TokenError('Token expired')
+    return claims
+
+
+def create_access_token(user, ttl=None):
+    now = time.time()
+    claims = {
+        'sub': str(user.id),
+        'id': user.id,
+        'username': user.username,
+        'is_admin': user.is_admin,
+        # Шард заметок: перенос пользователя отзывает его токены
+        'shard': user.shard,
+        # Дробный iat, чтобы отзыв токенов пользователя не задевал токены,
+        # выданные в ту же секунду после отзыва
+        'iat': now,
+        'exp': math.ceil(now + (ttl or settings.ACCESS_TOKEN_TTL)),
+        'jti': uuid.uuid4().hex,
+    }
+    return encode_token(claims)
+
+
+class TokenDenyList:
+    # Записи живут не дольше самих токенов, поэтому список остается
+    # небольшим
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def revoke(self, claims):
+        ttl = max(1, math.ceil(claims['exp'] - time.time()))
+        self.backend.set(f'jti:{claims["jti"]}', True, ttl=ttl)
+
+    def revoke_user(self, user_id):
+        # Все токены пользователя, выданные до этого момента
+        self.backend.set(f'user:{user_id}', time.time())
+
+    def revoke_all(self):
+        self.backend.set('all', time.time())
+
+    def is_revoked(self, claims):
+        if self.backend.get(f'jti:{claims["jti"]}'):
+            return True
+        for key in (f'user:{claims["id"]}', 'all'):
+            revoked_at = self.backend.get(key)
+            if revoked_at is not None and claims['iat'] < revoked_at:
+                return True
+        return False
+
+
+token_denylist = TokenDenyList(
+    get_cache_backend(
+        settings.TOKEN_DENYLIST_URL,
+        prefix='denylist',
+        maxsize=settings.TOKEN_DENYLIST_MAXSIZE,
+        ttl=settings.ACCESS_TOKEN_TTL,
+        # Вытесненная запись снова сделала бы отозванный токен
+        # действительным
+        evict=False,
+    )
+)
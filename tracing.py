@@ -0,0 +1,252 @@
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from cache import get_cache_backend
+from settings import settings
+from utils import get_request_claims
+
+# Запрос админа с этим заголовком записывает все SQL-запросы. Краткая
+# сводка возвращается в том же заголовке ответа, полная трасса с планами
+# самых медленных запросов - по адресу /api/debug/traces/{id}
+DEBUG_TRACE_HEADER = 'X-Debug-Trace'
+DEBUG_TRACE_ID_HEADER = 'X-Debug-Trace-Id'
+EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete')
+PARAMETER_REPR_LENGTH = 100
+
+traces = get_cache_backend(
+    settings.QUERY_TRACE_URL,
+    prefix='trace',
+    maxsize=settings.QUERY_TRACE_MAXSIZE,
+    ttl=settings.QUERY_TRACE_TTL
+)
+
+
+class QueryTrace:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.queries = []
+
+    def summary(self):
+        repeated = sum(
+            1 for count in Counter(
+                query['statement'] for query in self.queries
+            ).values() if count > 1
+        )
+        db_time = sum(query['duration'] for query in self.queries)
+        return (
+            f'queries={len(self.queries)}; '
+            f'db_time={db_time * 1000:.1f}ms; repeated={repeated}'
+        )
+
+
+query_trace = ContextVar('query_trace', default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if query_trace.get() is not None:
+        context._trace_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    trace = query_trace.get()
+    if trace is None or not hasattr(context, '_trace_start'):
+        return
+    trace.queries.append({
+        'engine': conn.engine,
+        'statement': statement,
+        'parameters': parameters,
+        'executemany': executemany,
+        'duration': time.perf_counter() - context._trace_start,
+    })
+
+
+def listen_trace_events():
+    if not event.contains(
+        Engine, 'before_cursor_execute', _before_cursor_execute
+    ):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _format_parameters(parameters):
+    def _format(value):
+        value = repr(value)
+        if len(value) > PARAMETER_REPR_LENGTH:
+            value = value[:PARAMETER_REPR_LENGTH] + '...'
+        return value
+
+    if isinstance(parameters, dict):
+        return {key: _format(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_format(value) for value in parameters]
+    return _format(parameters)
+
+
+def _get_explain_statement(dialect, statement):
+    if dialect == 'sqlite':
+        return f'EXPLAIN QUERY PLAN {statement}'
+    if dialect == 'postgresql' and statement.lstrip().lower().startswith(
+        ('select', 'with')
+    ):
+        # ANALYZE выполняет запрос, поэтому только для чтения
+        return f'EXPLAIN (ANALYZE, BUFFERS) {statement}'
+    return f'EXPLAIN {statement}'
+
+
+def _get_plan(rows, dialect):
+    if dialect == 'sqlite':
+        # id, parent, notused, detail
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+def _explain_sync(engine, statement, parameters):
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(statement, parameters).all()
+        connection.rollback()
+    return rows
+
+
+async def _explain(query):
+    engine = query['engine']
+    dialect = engine.dialect.name
+    statement = _get_explain_statement(dialect, query['statement'])
+    if engine.dialect.is_async:
+        # Движок основной базы или реплики, на которой выполнялся запрос
+        async with AsyncEngine(engine).connect() as connection:
+            result = await connection.exec_driver_sql(
+                statement, query['parameters']
+            )
+            rows = result.all()
+            await connection.rollback()
+    else:
+        rows = await run_in_threadpool(
+            _explain_sync, engine, statement, query['parameters']
+        )
+    return _get_plan(rows, dialect)
+
+
+async def _explain_slowest(queries, limit):
+    slowest = {}
+    for query in queries:
+        if query['executemany'] or not query['statement'].lstrip().lower(
+        ).startswith(EXPLAINABLE):
+            continue
+        current = slowest.get(query['statement'])
+        if current is None or current['duration'] < query['duration']:
+            slowest[query['statement']] = query
+    plans = []
+    for query in sorted(
+        slowest.values(), key=lambda query: query['duration'], reverse=True
+    )[:limit]:
+        try:
+            plan = await _explain(query)
+        except Exception as e:
+            plan = [f'EXPLAIN failed: {e}']
+        plans.append({
+            'statement': query['statement'],
+            'duration_ms': query['duration'] * 1000,
+            'plan': plan,
+        })
+    return plans
+
+
+async def build_trace_report(trace, request, status, duration):
+    statements = Counter(query['statement'] for query in trace.queries)
+    identical = Counter(
+        (query['statement'], repr(query['parameters']))
+        for query in trace.queries
+    )
+    return {
+        'id': trace.id,
+        'method': request['method'],
+        'path': request['path'],
+        'status': status,
+        'duration_ms': duration * 1000,
+        'db_time_ms': sum(
+            query['duration'] for query in trace.queries
+        ) * 1000,
+        'queries': [
+            {
+                'statement': query['statement'],
+                'parameters': _format_parameters(query['parameters']),
+                'duration_ms': query['duration'] * 1000,
+            }
+            for query in trace.queries
+        ],
+        # Один и тот же текст запроса несколько раз - кандидат на N+1,
+        # полностью одинаковые запросы можно не повторять
+        'repeated': [
+            {
+                'statement': statement,
+                'count': count,
+                'identical': max(
+                    identical_count
+                    for (identical_statement, _), identical_count
+                    in identical.items()
+                    if identical_statement == statement
+                ),
+            }
+            for statement, count in statements.items() if count > 1
+        ],
+        'explain': await _explain_slowest(
+            trace.queries, settings.QUERY_TRACE_EXPLAIN
+        ),
+    }
+
+
+def _is_admin_request(scope):
+    headers = Headers(scope=scope)
+    if DEBUG_TRACE_HEADER not in headers:
+        return False
+    claims = get_request_claims(headers)
+    return claims is not None and claims['is_admin']
+
+
+class QueryTraceMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not settings.QUERY_TRACE_ENABLED or \
+                not _is_admin_request(scope):
+            await self.app(scope, receive, send)
+            return
+        listen_trace_events()
+        trace = QueryTrace()
+        token = query_trace.set(trace)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message.setdefault('headers', [])
+                message['headers'] = [
+                    *message['headers'],
+                    (DEBUG_TRACE_HEADER.encode(), trace.summary().encode()),
+                    (DEBUG_TRACE_ID_HEADER.encode(), trace.id.encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            query_trace.reset(token)
+        # EXPLAIN выполняется вне трассы, его запросы в нее не попадают
+        traces.set(
+            trace.id,
+            await build_trace_report(trace, scope, status, duration)
+        )
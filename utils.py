@@ -1,22 +1,380 @@
-import json
-from base64 import b64decode, b64encode
+import asyncio
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import cache, partial
 from typing import Annotated
 
-from fastapi import Depends, HTTPException, status
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlmodel import Session, SQLModel, create_engine, select
+from sqlalchemy import event, make_url, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from sqlmodel import Session, create_engine, false
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from cache import get_cache_backend
 from settings import settings
+from tokens import (TokenError, create_access_token, decode_token,
+                    token_denylist)
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+READ_METHODS = ('GET', 'HEAD')
+STICKY_USER_KEY = 'replica_sticky_user_id'
+REPLICA_SESSION_KEY = 'replica'
+# Ключ pg_advisory_lock на время миграций
+SCHEMA_LOCK_KEY = 7_354_201
+
+
+class _TimedPoolMixin:
+    # Считаем, сколько времени запросы ждут соединение из пула
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self._checkouts += 1
+                self._wait_time += elapsed
+                self._max_wait_time = max(self._max_wait_time, elapsed)
+
+    def stats(self):
+        with self._stats_lock:
+            checkouts = self._checkouts
+            wait_time = self._wait_time
+            max_wait_time = self._max_wait_time
+        return {
+            'size': self.size(),
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+            'checkouts': checkouts,
+            'wait_time_total': wait_time,
+            'wait_time_avg': wait_time / checkouts if checkouts else 0.0,
+            'wait_time_max': max_wait_time,
+        }
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def get_async_db_url():
+    if settings.ASYNC_DB_URL:
+        return settings.ASYNC_DB_URL
+    return _to_async_db_url(settings.DB_URL)
+
+
+def _to_async_db_url(db_url):
+    url = make_url(db_url)
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name())
+    if drivername is None:
+        raise ValueError(
+            f'No async driver for {url.get_backend_name()}, '
+            'set ASYNC_DB_URL explicitly'
+        )
+    return url.set(drivername=drivername).render_as_string(
+        hide_password=False
+    )
+
+
+def _get_engine_options(db_url, poolclass=TimedQueuePool):
+    options = {
+        'pool_pre_ping': settings.DB_POOL_PRE_PING,
+        'pool_recycle': settings.DB_POOL_RECYCLE,
+    }
+    url = make_url(db_url)
+    if url.get_backend_name() == 'sqlite' and url.database in (
+        None, '', ':memory:'
+    ):
+        # In-memory SQLite живет в одном соединении, пул ему не нужен
+        return options
+    options.update(
+        poolclass=poolclass,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+    )
+    return options
+
+
+@cache
 def _get_engine():
-    engine = create_engine(settings.DB_URL)
+    # Один engine (и один пул соединений) на процесс
+    engine = create_engine(
+        settings.DB_URL, **_get_engine_options(settings.DB_URL)
+    )
     return engine
 
 
+def _create_async_engine(db_url):
+    return create_async_engine(
+        db_url,
+        **_get_engine_options(db_url, poolclass=TimedAsyncQueuePool)
+    )
+
+
+@cache
+def _get_async_engine():
+    return _create_async_engine(get_async_db_url())
+
+
+def _get_pool_stats(pool):
+    if isinstance(pool, _TimedPoolMixin):
+        return pool.stats()
+    return {'status': pool.status()}
+
+
+def _get_pool_load(pool):
+    if isinstance(pool, _TimedPoolMixin):
+        return pool.checkedout()
+    return 0
+
+
+class ReplicaSet:
+    # Из здоровых реплик выбирается наименее загруженная по числу занятых
+    # соединений, при равенстве - по кругу. Реплика, к которой не удалось
+    # подключиться, исключается на retry_interval секунд
+
+    def __init__(self, urls, retry_interval=None):
+        self.urls = list(urls)
+        self.retry_interval = (
+            retry_interval if retry_interval is not None
+            else settings.DB_REPLICA_RETRY_INTERVAL
+        )
+        self._engines = {}
+        self._failed_until = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _get_engine(self, url):
+        with self._lock:
+            engine = self._engines.get(url)
+            if engine is None:
+                engine = _create_async_engine(_to_async_db_url(url))
+                event.listen(
+                    engine.sync_engine, 'handle_error',
+                    partial(self._handle_error, url)
+                )
+                self._engines[url] = engine
+        return engine
+
+    def _handle_error(self, url, context):
+        # Ошибка установки соединения или разрыв уже открытого
+        if context.connection is None or context.is_disconnect:
+            self.mark_failed(url)
+
+    def mark_failed(self, url):
+        self._failed_until[url] = time.monotonic() + self.retry_interval
+
+    def get_healthy_urls(self):
+        now = time.monotonic()
+        return [
+            url for url in self.urls
+            if self._failed_until.get(url, 0) <= now
+        ]
+
+    def get_engine(self):
+        urls = self.get_healthy_urls()
+        if not urls:
+            return None
+        start = next(self._counter) % len(urls)
+        urls = urls[start:] + urls[:start]
+        return min(
+            (self._get_engine(url) for url in urls),
+            key=lambda engine: _get_pool_load(engine.pool)
+        )
+
+    def get_all_engines(self):
+        return [self._get_engine(url) for url in self.urls]
+
+    def stats(self):
+        return {
+            f'replica{index}': _get_pool_stats(self._engines[url].pool)
+            for index, url in enumerate(self.urls) if url in self._engines
+        }
+
+    async def dispose(self):
+        for engine in list(self._engines.values()):
+            await engine.dispose()
+
+
+class ShardSet:
+    # Заметки пользователя живут на одном шарде (User.shard). Шард 0 -
+    # основная база, в ней же таблица пользователей, остальные шарды
+    # задаются DB_SHARD_URLS
+
+    def __init__(self, urls):
+        self.urls = list(urls)
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.urls) + 1
+
+    def get_url(self, shard):
+        return settings.DB_URL if shard == 0 else self.urls[shard - 1]
+
+    def get_engine(self, shard):
+        if shard == 0:
+            return _get_async_engine()
+        url = self.urls[shard - 1]
+        with self._lock:
+            engine = self._engines.get(url)
+            if engine is None:
+                engine = self._engines[url] = _create_async_engine(
+                    _to_async_db_url(url)
+                )
+        return engine
+
+    def stats(self):
+        return {
+            f'shard{index}': _get_pool_stats(self._engines[url].pool)
+            for index, url in enumerate(self.urls, 1) if url in self._engines
+        }
+
+    async def dispose(self):
+        for engine in list(self._engines.values()):
+            await engine.dispose()
+        self._engines.clear()
+
+
+read_replicas = ReplicaSet(settings.DB_REPLICA_URLS)
+shards = ShardSet(settings.DB_SHARD_URLS)
+# Пользователи, недавно писавшие в основную базу: их чтения не идут на
+# реплики, пока те могут отставать
+replica_stickiness = get_cache_backend(
+    settings.DB_REPLICA_STICKY_URL,
+    prefix='sticky',
+    maxsize=settings.DB_REPLICA_STICKY_MAXSIZE,
+    ttl=settings.DB_REPLICA_STICKINESS,
+)
+
+
+def get_pool_stats():
+    return {
+        'sync': _get_pool_stats(_get_engine().pool),
+        'async': _get_pool_stats(_get_async_engine().pool),
+        **read_replicas.stats(),
+        **shards.stats(),
+    }
+
+
+def get_alembic_config(db_url=None):
+    config = Config(os.path.join(BASE_DIR, 'alembic.ini'))
+    config.set_main_option(
+        'sqlalchemy.url', (db_url or settings.DB_URL).replace('%', '%%')
+    )
+    # Не перенастраиваем логирование приложения из env.py
+    config.attributes['configure_logger'] = False
+    return config
+
+
+def _get_current_heads(connection):
+    heads = set(MigrationContext.configure(connection).get_current_heads())
+    connection.commit()
+    return heads
+
+
+@contextmanager
+def _schema_lock(connection):
+    # Миграции одной базы выполняет один процесс, остальные ждут
+    url = connection.engine.url
+    if url.get_backend_name() == 'postgresql':
+        connection.execute(
+            text('SELECT pg_advisory_lock(:key)'), {'key': SCHEMA_LOCK_KEY}
+        )
+        connection.commit()
+        try:
+            yield
+        finally:
+            connection.execute(
+                text('SELECT pg_advisory_unlock(:key)'),
+                {'key': SCHEMA_LOCK_KEY}
+            )
+            connection.commit()
+    elif url.get_backend_name() == 'sqlite' and fcntl is not None and \
+            url.database not in (None, '', ':memory:'):
+        with open(f'{url.database}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+    else:
+        yield
+
+
+def upgrade_schema(db_url):
+    # Версия схемы хранится alembic в alembic_version. Если она совпадает
+    # с головной ревизией миграций, достаточно одного SELECT без загрузки
+    # env.py и сравнения схемы. Возвращает True, если миграции применялись
+    config = get_alembic_config(db_url)
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+    engine = create_engine(db_url, poolclass=NullPool)
+    try:
+        with engine.connect() as connection:
+            if _get_current_heads(connection) == heads:
+                return False
+            with _schema_lock(connection):
+                # Пока ждали блокировку, схему мог обновить другой процесс
+                if _get_current_heads(connection) == heads:
+                    return False
+                config.attributes['connection'] = connection
+                command.upgrade(config, 'head')
+                connection.commit()
+                return True
+    finally:
+        engine.dispose()
+
+
 def create_db_and_tables():
-    engine = _get_engine()
-    SQLModel.metadata.create_all(engine)
+    for shard in range(len(shards)):
+        upgrade_schema(shards.get_url(shard))
+
+
+async def _warm_up_engine(engine, size):
+    # Соединения открываются одновременно, иначе пул отдавал бы одно и то же
+    connections = await asyncio.gather(
+        *(engine.connect().start() for _ in range(size))
+    )
+    await asyncio.gather(*(connection.close() for connection in connections))
+
+
+async def warm_up_pools(size):
+    # Соединения с основной базой, шардами и репликами открываются до
+    # первого запроса, а не во время него
+    size = min(size, settings.DB_POOL_SIZE)
+    engines = [shards.get_engine(shard) for shard in range(len(shards))]
+    engines.extend(read_replicas.get_all_engines())
+    await asyncio.gather(
+        *(_warm_up_engine(engine, size) for engine in engines)
+    )
 
 
 def get_session():
@@ -25,7 +383,77 @@ def get_session():
         yield session
 
 
+def create_async_session(engine=None):
+    return AsyncSession(
+        engine or _get_async_engine(), expire_on_commit=False
+    )
+
+
+def get_request_claims(headers):
+    # Необязательная аутентификация: claims действующего токена или None
+    scheme, _, token = headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    try:
+        claims = decode_token(token)
+    except TokenError:
+        return None
+    if token_denylist.is_revoked(claims):
+        return None
+    return claims
+
+
+def _get_read_engine(user_id):
+    if user_id is not None and replica_stickiness.get(f'user:{user_id}'):
+        return None
+    return read_replicas.get_engine()
+
+
+@event.listens_for(Session, 'after_commit')
+def _stick_to_primary(session):
+    user_id = session.info.get(STICKY_USER_KEY)
+    if user_id is not None and settings.DB_REPLICA_STICKINESS:
+        replica_stickiness.set(f'user:{user_id}', True)
+
+
+def get_cache_ttl(session):
+    # Ответ, прочитанный с реплики, мог отстать от основной базы:
+    # кешируем его не дольше окна, в котором реплика считается отстающей
+    if session.info.get(REPLICA_SESSION_KEY):
+        return settings.DB_REPLICA_STICKINESS or None
+    return None
+
+
+@asynccontextmanager
+async def open_request_session(request, user_id=None, shard=0):
+    # Чтения основной базы идут на реплику, если пользователь недавно
+    # не писал сам
+    replica = None
+    if shard == 0 and read_replicas.urls and request.method in READ_METHODS:
+        replica = _get_read_engine(user_id)
+    async with create_async_session(
+        replica or shards.get_engine(shard)
+    ) as session:
+        if replica is not None:
+            session.info[REPLICA_SESSION_KEY] = True
+        if user_id is not None and read_replicas.urls and \
+                request.method not in READ_METHODS:
+            # После COMMIT чтения пользователя идут в основную базу
+            session.info[STICKY_USER_KEY] = user_id
+        yield session
+
+
+async def get_async_session(request: Request):
+    user_id = None
+    if read_replicas.urls:
+        claims = get_request_claims(request.headers)
+        user_id = claims['id'] if claims is not None else None
+    async with open_request_session(request, user_id) as session:
+        yield session
+
+
 SessionDep = Annotated[Session, Depends(get_session)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
 
@@ -35,33 +463,57 @@ def get_user_model():
 
 
 def get_subject(user):
-    payload = {'id': user.id, 'username': user.username}
-    subject = b64encode(json.dumps(payload).encode()).decode()
-    return subject
+    return create_access_token(user)
 
 
-async def get_current_user(
-    session: SessionDep,
-    token: Annotated[str, Depends(oauth2_scheme)]
-):
+async def get_token_claims(token: Annotated[str, Depends(oauth2_scheme)]):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    payload = json.loads(
-        b64decode(token)
-    )
-    user_id = payload.get('id')
-    username = payload.get('username')
+    try:
+        claims = decode_token(token)
+    except TokenError:
+        raise credentials_exception
+    if token_denylist.is_revoked(claims):
+        raise credentials_exception
+    return claims
+
+
+async def get_current_user(
+    claims: Annotated[dict, Depends(get_token_claims)]
+):
+    # Подписанному токену доверяем без похода в БД
     user_model = get_user_model()
-    user_query = select(user_model).filter(
-        user_model.id == user_id,
-        user_model.username == username
+    return user_model(
+        id=claims['id'],
+        username=claims['username'],
+        is_admin=claims['is_admin'],
+        # Токены, выданные до шардирования, - пользователи основной базы
+        shard=claims.get('shard', 0),
     )
-    result = session.exec(user_query)
-    session.commit()
-    user = result.one_or_none()
-    if user is None:
-        raise credentials_exception
-    return user
+
+
+def get_note_filters(note_id, current_user):
+    # Пользователь видит только свои неудаленные заметки, админ - все
+    from models import Note
+    if current_user.is_admin:
+        return [Note.id == note_id]
+    return [
+        Note.id == note_id,
+        Note.user_id == current_user.id,
+        Note.is_deleted == false()
+    ]
+
+
+def etag_matches(header, etag, weak=False):
+    # Проверка If-Match/If-None-Match, weak - сравнение без префикса W/
+    if header is None:
+        return False
+    if header.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in header.split(',')]
+    if weak:
+        tags = [tag.removeprefix('W/') for tag in tags]
+    return etag in tags